@@ -0,0 +1,266 @@
+#
+# aggregates.py
+#
+# Per-user aggregate Benford statistics. Every completed job's
+# digit histogram is added into one row per (userid, period) in
+# the userstats table, where period is 'all' or the month the
+# job completed ('YYYY-MM'). The portfolio-level fit of a user
+# is then a single-row read instead of downloading every results
+# file of every job.
+#
+# The userstatsjobs table records which jobs have been added, so
+# a job is never counted twice (duplicate events, backfill runs).
+#
+# Usage:
+#   python3 aggregates.py create               -- create the tables
+#   python3 aggregates.py backfill             -- add existing jobs
+#   python3 aggregates.py show userid [period] -- print a user's fit
+#
+
+import datatier
+import benford
+import compression
+import datetime
+import sys
+import uuid
+
+
+CREATE_TABLES = [
+  """
+  CREATE TABLE IF NOT EXISTS userstats (
+    userid    int NOT NULL,
+    period    varchar(8) NOT NULL,
+    numjobs   int NOT NULL DEFAULT 0,
+    numpages  bigint NOT NULL DEFAULT 0,
+    count0    bigint NOT NULL DEFAULT 0,
+    count1    bigint NOT NULL DEFAULT 0,
+    count2    bigint NOT NULL DEFAULT 0,
+    count3    bigint NOT NULL DEFAULT 0,
+    count4    bigint NOT NULL DEFAULT 0,
+    count5    bigint NOT NULL DEFAULT 0,
+    count6    bigint NOT NULL DEFAULT 0,
+    count7    bigint NOT NULL DEFAULT 0,
+    count8    bigint NOT NULL DEFAULT 0,
+    count9    bigint NOT NULL DEFAULT 0,
+    PRIMARY KEY (userid, period)
+  );
+  """,
+  """
+  CREATE TABLE IF NOT EXISTS userstatsjobs (
+    jobid     int NOT NULL,
+    token     varchar(36) NOT NULL,
+    PRIMARY KEY (jobid)
+  );
+  """
+]
+
+COUNT_COLUMNS = ", ".join(f"count{i}" for i in range(10))
+
+#
+# adds a job into the 'all' and the monthly row of its user, but
+# only if this transaction is the one that recorded the job in
+# userstatsjobs (the token matches):
+#
+ADD_JOB_SQL = f"""
+  INSERT INTO userstats (userid, period, numjobs, numpages, {COUNT_COLUMNS})
+    SELECT %s, p.period, 1, %s, {", ".join(["%s"] * 10)}
+      FROM userstatsjobs j
+      JOIN (SELECT 'all' AS period UNION ALL SELECT %s) p
+     WHERE j.jobid = %s AND j.token = %s
+  ON DUPLICATE KEY UPDATE
+    numjobs = numjobs + VALUES(numjobs),
+    numpages = numpages + VALUES(numpages),
+    {", ".join(f"count{i} = count{i} + VALUES(count{i})" for i in range(10))};
+"""
+
+
+def current_period():
+  """
+  Returns the period ('YYYY-MM', UTC) a job completing now counts in.
+  """
+  return datetime.datetime.now(datetime.timezone.utc).strftime("%Y-%m")
+
+
+###################################################################
+#
+# job_actions
+#
+def job_actions(jobid, userid, number_of_pages, digit_count, period):
+  """
+  Returns the action queries that add one job's histogram into
+  its user's aggregates; execute them with datatier.perform_actions,
+  ideally in the same transaction that marks the job completed
+
+  Parameters
+  ----------
+  jobid: the job's id,
+  userid: the job's user,
+  number_of_pages: pages in the job's document,
+  digit_count: dict of digit ('0'..'9') -> count,
+  period: month the job counts in ('YYYY-MM')
+
+  Returns
+  -------
+  list of (sql, parameters) tuples
+  """
+  token = str(uuid.uuid4())
+  counts = [digit_count.get(str(i), 0) for i in range(10)]
+
+  return [
+    ("INSERT IGNORE INTO userstatsjobs (jobid, token) VALUES (%s, %s);", [jobid, token]),
+    (ADD_JOB_SQL, [userid, number_of_pages] + counts + [period, jobid, token])
+  ]
+
+
+###################################################################
+#
+# completion_actions
+#
+def completion_actions(dbConn, datafilekey, number_of_pages, digit_count):
+  """
+  Looks up the job for datafilekey and returns the action queries
+  that add its histogram into its user's aggregates
+
+  Parameters
+  ----------
+  dbConn: the database connection,
+  datafilekey: bucketkey of the job's PDF,
+  number_of_pages: pages in the job's document,
+  digit_count: dict of digit ('0'..'9') -> count
+
+  Returns
+  -------
+  list of (sql, parameters) tuples, empty if there is no such job
+  """
+  sql = "SELECT jobid, userid FROM jobs WHERE datafilekey = %s;"
+  row = datatier.retrieve_one_row(dbConn, sql, [datafilekey])
+
+  if row == ():
+    return []
+
+  return job_actions(row[0], row[1], number_of_pages, digit_count, current_period())
+
+
+###################################################################
+#
+# get_user_stats
+#
+def get_user_stats(dbConn, userid, period="all"):
+  """
+  Returns a user's aggregate statistics and Benford fit
+
+  Parameters
+  ----------
+  dbConn: the database connection,
+  userid: the user,
+  period: 'all' or a month ('YYYY-MM')
+
+  Returns
+  -------
+  dict with numjobs, numpages, digit_count and fit (see
+  benford.fit), or None if the user has no completed jobs
+  """
+  sql = f"SELECT numjobs, numpages, {COUNT_COLUMNS} FROM userstats WHERE userid = %s AND period = %s;"
+  row = datatier.retrieve_one_row(dbConn, sql, [userid, period])
+
+  if row == ():
+    return None
+
+  digit_count = {str(i): int(row[2 + i]) for i in range(10)}
+
+  return {
+    'numjobs': int(row[0]),
+    'numpages': int(row[1]),
+    'digit_count': digit_count,
+    'fit': benford.fit(digit_count)
+  }
+
+
+###################################################################
+#
+# backfill
+#
+def backfill(dbConn, storage):
+  """
+  Adds every completed job that is not yet in the aggregates,
+  reading its histogram from its results file in storage. The
+  period is the month the results file was written.
+
+  Parameters
+  ----------
+  dbConn: the database connection,
+  storage: storage.Storage holding the results files
+
+  Returns
+  -------
+  (number of jobs added, number of jobs skipped)
+  """
+  sql = """
+    SELECT jobid, userid, resultsfilekey FROM jobs
+     WHERE status = 'completed'
+       AND jobid NOT IN (SELECT jobid FROM userstatsjobs)
+     ORDER BY jobid;
+  """
+  rows = datatier.retrieve_all_rows(dbConn, sql)
+
+  added = 0
+  skipped = 0
+
+  for (jobid, userid, resultsfilekey) in rows:
+    try:
+      (data, modified) = storage.read(resultsfilekey)
+      text = compression.sniff_decompress(data).decode("utf-8")
+      (number_of_pages, digit_count) = benford.parse_results(text)
+    except Exception as err:
+      print("job", jobid, "skipped:", str(err))
+      skipped += 1
+      continue
+
+    period = modified.strftime("%Y-%m")
+
+    datatier.perform_actions(dbConn, job_actions(jobid, userid, number_of_pages, digit_count, period))
+    added += 1
+
+  return (added, skipped)
+
+
+if __name__ == "__main__":
+  from configparser import ConfigParser
+  import os
+  import storage
+
+  if len(sys.argv) < 2 or sys.argv[1] not in ["create", "backfill", "show"]:
+    print("usage: python3 aggregates.py create | backfill | show userid [period]")
+    sys.exit(0)
+
+  config_file = 'benfordapp-config.ini'
+  os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+  configur = ConfigParser()
+  configur.read(config_file)
+
+  dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                               int(configur.get('rds', 'port_number')),
+                               configur.get('rds', 'user_name'),
+                               configur.get('rds', 'user_pwd'),
+                               configur.get('rds', 'db_name'))
+
+  if sys.argv[1] == "create":
+    datatier.perform_actions(dbConn, [(sql, []) for sql in CREATE_TABLES])
+    print("tables created")
+
+  elif sys.argv[1] == "backfill":
+    (added, skipped) = backfill(dbConn, storage.make_storage(configur))
+    print(added, "jobs added,", skipped, "skipped")
+
+  else:
+    userid = int(sys.argv[2])
+    period = sys.argv[3] if len(sys.argv) > 3 else "all"
+    stats = get_user_stats(dbConn, userid, period)
+    if stats is None:
+      print("no statistics for user", userid, "in period", period)
+    else:
+      print(stats['numjobs'], "jobs,", stats['numpages'], "pages")
+      for (digit, count) in stats['digit_count'].items():
+        print(digit, count)
+      print(f"chi-square {stats['fit']['chisq']:.2f}, MAD {stats['fit']['mad']:.4f}")
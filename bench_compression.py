@@ -0,0 +1,72 @@
+#
+# bench_compression.py
+#
+# Measures what compressed transport saves, without a server:
+#
+#   python3 bench_compression.py [PDF] [MBITS]
+#
+# For the upload request body of PDF (default update09.pdf), a
+# synthetic /jobs listing of 1,000 jobs, and a results file, prints
+# the bytes on the wire for each content encoding, the time to
+# compress and decompress, and the estimated total time at MBITS
+# megabits per second (default 20).
+#
+
+import base64
+import json
+import sys
+import time
+
+import compression
+
+
+def _measure(name, payload, mbits):
+  print(f"**{name}: {len(payload)} bytes uncompressed**")
+  print(f"{'encoding':<10} {'bytes':>10} {'ratio':>7} {'comp ms':>8} {'decomp ms':>10} {'total ms':>9}")
+
+  for encoding in ["none"] + compression.available_encodings():
+    start = time.perf_counter()
+    body = compression.compress(payload, encoding)
+    compress_secs = time.perf_counter() - start
+
+    start = time.perf_counter()
+    compression.decompress(body, encoding)
+    decompress_secs = time.perf_counter() - start
+
+    transfer_secs = len(body) * 8 / (mbits * 1000000)
+    total_ms = 1000 * (compress_secs + transfer_secs + decompress_secs)
+
+    print(f"{encoding:<10} {len(body):10} {len(body) / len(payload):7.3f} "
+          f"{1000 * compress_secs:8.1f} {1000 * decompress_secs:10.1f} {total_ms:9.1f}")
+  print()
+
+
+if __name__ == "__main__":
+  pdf = sys.argv[1] if len(sys.argv) > 1 else "update09.pdf"
+  mbits = float(sys.argv[2]) if len(sys.argv) > 2 else 20.0
+
+  #
+  # the body main.upload sends:
+  #
+  with open(pdf, "rb") as infile:
+    datastr = base64.b64encode(infile.read()).decode("utf-8")
+  upload_body = json.dumps({"filename": pdf, "data": datastr}).encode("utf-8")
+
+  _measure(f"upload of {pdf}", upload_body, mbits)
+
+  #
+  # a /jobs response, rows as returned by the web service:
+  #
+  rows = [[jobid, 80001 + jobid % 7, "completed", f"report{jobid:04}.pdf",
+           f"benfordapp/user{jobid % 7}/{jobid:08x}-4e0c-9b6e.pdf",
+           f"benfordapp/user{jobid % 7}/{jobid:08x}-4e0c-9b6e.txt"]
+          for jobid in range(1001, 2001)]
+  _measure("/jobs listing of 1000 jobs", json.dumps(rows).encode("utf-8"), mbits)
+
+  #
+  # a results file is ~100 bytes, which compression only grows;
+  # lambda_function leaves files below [s3] compress_min_bytes
+  # uncompressed:
+  #
+  results = "**RESULTS**\n28 pages\n" + "".join(f"{d} {c}\n" for (d, c) in enumerate([0, 595, 373, 255, 179, 223, 177, 178, 163, 121]))
+  _measure("results file", results.encode("utf-8"), mbits)
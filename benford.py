@@ -0,0 +1,225 @@
+#
+# benford.py
+#
+# Benford's Law engine shared by the lambda function, the client's
+# local analysis mode and the tools around them: tallying the first
+# significant digit of the numeric values in a PDF, the expected
+# first-digit frequencies, fit statistics for a digit histogram,
+# and writing / parsing the results file format.
+#
+# https://en.wikipedia.org/wiki/Benford%27s_law
+#
+
+import math
+import string
+
+
+#
+# expected frequency of each first significant digit 1..9:
+#
+EXPECTED = {str(d): math.log10(1 + 1 / d) for d in range(1, 10)}
+
+_strip_punctuation = str.maketrans('', '', string.punctuation)
+
+
+def new_digit_count():
+  """
+  Returns an empty histogram: dict of digit ('0'..'9') -> 0.
+  """
+  return {str(i): 0 for i in range(10)}
+
+
+###################################################################
+#
+# tally_text
+#
+# Splits text into words, and for each word that is a numeric
+# value (once punctuation is removed) counts its first non-zero
+# digit.
+#
+# TALLY_VERSION names the rule; histograms kept across jobs (see
+# pagecache.py) are only reused under the version they were made
+# with, so change it whenever the rule (or the text extraction it
+# depends on) changes.
+#
+TALLY_VERSION = "tally-1"
+
+def tally_text(text, digit_count):
+  """
+  Adds the first significant digits of the numeric words in text
+  to digit_count
+
+  Parameters
+  ----------
+  text: the text to tally,
+  digit_count: dict of digit ('0'..'9') -> count, updated in place
+
+  Returns
+  -------
+  the number of words in text
+  """
+  words = text.split()
+
+  for word in words:
+    word = word.translate(_strip_punctuation)
+    if word.isnumeric():
+      for digit in word:
+        if digit != '0':
+          if digit in digit_count:
+            digit_count[digit] += 1
+          break  # Stop once the first non-zero digit is found
+
+  return len(words)
+
+
+def _tally_pages(local_pdf, first, last):
+  """
+  Tallies pages [first, last) of a PDF; runs in a worker process.
+  """
+  from pypdf import PdfReader
+
+  reader = PdfReader(local_pdf)
+  digit_count = new_digit_count()
+
+  for i in range(first, last):
+    tally_text(reader.pages[i].extract_text(), digit_count)
+
+  return digit_count
+
+
+###################################################################
+#
+# analyze_pdf
+#
+def analyze_pdf(local_pdf, workers=1, pages_per_worker=8):
+  """
+  Tallies the first significant digits of all the numeric values
+  in a local PDF, the same way lambda_function does
+
+  Parameters
+  ----------
+  local_pdf: path of the PDF,
+  workers: number of processes to spread the pages over,
+  pages_per_worker: fewer pages than this per process are not
+    worth starting a process for
+
+  Returns
+  -------
+  (number of pages, dict of digit -> count)
+  """
+  from pypdf import PdfReader
+
+  reader = PdfReader(local_pdf)
+  number_of_pages = len(reader.pages)
+
+  workers = max(1, min(workers, number_of_pages // pages_per_worker))
+
+  if workers == 1:
+    digit_count = new_digit_count()
+    for page in reader.pages:
+      tally_text(page.extract_text(), digit_count)
+    return (number_of_pages, digit_count)
+
+  #
+  # split the pages into one contiguous range per process:
+  #
+  from concurrent.futures import ProcessPoolExecutor
+
+  bounds = [number_of_pages * w // workers for w in range(workers + 1)]
+
+  digit_count = new_digit_count()
+
+  with ProcessPoolExecutor(max_workers=workers) as executor:
+    futures = [executor.submit(_tally_pages, local_pdf, bounds[w], bounds[w + 1])
+               for w in range(workers)]
+    for future in futures:
+      for (digit, count) in future.result().items():
+        digit_count[digit] += count
+
+  return (number_of_pages, digit_count)
+
+
+###################################################################
+#
+# format_results
+#
+def format_results(number_of_pages, digit_count, unit="pages"):
+  """
+  Returns the contents of a results file (see parse_results); unit
+  names what was counted ("rows" / "lines" for ledgers).
+  """
+  lines = ["**RESULTS**\n", f"{number_of_pages} {unit}\n"]
+  # each digit count on a new line
+  for (digit, count) in digit_count.items():
+    lines.append(f"{digit} {count}\n")
+  return "".join(lines)
+
+
+###################################################################
+#
+# fit
+#
+def fit(digit_count):
+  """
+  Computes how well a first-digit histogram follows Benford's Law
+
+  Parameters
+  ----------
+  digit_count: dict of digit ('0'..'9') -> count; '0' is ignored
+
+  Returns
+  -------
+  dict with total (number of first digits), chisq (chi-square
+  statistic, 8 degrees of freedom), mad (mean absolute deviation
+  of the frequencies) and freqs (dict of digit -> frequency)
+  """
+  total = sum(digit_count.get(d, 0) for d in EXPECTED)
+
+  if total == 0:
+    return {'total': 0, 'chisq': 0.0, 'mad': 0.0, 'freqs': {d: 0.0 for d in EXPECTED}}
+
+  freqs = {d: digit_count.get(d, 0) / total for d in EXPECTED}
+
+  chisq = sum((digit_count.get(d, 0) - total * p) ** 2 / (total * p) for (d, p) in EXPECTED.items())
+  mad = sum(abs(freqs[d] - p) for (d, p) in EXPECTED.items()) / len(EXPECTED)
+
+  return {'total': total, 'chisq': chisq, 'mad': mad, 'freqs': freqs}
+
+
+###################################################################
+#
+# parse_results
+#
+def parse_results(text):
+  """
+  Parses the contents of a results file written by lambda_function:
+
+    **RESULTS**
+    <n> pages        (or "<n> rows" / "<n> lines" for ledgers)
+    0 <count>
+    ...
+    9 <count>
+
+  Parameters
+  ----------
+  text: contents of the results file (string)
+
+  Returns
+  -------
+  (number of pages, dict of digit -> count); raises ValueError
+  if the text is not a results file (e.g. an error message)
+  """
+  lines = text.strip().splitlines()
+
+  if len(lines) < 2 or lines[0].strip() != "**RESULTS**":
+    raise ValueError("not a results file")
+
+  number_of_pages = int(lines[1].split()[0])
+
+  digit_count = {str(i): 0 for i in range(10)}
+  for line in lines[2:]:
+    fields = line.split()
+    if len(fields) == 2 and fields[0] in digit_count:
+      digit_count[fields[0]] = int(fields[1])
+
+  return (number_of_pages, digit_count)
@@ -0,0 +1,262 @@
+#
+# clientmetrics.py
+#
+# Client-side metrics of the web service calls made by main.py, per
+# endpoint: a latency histogram, counts per status code, retries,
+# failed calls (no response), and bytes sent and received. URLs are
+# reduced to their route, so every job counts as /results/{jobid};
+# long polls (?wait=...) are kept apart as their own endpoint, since
+# they are slow on purpose.
+#
+# main.py dumps them at exit when configured:
+#
+#   [client]
+#   metrics = none           (default)
+#   metrics = report         a table per endpoint
+#   metrics = prometheus     Prometheus text exposition format
+#   metrics_file = ...       write there instead of printing
+#
+
+import bisect
+import threading
+import time
+import urllib.parse
+
+import requests
+
+
+#
+# upper bounds of the latency buckets, in seconds (the last one is
+# +Inf):
+#
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0]
+
+#
+# routes of the web service; a path is matched segment by segment,
+# "{...}" matching any one segment:
+#
+ROUTES = [
+  "/users",
+  "/jobs",
+  "/reset",
+  "/pdf/{userid}",
+  "/results/{jobid}",
+  "/results",
+  "/stats",
+  "/lookup/{userid}/{hash}",
+]
+
+
+def endpoint_of(url):
+  """
+  Returns the route of a URL, e.g. /results/{jobid} for
+  https://.../prod/results/1003; a long poll gets " (long poll)"
+  appended. URLs that match no route keep their last segments.
+  """
+  parts = urllib.parse.urlsplit(url)
+  segments = [s for s in parts.path.split("/") if s != ""]
+  suffix = " (long poll)" if "wait" in urllib.parse.parse_qs(parts.query) else ""
+
+  for route in ROUTES:
+    pattern = route.split("/")[1:]
+    if len(segments) < len(pattern):
+      continue
+    tail = segments[len(segments) - len(pattern):]
+    if all(p.startswith("{") or p == s for (p, s) in zip(pattern, tail)):
+      return route + suffix
+
+  return "/" + "/".join(segments[-2:]) + suffix
+
+
+class EndpointMetrics:
+
+  def __init__(self):
+    self.calls = 0
+    self.failures = 0
+    self.retries = 0
+    self.status_codes = {}
+    self.bytes_sent = 0
+    self.bytes_received = 0
+    self.latency_sum = 0.0
+    self.latency_max = 0.0
+    self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+  def percentile(self, p):
+    """
+    Returns the upper bound of the bucket holding the p-th
+    percentile latency (the max for the +Inf bucket).
+    """
+    if self.calls == 0:
+      return 0.0
+
+    rank = p / 100 * self.calls
+    seen = 0
+    for (i, count) in enumerate(self.buckets):
+      seen += count
+      if seen >= rank:
+        return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else self.latency_max
+
+    return self.latency_max
+
+
+###################################################################
+#
+# ClientMetrics
+#
+class ClientMetrics:
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self.endpoints = {}
+
+  def _endpoint(self, method, url):
+    key = (method, endpoint_of(url))
+    if key not in self.endpoints:
+      self.endpoints[key] = EndpointMetrics()
+    return self.endpoints[key]
+
+  def observe(self, method, url, status_code, secs, bytes_sent=0, bytes_received=0):
+    """
+    Records a call that got a response (status_code) or failed
+    (status_code None).
+    """
+    with self._lock:
+      m = self._endpoint(method, url)
+      m.calls += 1
+      m.latency_sum += secs
+      m.latency_max = max(m.latency_max, secs)
+      m.buckets[bisect.bisect_left(LATENCY_BUCKETS, secs)] += 1
+      m.bytes_sent += bytes_sent
+      m.bytes_received += bytes_received
+      if status_code is None:
+        m.failures += 1
+      else:
+        m.status_codes[status_code] = m.status_codes.get(status_code, 0) + 1
+
+  def retry(self, method, url):
+    """
+    Records that a call is repeated.
+    """
+    with self._lock:
+      self._endpoint(method, url).retries += 1
+
+  def report(self):
+    """
+    Returns the metrics as a table, one row per endpoint.
+    """
+    lines = ["**CLIENT METRICS**"]
+    lines.append(f"{'endpoint':<36} {'calls':>6} {'retry':>6} {'fail':>5} {'avg ms':>8} "
+                 f"{'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'sent':>10} {'received':>10}  status codes")
+
+    with self._lock:
+      for ((method, endpoint), m) in sorted(self.endpoints.items(), key=lambda item: item[0][1]):
+        avg = m.latency_sum / m.calls if m.calls > 0 else 0.0
+        codes = ", ".join(f"{code}: {n}" for (code, n) in sorted(m.status_codes.items()))
+        lines.append(f"{method + ' ' + endpoint:<36} {m.calls:>6} {m.retries:>6} {m.failures:>5} "
+                     f"{avg * 1000:>8.1f} {m.percentile(50) * 1000:>8.0f} {m.percentile(95) * 1000:>8.0f} "
+                     f"{m.latency_max * 1000:>8.1f} {m.bytes_sent:>10} {m.bytes_received:>10}  {codes}")
+
+    return "\n".join(lines) + "\n"
+
+  def prometheus(self):
+    """
+    Returns the metrics in the Prometheus text exposition format.
+    """
+    def labels(method, endpoint, **extra):
+      pairs = [("method", method), ("endpoint", endpoint)] + list(extra.items())
+      escaped = [(k, str(v).replace("\\", "\\\\").replace('"', '\\"')) for (k, v) in pairs]
+      return "{" + ",".join(f'{k}="{v}"' for (k, v) in escaped) + "}"
+
+    out = []
+
+    with self._lock:
+      items = sorted(self.endpoints.items(), key=lambda item: item[0][1])
+
+      out.append("# HELP benford_client_request_duration_seconds Latency of web service calls.")
+      out.append("# TYPE benford_client_request_duration_seconds histogram")
+      for ((method, endpoint), m) in items:
+        cumulative = 0
+        for (i, count) in enumerate(m.buckets):
+          cumulative += count
+          le = f"{LATENCY_BUCKETS[i]}" if i < len(LATENCY_BUCKETS) else "+Inf"
+          out.append(f"benford_client_request_duration_seconds_bucket{labels(method, endpoint, le=le)} {cumulative}")
+        out.append(f"benford_client_request_duration_seconds_sum{labels(method, endpoint)} {m.latency_sum:.6f}")
+        out.append(f"benford_client_request_duration_seconds_count{labels(method, endpoint)} {m.calls}")
+
+      out.append("# HELP benford_client_responses_total Responses by status code.")
+      out.append("# TYPE benford_client_responses_total counter")
+      for ((method, endpoint), m) in items:
+        for (code, n) in sorted(m.status_codes.items()):
+          out.append(f"benford_client_responses_total{labels(method, endpoint, code=code)} {n}")
+
+      counters = [
+        ("failures", "Calls that got no response.", lambda m: m.failures),
+        ("retries", "Calls that were repeated.", lambda m: m.retries),
+        ("sent_bytes", "Request body bytes sent.", lambda m: m.bytes_sent),
+        ("received_bytes", "Response body bytes received.", lambda m: m.bytes_received),
+      ]
+      for (name, help, value) in counters:
+        out.append(f"# HELP benford_client_{name}_total {help}")
+        out.append(f"# TYPE benford_client_{name}_total counter")
+        for ((method, endpoint), m) in items:
+          out.append(f"benford_client_{name}_total{labels(method, endpoint)} {value(m)}")
+
+    return "\n".join(out) + "\n"
+
+  def dump(self, fmt, filename=None):
+    """
+    Prints the metrics as "report" or "prometheus", or writes them
+    to filename.
+    """
+    text = self.prometheus() if fmt == "prometheus" else self.report()
+
+    if filename:
+      with open(filename, "w") as outfile:
+        outfile.write(text)
+    else:
+      print(text, end="")
+
+
+#
+# the metrics of this process:
+#
+METRICS = ClientMetrics()
+
+
+###################################################################
+#
+# request
+#
+def request(method, url, **kwargs):
+  """
+  requests.request, recording the call in METRICS
+
+  Parameters
+  ----------
+  method: "GET", "POST", "DELETE", ...,
+  url: url for calling the web service,
+  kwargs: passed on to requests.request
+
+  Returns
+  -------
+  response received from web service (exceptions are re-raised)
+  """
+  body = kwargs.get('data')
+  sent = len(body) if isinstance(body, (bytes, str)) else 0
+
+  start = time.perf_counter()
+  try:
+    response = requests.request(method, url, **kwargs)
+  except Exception:
+    METRICS.observe(method, url, None, time.perf_counter() - start, sent)
+    raise
+
+  #
+  # bytes on the wire: the Content-Length of a compressed response,
+  # not its decoded size
+  #
+  received = response.headers.get('Content-Length')
+  received = int(received) if received is not None and received.isnumeric() else len(response.content)
+
+  METRICS.observe(method, url, response.status_code, time.perf_counter() - start, sent, received)
+  return response
@@ -0,0 +1,175 @@
+#
+# coldstart.py
+#
+# Measures the cold start of lambda_function locally:
+#
+#   python3 coldstart.py imports [N]
+#     per-module import cost (python -X importtime), grouped by
+#     top-level package, for the module itself and for the heavy
+#     dependencies it imports on first use; shows the top N.
+#
+#   python3 coldstart.py bench [RUNS]
+#     starts a fresh interpreter RUNS times and reports the time
+#     to import lambda_function, the time of the first handler
+#     call, and the time of the first-use imports (boto3, pypdf,
+#     pymysql) that a first record pays for.
+#
+# The benchmark runs in a scratch directory with a dummy config
+# file, so no AWS or database access is needed.
+#
+
+import json
+import os
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+HERE = pathlib.Path(__file__).resolve().parent
+
+#
+# the modules lambda_function imports lazily, on first use:
+#
+FIRST_USE_IMPORTS = ["boto3", "pypdf", "pymysql"]
+
+DUMMY_CONFIG = """\
+[s3]
+bucket_name = coldstart-bench
+
+[s3readwrite]
+region_name = us-east-2
+aws_access_key_id = coldstart
+aws_secret_access_key = coldstart
+
+[rds]
+endpoint = localhost
+port_number = 3306
+user_name = coldstart
+user_pwd = coldstart
+db_name = coldstart
+"""
+
+BENCH_SCRIPT = """\
+import json, sys, time
+t0 = time.perf_counter()
+import lambda_function
+t1 = time.perf_counter()
+lambda_function.lambda_handler({"Records": []}, None)
+t2 = time.perf_counter()
+for name in %r:
+  __import__(name)
+t3 = time.perf_counter()
+sys.stderr.write(json.dumps({"import": t1 - t0, "first_call": t2 - t1, "first_use_imports": t3 - t2}) + "\\n")
+""" % (FIRST_USE_IMPORTS,)
+
+
+###################################################################
+#
+# import_report
+#
+def import_report(top=20):
+  """
+  Prints the import cost of lambda_function and its first-use
+  dependencies, grouped by top-level package
+
+  Parameters
+  ----------
+  top: number of packages to show
+
+  Returns
+  -------
+  list of (package, self microseconds, module count), most
+  expensive first
+  """
+  code = "import lambda_function; " + "; ".join("import " + name for name in FIRST_USE_IMPORTS)
+
+  proc = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                        cwd=HERE, capture_output=True, text=True)
+
+  if proc.returncode != 0:
+    print(proc.stderr)
+    raise Exception("import of lambda_function failed")
+
+  #
+  # lines look like "import time:  self [us] |  cumulative | imported package",
+  # with nested imports indented under the package name:
+  #
+  packages = {}
+  for line in proc.stderr.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+      continue
+    fields = line[len("import time:"):].split("|")
+    selftime = int(fields[0])
+    name = fields[2].strip().split(".")[0]
+    (total, count) = packages.get(name, (0, 0))
+    packages[name] = (total + selftime, count + 1)
+
+  report = sorted(((name, total, count) for (name, (total, count)) in packages.items()),
+                  key=lambda entry: entry[1], reverse=True)
+
+  grand_total = sum(total for (_, total, _) in report)
+
+  print("**IMPORT TIME by package**")
+  print(f"{'package':<24} {'ms':>9} {'%':>6} {'modules':>8}")
+  for (name, total, count) in report[:top]:
+    print(f"{name:<24} {total / 1000:9.1f} {100 * total / grand_total:6.1f} {count:8}")
+  print(f"{'total':<24} {grand_total / 1000:9.1f}")
+
+  return report
+
+
+###################################################################
+#
+# bench
+#
+def bench(runs=10):
+  """
+  Measures time-to-first-handler-call in fresh interpreters
+
+  Parameters
+  ----------
+  runs: number of cold starts to measure
+
+  Returns
+  -------
+  dict of phase name -> list of seconds
+  """
+  phases = {"import": [], "first_call": [], "first_use_imports": []}
+
+  with tempfile.TemporaryDirectory() as scratch:
+    pathlib.Path(scratch, "benfordapp-config.ini").write_text(DUMMY_CONFIG)
+
+    env = dict(os.environ)
+    env["PYTHONPATH"] = str(HERE) + os.pathsep + env.get("PYTHONPATH", "")
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+
+    for _ in range(runs):
+      proc = subprocess.run([sys.executable, "-c", BENCH_SCRIPT],
+                            cwd=scratch, env=env, capture_output=True, text=True)
+      if proc.returncode != 0:
+        print(proc.stderr)
+        raise Exception("cold start run failed")
+
+      timings = json.loads(proc.stderr.strip().splitlines()[-1])
+      for (phase, seconds) in timings.items():
+        phases[phase].append(seconds)
+
+  print("**COLD START over", runs, "runs (ms)**")
+  print(f"{'phase':<20} {'median':>9} {'min':>9} {'max':>9}")
+  for (phase, values) in phases.items():
+    print(f"{phase:<20} {1000 * statistics.median(values):9.1f} {1000 * min(values):9.1f} {1000 * max(values):9.1f}")
+
+  return phases
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 2 or sys.argv[1] not in ["imports", "bench"]:
+    print("usage: python3 coldstart.py imports [N] | bench [RUNS]")
+    sys.exit(0)
+
+  if sys.argv[1] == "imports":
+    import_report(int(sys.argv[2]) if len(sys.argv) > 2 else 20)
+  else:
+    bench(int(sys.argv[2]) if len(sys.argv) > 2 else 10)
@@ -0,0 +1,110 @@
+#
+# compression.py
+#
+# gzip / zstd helpers shared by the client (request bodies and
+# responses) and the lambda function (results objects in S3).
+# gzip is always available; zstd needs the optional zstandard
+# package, and is only offered when it can be imported.
+#
+
+import gzip
+
+
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def _zstandard():
+  try:
+    import zstandard
+    return zstandard
+  except ImportError:
+    return None
+
+
+def available_encodings():
+  """
+  Returns the content encodings we can produce and decode, most
+  preferred first (for an Accept-Encoding header).
+  """
+  if _zstandard() is not None:
+    return ["zstd", "gzip"]
+  return ["gzip"]
+
+
+###################################################################
+#
+# compress
+#
+def compress(data, encoding):
+  """
+  Compresses bytes with the given content encoding
+
+  Parameters
+  ----------
+  data: bytes to compress,
+  encoding: "gzip", "zstd", or "identity" / "none" / "" for none
+
+  Returns
+  -------
+  compressed bytes
+  """
+  if encoding in ["identity", "none", "", None]:
+    return data
+
+  if encoding == "gzip":
+    return gzip.compress(data, compresslevel=6)
+
+  if encoding == "zstd":
+    zstandard = _zstandard()
+    if zstandard is None:
+      raise Exception("zstd compression requires the zstandard package")
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+  raise Exception(f"unknown content encoding '{encoding}'")
+
+
+###################################################################
+#
+# decompress
+#
+def decompress(data, encoding):
+  """
+  Decompresses bytes that were compressed with the given content
+  encoding (see compress)
+  """
+  if encoding in ["identity", "none", "", None]:
+    return data
+
+  if encoding == "gzip":
+    return gzip.decompress(data)
+
+  if encoding == "zstd":
+    zstandard = _zstandard()
+    if zstandard is None:
+      raise Exception("zstd decompression requires the zstandard package")
+    return zstandard.ZstdDecompressor().decompress(data, max_output_size=1 << 30)
+
+  raise Exception(f"unknown content encoding '{encoding}'")
+
+
+###################################################################
+#
+# sniff_decompress
+#
+# Results objects may be stored compressed in S3, and are passed
+# through the web service as opaque (base64) bytes, so the client
+# recognizes a compressed payload by its magic number.
+#
+def sniff_decompress(data):
+  """
+  Decompresses data if it starts with a gzip or zstd magic number,
+  otherwise returns it unchanged
+  """
+  if data.startswith(GZIP_MAGIC):
+    return decompress(data, "gzip")
+
+  if data.startswith(ZSTD_MAGIC):
+    return decompress(data, "zstd")
+
+  return data
@@ -7,8 +7,9 @@
 #   Prof. Joe Hummel
 #   Northwestern University
 #
-
-import pymysql
+# pymysql is imported when the first connection is opened, so
+# importing this module stays cheap.
+#
 
 
 ###################################################################
@@ -36,6 +37,8 @@ def get_dbConn(endpoint, portnum, username, pwd, dbname):
   a connection object
   """
   try:
+    import pymysql
+
     dbConn = pymysql.connect(host=endpoint,
                              port=portnum,
                              user=username,
@@ -190,3 +193,52 @@ def perform_action(dbConn, sql, parameters=[]):
 
   finally:
     dbCursor.close()
+
+
+###############################################################
+#
+# perform_actions:
+#
+# Given a database connection and a list of (sql, parameters)
+# action queries, executes them in order as one transaction:
+# either all of them are committed, or (on an error) none are.
+# Returns the list of the number of rows modified by each query.
+#
+def perform_actions(dbConn, actions):
+  """
+  Executes a list of sql ACTION queries as a single transaction
+  and returns the number of rows modified by each
+
+  Parameters
+  __________
+  dbConn : the database connection, 
+  actions : list of (sql, parameters) tuples, where sql is an
+            ACTION query (can be parameterized with %s) and
+            parameters the list of values if parameterized
+
+  Returns
+  _______
+  list with the number of rows modified by each query
+  """
+
+  dbCursor = dbConn.cursor()
+
+  try:
+    # execute every query, and only if all succeed commit
+    # the changes:
+    rowcounts = []
+    for (sql, parameters) in actions:
+      dbCursor.execute(sql, parameters)
+      rowcounts.append(dbCursor.rowcount)
+    dbConn.commit()
+    return rowcounts
+
+  except Exception as err:
+    # failed, rollback all the changes and log error:
+    dbConn.rollback()
+    print("datatier.perform_actions() failed:")
+    print(str(err))
+    raise
+
+  finally:
+    dbCursor.close()
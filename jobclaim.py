@@ -0,0 +1,137 @@
+#
+# jobclaim.py
+#
+# Idempotent claiming of jobs. S3 event notifications (and SQS
+# redeliveries) are at-least-once, so the same datafilekey can
+# arrive twice, even at the same time. Before doing any work the
+# handler claims the job with one conditional UPDATE, which only
+# succeeds for a job that is still 'uploaded', or whose previous
+# claim's lease has expired (its lambda died without reporting
+# 'completed', 'error' or, for a sampled job with no exact tally to
+# follow, 'provisional'). Whoever gets the row updated owns the
+# job; every other delivery exits immediately. The terminal status
+# updates are conditional on the owner too, so a delivery that lost
+# its lease cannot overwrite the result of the one that took over.
+#
+# A job that ended in 'error' can be claimed again: its record was
+# reported as failed (see lambda_handler's batchItemFailures), and
+# its redelivery is the retry, not a duplicate.
+#
+#   [claim]
+#   enabled = false      (default; set it to true once migration
+#                        0005_jobs_claim has been applied)
+#   lease_secs = 900     how long a claim holds; the default is the
+#                        maximum lambda run time, so a live owner's
+#                        lease never expires and needs no renewal
+#
+# The jobs table needs the claimowner and leaseexpires columns, see
+# migrations.py; without them every claim would fail.
+#
+
+import datatier
+import datetime
+import threading
+import uuid
+
+
+CLAIM_SQL = """
+  UPDATE jobs SET status = %s, claimowner = %s, leaseexpires = %s
+  WHERE datafilekey = %s AND status = 'uploaded';
+"""
+
+RECLAIM_SQL = """
+  UPDATE jobs SET status = %s, claimowner = %s, leaseexpires = %s
+  WHERE datafilekey = %s AND status NOT IN ('uploaded', 'completed', 'provisional')
+    AND (status = 'error' OR leaseexpires IS NULL OR leaseexpires < %s);
+"""
+
+CLAIMED_STATUS = "processing - claimed"
+
+
+def _utcnow():
+  return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None, microsecond=0)
+
+
+class JobClaims:
+
+  def __init__(self, configur):
+    self.enabled = configur.getboolean('claim', 'enabled', fallback=False)
+    self.lease_secs = configur.getint('claim', 'lease_secs', fallback=900)
+
+    self._lock = threading.Lock()
+    self.claimed = 0
+    self.reclaimed = 0
+    self.duplicates = 0
+    self.unknown = 0
+
+  def _count(self, counter):
+    with self._lock:
+      setattr(self, counter, getattr(self, counter) + 1)
+
+  def claim(self, dbConn, datafilekey):
+    """
+    Tries to claim the job of a datafilekey
+
+    Parameters
+    ----------
+    dbConn: database connection,
+    datafilekey: bucket key of the job's PDF
+
+    Returns
+    -------
+    (claimed, owner): claimed is False if another delivery owns
+    the job (or it is already done); owner is the token that the
+    terminal updates must match, None if there is no job row for
+    the key (it is processed unclaimed, as before claiming existed)
+    """
+    owner = str(uuid.uuid4())
+    now = _utcnow()
+    expires = now + datetime.timedelta(seconds=self.lease_secs)
+
+    modified = datatier.perform_action(dbConn, CLAIM_SQL, [CLAIMED_STATUS, owner, expires, datafilekey])
+    if modified > 0:
+      self._count('claimed')
+      return (True, owner)
+
+    modified = datatier.perform_action(dbConn, RECLAIM_SQL, [CLAIMED_STATUS, owner, expires, datafilekey, now])
+    if modified > 0:
+      print("**CLAIM: retrying the job after an error, or taking it over from an expired lease**")
+      self._count('reclaimed')
+      return (True, owner)
+
+    row = datatier.retrieve_one_row(dbConn, "SELECT status, leaseexpires FROM jobs WHERE datafilekey = %s;", [datafilekey])
+    if row == ():
+      self._count('unknown')
+      return (True, None)
+
+    print("**CLAIM: job is", row[0], "with a lease until", row[1], "- duplicate delivery**")
+    self._count('duplicates')
+    return (False, None)
+
+  def metrics(self):
+    """
+    Returns the claim counters as a dict.
+    """
+    with self._lock:
+      return {
+        'claimed': self.claimed,
+        'reclaimed': self.reclaimed,
+        'duplicates': self.duplicates,
+        'unknown': self.unknown
+      }
+
+
+def owned_update(sql, parameters, owner):
+  """
+  Makes an "UPDATE jobs ... WHERE datafilekey = %s;" conditional on
+  the claim owner (unchanged if owner is None)
+
+  Returns
+  -------
+  (sql, parameters)
+  """
+  if owner is None:
+    return (sql, parameters)
+
+  sql = sql.rstrip().rstrip(";") + " AND claimowner = %s;"
+  return (sql, parameters + [owner])
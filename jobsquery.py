@@ -0,0 +1,235 @@
+#
+# jobsquery.py
+#
+# Server side of GET /jobs: lists jobs with optional filters and a
+# column projection, instead of every column of every job. The
+# query string parameters are all optional:
+#
+#   userid=80001              jobs of this user
+#   status=error,uploaded     jobs in any of these states; a value
+#                             ending in * matches a prefix, e.g.
+#                             processing* for the progress states
+#   since=2024-05-01          created at or after (date or
+#   until=2024-05-01T12:00    datetime, ISO format), before
+#   columns=jobid,status      columns to return, in this order
+#   limit=100                 at most this many jobs (newest first
+#                             when a time range is given)
+#
+# The WHERE clause is built only from whitelisted columns, with
+# every value passed as a %s parameter, so it can use the indexes on
+# jobs(userid, status, created) and jobs(datafilekey) created by
+# migrations.py. The response body is the list of rows (lists), and
+# the X-Jobs-Columns header names the columns in the rows.
+#
+
+import datatier
+import datetime
+import json
+
+from configparser import ConfigParser
+
+
+JOB_COLUMNS = ["jobid", "userid", "status", "originaldatafile", "datafilekey", "resultsfilekey", "created"]
+
+#
+# what GET /jobs returned before projections existed:
+#
+DEFAULT_COLUMNS = JOB_COLUMNS[0:6]
+
+MAX_LIMIT = 10000
+
+
+def _parse_time(name, value):
+  try:
+    return datetime.datetime.fromisoformat(value)
+  except ValueError:
+    raise ValueError(f"{name}: '{value}' is not an ISO date or datetime")
+
+
+###################################################################
+#
+# parse_filters
+#
+def parse_filters(params):
+  """
+  Validates the query string parameters of GET /jobs
+
+  Parameters
+  ----------
+  params: dict of query string parameters (or None)
+
+  Returns
+  -------
+  (filters as a dict with any of userid, statuses, since, until,
+   limit; list of columns to return)
+
+  Raises ValueError if a parameter is malformed.
+  """
+  params = params or {}
+  filters = {}
+
+  if params.get('userid', '') != '':
+    if not params['userid'].isnumeric():
+      raise ValueError(f"userid: '{params['userid']}' is not a number")
+    filters['userid'] = int(params['userid'])
+
+  if params.get('status', '') != '':
+    filters['statuses'] = [s.strip() for s in params['status'].split(",") if s.strip() != ""]
+
+  if params.get('since', '') != '':
+    filters['since'] = _parse_time('since', params['since'])
+
+  if params.get('until', '') != '':
+    filters['until'] = _parse_time('until', params['until'])
+
+  if params.get('limit', '') != '':
+    if not params['limit'].isnumeric() or int(params['limit']) == 0:
+      raise ValueError(f"limit: '{params['limit']}' is not a positive number")
+    filters['limit'] = min(int(params['limit']), MAX_LIMIT)
+
+  columns = DEFAULT_COLUMNS
+  if params.get('columns', '') != '':
+    columns = [c.strip() for c in params['columns'].split(",") if c.strip() != ""]
+    unknown = [c for c in columns if c not in JOB_COLUMNS]
+    if len(unknown) > 0:
+      raise ValueError(f"columns: unknown column(s) {', '.join(unknown)}")
+
+  return (filters, columns)
+
+
+###################################################################
+#
+# build_query
+#
+def build_query(filters, columns):
+  """
+  Builds the parameterized SELECT for the given filters and columns
+
+  Parameters
+  ----------
+  filters, columns: as returned by parse_filters
+
+  Returns
+  -------
+  (sql, list of parameters)
+  """
+  where = []
+  parameters = []
+
+  if 'userid' in filters:
+    where.append("userid = %s")
+    parameters.append(filters['userid'])
+
+  statuses = filters.get('statuses', [])
+  exact = [s for s in statuses if not s.endswith("*")]
+  prefixes = [s[0:-1] for s in statuses if s.endswith("*")]
+
+  alternatives = []
+  if len(exact) == 1:
+    alternatives.append("status = %s")
+    parameters.extend(exact)
+  elif len(exact) > 1:
+    alternatives.append("status IN (" + ", ".join(["%s"] * len(exact)) + ")")
+    parameters.extend(exact)
+  for prefix in prefixes:
+    alternatives.append("status LIKE %s")
+    parameters.append(prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%")
+  if len(alternatives) > 0:
+    where.append("(" + " OR ".join(alternatives) + ")")
+
+  if 'since' in filters:
+    where.append("created >= %s")
+    parameters.append(filters['since'])
+
+  if 'until' in filters:
+    where.append("created < %s")
+    parameters.append(filters['until'])
+
+  sql = "SELECT " + ", ".join(columns) + " FROM jobs"
+  if len(where) > 0:
+    sql += " WHERE " + " AND ".join(where)
+
+  if 'since' in filters or 'until' in filters:
+    sql += " ORDER BY created DESC, jobid DESC"
+  else:
+    sql += " ORDER BY jobid"
+
+  if 'limit' in filters:
+    sql += " LIMIT %s"
+    parameters.append(filters['limit'])
+
+  return (sql + ";", parameters)
+
+
+###################################################################
+#
+# get_jobs
+#
+def get_jobs(dbConn, filters, columns):
+  """
+  Retrieves the jobs matching the filters
+
+  Parameters
+  ----------
+  dbConn: database connection,
+  filters, columns: as returned by parse_filters
+
+  Returns
+  -------
+  list of rows (lists of the columns' values; datetimes as ISO
+  strings)
+  """
+  (sql, parameters) = build_query(filters, columns)
+
+  rows = datatier.retrieve_all_rows(dbConn, sql, parameters)
+
+  return [[value.isoformat(sep=" ") if isinstance(value, datetime.datetime) else value
+           for value in row]
+          for row in rows]
+
+
+###################################################################
+#
+# lambda_handler
+#
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_jobs**")
+
+    try:
+      (filters, columns) = parse_filters(event.get('queryStringParameters'))
+    except ValueError as err:
+      print("**ERROR:", str(err))
+      return {
+        'statusCode': 400,
+        'body': json.dumps(str(err))
+      }
+
+    configur = ConfigParser()
+    configur.read('benfordapp-config.ini')
+
+    dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                                 int(configur.get('rds', 'port_number')),
+                                 configur.get('rds', 'user_name'),
+                                 configur.get('rds', 'user_pwd'),
+                                 configur.get('rds', 'db_name'))
+
+    rows = get_jobs(dbConn, filters, columns)
+
+    print("**DONE,", len(rows), "jobs**")
+
+    return {
+      'statusCode': 200,
+      'headers': {'X-Jobs-Columns': ",".join(columns)},
+      'body': json.dumps(rows)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 500,
+      'body': json.dumps(str(err))
+    }
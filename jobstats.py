@@ -0,0 +1,208 @@
+#
+# jobstats.py
+#
+# Per-job results in the database, next to the results files: the
+# jobstats table holds a row per completed job (pages or rows, total
+# first digits, chi-square, MAD), and jobdigits a row per job and
+# digit 1..9 (count and frequency). Questions across jobs, e.g. all
+# jobs whose digit-1 frequency is below 25%, are then one indexed
+# query (see statsquery.py) instead of reading every results file.
+#
+# The lambda adds a job's rows in the transaction that marks it
+# completed: one row into jobstats, and its histogram as a single
+# multi-row INSERT into jobdigits. Both are INSERT IGNORE, so a
+# duplicate delivery of the same job adds nothing.
+#
+#   [jobstats]
+#   enabled = false          (tables created by migrations.py)
+#
+# Usage:
+#   python3 jobstats.py create     -- create the tables
+#   python3 jobstats.py backfill   -- add existing completed jobs
+#
+
+import datatier
+import benford
+import compression
+import sys
+
+
+CREATE_TABLES = [
+  """
+  CREATE TABLE IF NOT EXISTS jobstats (
+    jobid     int NOT NULL,
+    unit      varchar(8) NOT NULL,
+    numunits  int NOT NULL,
+    total     bigint NOT NULL,
+    chisq     double NOT NULL,
+    mad       double NOT NULL,
+    PRIMARY KEY (jobid)
+  );
+  """,
+  """
+  CREATE TABLE IF NOT EXISTS jobdigits (
+    jobid     int NOT NULL,
+    digit     tinyint NOT NULL,
+    count     bigint NOT NULL,
+    frequency double NOT NULL,
+    PRIMARY KEY (jobid, digit)
+  );
+  """
+]
+
+#
+# filters on the frequency of a digit start from this index, and
+# filters on the fit from these:
+#
+CREATE_INDEXES = [
+  """
+  CREATE INDEX jobdigits_digit_frequency ON jobdigits (digit, frequency);
+  """,
+  """
+  CREATE INDEX jobstats_chisq ON jobstats (chisq);
+  """
+]
+
+DIGITS = [str(d) for d in range(1, 10)]
+
+
+###################################################################
+#
+# job_actions
+#
+def job_actions(jobid, number_of_units, digit_count, unit="pages"):
+  """
+  Returns the action queries that store one job's results; execute
+  them with datatier.perform_actions, ideally in the same
+  transaction that marks the job completed
+
+  Parameters
+  ----------
+  jobid: the job's id,
+  number_of_units: pages (rows, lines) in the job's document,
+  digit_count: dict of digit ('0'..'9') -> count,
+  unit: "pages", "rows" or "lines"
+
+  Returns
+  -------
+  list of (sql, parameters) tuples
+  """
+  fit = benford.fit(digit_count)
+
+  values = ", ".join(["(%s, %s, %s, %s)"] * len(DIGITS))
+  parameters = []
+  for d in DIGITS:
+    parameters += [jobid, int(d), digit_count.get(d, 0), fit['freqs'][d]]
+
+  return [
+    ("INSERT IGNORE INTO jobstats (jobid, unit, numunits, total, chisq, mad) VALUES (%s, %s, %s, %s, %s, %s);",
+     [jobid, unit, number_of_units, fit['total'], fit['chisq'], fit['mad']]),
+    (f"INSERT IGNORE INTO jobdigits (jobid, digit, count, frequency) VALUES {values};", parameters)
+  ]
+
+
+###################################################################
+#
+# completion_actions
+#
+def completion_actions(dbConn, datafilekey, number_of_units, digit_count, unit="pages"):
+  """
+  Looks up the job for datafilekey and returns the action queries
+  that store its results
+
+  Parameters
+  ----------
+  dbConn: the database connection,
+  datafilekey: bucketkey of the job's document,
+  number_of_units: pages (rows, lines) in the job's document,
+  digit_count: dict of digit ('0'..'9') -> count,
+  unit: "pages", "rows" or "lines"
+
+  Returns
+  -------
+  list of (sql, parameters) tuples, empty if there is no such job
+  """
+  sql = "SELECT jobid FROM jobs WHERE datafilekey = %s;"
+  row = datatier.retrieve_one_row(dbConn, sql, [datafilekey])
+
+  if row == ():
+    return []
+
+  return job_actions(row[0], number_of_units, digit_count, unit)
+
+
+###################################################################
+#
+# backfill
+#
+def backfill(dbConn, storage):
+  """
+  Stores the results of every completed job that has none in the
+  tables yet, reading them from its results file in storage
+
+  Parameters
+  ----------
+  dbConn: the database connection,
+  storage: storage.Storage holding the results files
+
+  Returns
+  -------
+  (number of jobs added, number of jobs skipped)
+  """
+  sql = """
+    SELECT jobid, resultsfilekey FROM jobs
+     WHERE status = 'completed'
+       AND jobid NOT IN (SELECT jobid FROM jobstats)
+     ORDER BY jobid;
+  """
+  rows = datatier.retrieve_all_rows(dbConn, sql)
+
+  added = 0
+  skipped = 0
+
+  for (jobid, resultsfilekey) in rows:
+    try:
+      (data, _) = storage.read(resultsfilekey)
+      text = compression.sniff_decompress(data).decode("utf-8")
+      (number_of_units, digit_count) = benford.parse_results(text)
+      fields = text.strip().splitlines()[1].split()
+      unit = fields[1] if len(fields) > 1 else "pages"
+    except Exception as err:
+      print("job", jobid, "skipped:", str(err))
+      skipped += 1
+      continue
+
+    datatier.perform_actions(dbConn, job_actions(jobid, number_of_units, digit_count, unit))
+    added += 1
+
+  return (added, skipped)
+
+
+if __name__ == "__main__":
+  from configparser import ConfigParser
+  import os
+  import storage
+
+  if len(sys.argv) < 2 or sys.argv[1] not in ["create", "backfill"]:
+    print("usage: python3 jobstats.py create | backfill")
+    sys.exit(0)
+
+  config_file = 'benfordapp-config.ini'
+  os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+  configur = ConfigParser()
+  configur.read(config_file)
+
+  dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                               int(configur.get('rds', 'port_number')),
+                               configur.get('rds', 'user_name'),
+                               configur.get('rds', 'user_pwd'),
+                               configur.get('rds', 'db_name'))
+
+  if sys.argv[1] == "create":
+    datatier.perform_actions(dbConn, [(sql, []) for sql in CREATE_TABLES + CREATE_INDEXES])
+    print("tables created")
+
+  else:
+    (added, skipped) = backfill(dbConn, storage.make_storage(configur))
+    print(added, "jobs added,", skipped, "skipped")
@@ -9,120 +9,448 @@
 # https://en.wikipedia.org/wiki/Benford%27s_law
 # https://chance.amstat.org/2021/04/benfords-law/
 #
-# importing the necessary libraries
+# importing the necessary libraries. boto3 and pypdf (and pymysql,
+# inside datatier) dominate the cold start, so they are imported
+# on first use instead of here; see coldstart.py.
+import hashlib
 import json
-import boto3
 import os
 import uuid
-import base64
 import pathlib
+import aggregates
+import benford
+import compression
 import datatier
+import jobclaim
+import jobstats
+import ledger
+import pagecache
+import pagematrix
+import preflight
+import profiling
+import revisions
+import sampling
+import scheduler
+import statussink
+import storage
 import urllib.parse
-import string
+import threading
 
+from concurrent.futures import ThreadPoolExecutor
 from configparser import ConfigParser
-from pypdf import PdfReader
 
-def lambda_handler(event, context):
-  try:
-    print("**STARTING**")
-    print("**lambda: proj03_compute**")
-    
-    # 
-    # in case we get an exception, initial this filename
-    # so we can write an error message if need be:
+
+#
+# the files written next to a job's results file, in the same
+# bucket as its input (see profiling.profile_keys and
+# pagematrix.matrix_key); a ledger must not be named like them:
+#
+OUTPUT_SUFFIXES = [".results.txt", ".profile.txt", ".profile.prof", ".pages.bin"]
+
+
+###################################################################
+#
+# Clients
+#
+# The storage (S3 client, or a file tree, see storage.py) and RDS
+# settings are created once per container and shared by every
+# record in an event (and by every invocation that lands on a warm
+# container). boto3 clients are thread-safe, pymysql connections
+# are not, so each worker thread lazily opens its own DB connection
+# and keeps reusing it. The worker threads belong to one executor
+# that lives as long as the container, so a warm container holds
+# at most max_workers + 1 connections, however many invocations it
+# serves.
+#
+# A local S3 stand-in and DB connection function can be passed in
+# instead, as the load-test harness does (see loadtest.py).
+#
+class Clients:
+
+  def __init__(self, configur, s3=None, connect_db=None):
     #
-    bucketkey_results_file = ""
-    
+    # configure for S3 access, or the file tree that stands in
+    # for the bucket:
     #
-    # setup AWS based on config file:
+    self.storage = storage.make_storage(configur, s3)
+
     #
-    config_file = 'benfordapp-config.ini'
-    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
-    
-    configur = ConfigParser()
-    configur.read(config_file)
-    
+    # configure for RDS access
     #
-    # configure for S3 access:
+    self.rds_endpoint = configur.get('rds', 'endpoint')
+    self.rds_portnum = int(configur.get('rds', 'port_number'))
+    self.rds_username = configur.get('rds', 'user_name')
+    self.rds_pwd = configur.get('rds', 'user_pwd')
+    self.rds_dbname = configur.get('rds', 'db_name')
+
+    if connect_db is None:
+      connect_db = lambda: datatier.get_dbConn(self.rds_endpoint, self.rds_portnum,
+                                               self.rds_username, self.rds_pwd,
+                                               self.rds_dbname)
+    self.connect_db = connect_db
+
     #
-    s3_profile = 's3readwrite'
-    boto3.setup_default_session(profile_name=s3_profile)
-    
-    bucketname = configur.get('s3', 'bucket_name')
-    
-    s3 = boto3.resource('s3')
-    bucket = s3.Bucket(bucketname)
-    
+    # how many records of a batched event we process at once;
+    # across invocations, the lambda's concurrency limit bounds
+    # the DB connections (see scheduler.py):
     #
-    # configure for RDS access
+    self.max_workers = configur.getint('lambda', 'max_workers', fallback=4)
+
     #
-    rds_endpoint = configur.get('rds', 'endpoint')
-    rds_portnum = int(configur.get('rds', 'port_number'))
-    rds_username = configur.get('rds', 'user_name')
-    rds_pwd = configur.get('rds', 'user_pwd')
-    rds_dbname = configur.get('rds', 'db_name')
-    
-    #
-    # this function is event-driven by a PDF being
-    # dropped into S3. The bucket key is sent to 
-    # us and obtain as follows:
-    #
-    bucketkey = urllib.parse.unquote_plus(event['Records'][0]['s3']['object']['key'], encoding='utf-8')
-    
-    print("bucketkey:", bucketkey)
-      
-    extension = pathlib.Path(bucketkey).suffix
-    
-    if extension != ".pdf" : 
-      # raise an exception if pdf is not found
-      raise Exception("expecting S3 document to have .pdf extension")
-    
-    # convert pdf to text file
-    bucketkey_results_file = bucketkey[0:-4] + ".txt"
-    
-    print("bucketkey results file:", bucketkey_results_file)
-      
+    # limits for the preflight checks done before downloading:
     #
-    # download PDF from S3 to LOCAL file system:
-    # Local file system is AWS lambda
-    print("**DOWNLOADING '", bucketkey, "'**")
+    self.preflight = preflight.PreflightLimits(configur)
+
+    #
+    # add completed jobs into the per-user aggregates? (the
+    # tables are created by "python3 aggregates.py create")
+    #
+    self.aggregates = configur.getboolean('aggregates', 'enabled', fallback=False)
+
+    #
+    # store each completed job's histogram and fit in the jobstats
+    # tables, for queries across jobs (see jobstats.py)?
+    #
+    self.jobstats = configur.getboolean('jobstats', 'enabled', fallback=False)
+
+    #
+    # reuse the page histograms of an earlier version of a PDF
+    # revised by an incremental update (see revisions.py)?
+    #
+    self.revisions = configur.getboolean('revisions', 'enabled', fallback=True)
 
     #
-    # TODO #1 of 8: where do we write local files? Replace
-    # the ??? with the local directory where we have access.
-    # refers to the local directory of AWS lambda
+    # results objects are stored compressed ("gzip" or "zstd")
+    # when at least compress_min_bytes long; tiny files would
+    # only grow:
     #
-    local_pdf = "/tmp/data.pdf"
-    
-    bucket.download_file(bucketkey, local_pdf)
+    self.compress_results = configur.get('s3', 'compress_results', fallback='none')
+    self.compress_min_bytes = configur.getint('s3', 'compress_min_bytes', fallback=1024)
+
+    self._local = threading.local()
+    self._executor = None
+    self._executor_lock = threading.Lock()
+    self._jobs_columns = {}
+    self._jobs_columns_lock = threading.Lock()
+
+    #
+    # where progress of a job is reported; terminal states are
+    # always written to the jobs table as well:
+    #
+    self.status = statussink.make_status_sink(configur, self.get_dbConn, self.connect_db)
+
+    #
+    # per-page histograms of pages seen before, or None:
+    #
+    self.pagecache = pagecache.make_page_cache(configur, self.get_dbConn)
+
+    #
+    # huge documents get a provisional result from a sample first:
+    #
+    self.sampling = sampling.SamplingConfig(configur)
+
+    #
+    # profile every record? (the event can also ask for it)
+    #
+    self.profiling = configur.getboolean('profiling', 'enabled', fallback=False)
+    self.profiling_top_n = configur.getint('profiling', 'top_n', fallback=25)
+
+    #
+    # claim each job before processing it, so duplicate
+    # deliveries of the same event are dropped:
+    #
+    self.claims = jobclaim.JobClaims(configur)
+
+    #
+    # records of a batch are run fairly by user, or in order:
+    #
+    self.scheduler = scheduler.SchedulerConfig(configur)
+
+    #
+    # chunk sizes for streaming .csv / .tsv / .txt ledgers:
+    #
+    self.ledger = ledger.LedgerConfig(configur)
+
+  def get_dbConn(self):
+    """
+    Returns this thread's DB connection, opening it on first use.
+    """
+    dbConn = getattr(self._local, 'dbConn', None)
+    if dbConn is None:
+      print("**Opening DB connection**")
+      dbConn = self.connect_db()
+      self._local.dbConn = dbConn
+    return dbConn
+
+  def executor(self):
+    """
+    Returns the executor running the records of batched events,
+    creating it on first use; its threads (and their DB
+    connections) are reused by later invocations.
+    """
+    with self._executor_lock:
+      if self._executor is None:
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="record")
+      return self._executor
+
+  def jobs_has_column(self, column):
+    """
+    Returns True if the jobs table has the column; columns added by
+    migrations.py may not be there yet. Checked once per container;
+    any error other than an unknown column (e.g. a lost connection)
+    is raised, and the column checked again next time.
+    """
+    with self._jobs_columns_lock:
+      if column not in self._jobs_columns:
+        try:
+          datatier.retrieve_all_rows(self.get_dbConn(), f"SELECT {column} FROM jobs WHERE 1 = 0;")
+          self._jobs_columns[column] = True
+        except Exception as err:
+          if not _is_unknown_column(err):
+            raise
+          print(f"**jobs.{column} is missing, apply the migrations (python3 migrations.py migrate)**")
+          self._jobs_columns[column] = False
+      return self._jobs_columns[column]
+
+  def reset_dbConn(self):
+    """
+    Drops this thread's DB connection, e.g. after a failure, so the
+    next call to get_dbConn() opens a fresh one.
+    """
+    dbConn = getattr(self._local, 'dbConn', None)
+    self._local.dbConn = None
+    if dbConn is not None:
+      try:
+        dbConn.close()
+      except Exception:
+        pass
+
+
+def _is_unknown_column(err):
+  """
+  Returns True if err is MySQL's error 1054, unknown column (or
+  SQLite's equivalent, for loadtest.py's stand-in database).
+  """
+  code = err.args[0] if len(err.args) > 0 else None
+  return code == 1054 or "no such column" in str(err)
+
+
+_clients = None
+_clients_lock = threading.Lock()
+
+
+def set_clients(clients):
+  """
+  Installs the Clients object used by lambda_handler (None to
+  create it from the config file again on the next call).
+  """
+  global _clients
+
+  with _clients_lock:
+    _clients = clients
+
+
+def get_clients():
+  """
+  Returns the shared Clients object, creating it from the config
+  file on the first call.
+  """
+  global _clients
+
+  with _clients_lock:
+    if _clients is None:
+      #
+      # setup AWS based on config file:
+      #
+      config_file = 'benfordapp-config.ini'
+      os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+      configur = ConfigParser()
+      configur.read(config_file)
+
+      _clients = Clients(configur)
+
+    return _clients
+
+
+###################################################################
+#
+# get_event_items
+#
+# This function is event-driven by PDFs being dropped into S3. The
+# notification arrives either directly from S3 (one or more
+# Records) or via an SQS queue, in which case each queue message
+# body is itself an S3 event. Returns a list of (itemIdentifier,
+# [bucketkeys]) so failures can be reported per queue message, and
+# the queue messages whose body is not an S3 event: those fail on
+# their own (and end up in the dead-letter queue), instead of
+# failing the whole batch.
+#
+def get_event_items(event):
+  """
+  Extracts the S3 bucket keys from a (possibly batched) event
+
+  Parameters
+  ----------
+  event: the event passed to lambda_handler
+
+  Returns
+  -------
+  (list of (itemIdentifier, list of bucketkeys) tuples, list of
+  (itemIdentifier, error message) tuples of malformed messages)
+  """
+  items = []
+  malformed = []
+
+  for record in event.get('Records', []):
+    if record.get('eventSource') == 'aws:sqs':
+      identifier = record['messageId']
+      try:
+        body = json.loads(record['body'])
+        keys = [r['s3']['object']['key'] for r in body.get('Records', [])]
+      except (ValueError, KeyError, TypeError, AttributeError) as err:
+        print("**ERROR: message", identifier, "is not an S3 event:", repr(err), "**")
+        malformed.append((identifier, f"malformed message: {err!r}"))
+        continue
+    else:
+      keys = [record['s3']['object']['key']]
+      identifier = keys[0]
+
+    keys = [urllib.parse.unquote_plus(key, encoding='utf-8') for key in keys]
+    items.append((identifier, keys))
+
+  return (items, malformed)
+
+
+###################################################################
+#
+# upload_results
+#
+# Uploads a local results (or error) file to storage, compressing it
+# first if so configured. The object's Content-Encoding tells
+# HTTP clients it is compressed; the client also recognizes a
+# compressed payload by its magic number.
+#
+def upload_results(clients, local_results_file, bucketkey_results_file, content_type='text/plain'):
+  content_encoding = None
+
+  encoding = clients.compress_results
+  if encoding not in ["none", ""] and os.path.getsize(local_results_file) >= clients.compress_min_bytes:
+    with open(local_results_file, "rb") as infile:
+      data = compression.compress(infile.read(), encoding)
+    with open(local_results_file, "wb") as outfile:
+      outfile.write(data)
+    content_encoding = encoding
+
+  clients.storage.put_file(local_results_file, bucketkey_results_file, content_type, content_encoding)
+
+
+###################################################################
+#
+# file_sha256
+#
+# The hex SHA-256 of a file's contents, stored with the job so the
+# client can find the results of a file it uploaded before (see
+# resultslookup.py).
+#
+def file_sha256(filename):
+  digest = hashlib.sha256()
+  with open(filename, "rb") as infile:
+    for chunk in iter(lambda: infile.read(1024 * 1024), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+###################################################################
+#
+# completion_update
+#
+# The action query that marks a job completed, storing its results
+# key and the SHA-256 of its document (if the jobs table has the
+# datafilehash column yet, see migrations.py).
+#
+def completion_update(clients, bucketkey, bucketkey_results_file, datafilehash, owner=None):
+  if clients.jobs_has_column('datafilehash'):
+    sql = """UPDATE jobs SET status = %s, resultsfilekey = %s, datafilehash = %s WHERE datafilekey = %s;"""
+    parameters = ["completed", bucketkey_results_file, datafilehash, bucketkey]
+  else:
+    sql = """UPDATE jobs SET status = %s, resultsfilekey = %s WHERE datafilekey = %s;"""
+    parameters = ["completed", bucketkey_results_file, bucketkey]
+
+  return jobclaim.owned_update(sql, parameters, owner)
+
+
+###################################################################
+#
+# process_pdf
+#
+# Downloads the PDF from storage, tallies the first significant digits,
+# uploads the results and updates the job's row in the database.
+# Raises an exception on failure.
+#
+def process_pdf(clients, bucketkey, bucketkey_results_file, owner=None):
+  print("bucketkey:", bucketkey)
+  print("bucketkey results file:", bucketkey_results_file)
+
+  #
+  # every record gets its own local files, since several
+  # records may be processed at the same time:
+  #
+  local_id = uuid.uuid4()
+  local_pdf = f"/tmp/{local_id}.pdf"
+  local_results_file = f"/tmp/{local_id}.txt"
+  local_matrix_file = f"/tmp/{local_id}.pages.bin"
+
+  try:
+    #
+    # preflight: a few ranged reads of the object to reject a
+    # malformed, encrypted or oversized PDF in milliseconds,
+    # before any of the heavy work below. A rejection raises
+    # PreflightError, and the reason ends up on the job:
+    #
+    route = "standard"
+
+    if clients.preflight.enabled:
+      print("**PREFLIGHT**")
+
+      result = preflight.preflight_pdf(clients.storage, bucketkey, clients.preflight)
+
+      print("size:", result.size, ", estimated pages:", result.est_pages, ", route:", result.route)
+
+      route = result.route
+
+      if result.route == "large":
+        clients.status.progress(bucketkey, "processing - preflight: " + result.reason)
+
+    #
+    # download PDF from S3 to LOCAL file system:
+    # Local file system is AWS lambda (a filesystem storage
+    # hands back the file itself, nothing is copied)
+    print("**DOWNLOADING '", bucketkey, "'**")
+
+    pdf_path = clients.storage.local_path(bucketkey, local_pdf)
     # now the file has been downloaded from AWS s3 to AWS lambda
     #
     # open LOCAL pdf file:
     #
     print("**PROCESSING local PDF**")
-    
-    reader = PdfReader(local_pdf)
+
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
     number_of_pages = len(reader.pages)
 
+    datafilehash = file_sha256(pdf_path)
+
     #
-    # TODO #2 of 8: update status column in DB for this job,
-    # change the value to "processing - starting". Use the
-    # bucketkey --- stored as datafilekey in the table ---
-    # to identify the row to update. Use the datatier.
-    #
-    # open connection to the database:
+    # update status of this job, change the value to
+    # "processing - starting". Use the bucketkey --- stored as
+    # datafilekey in the table --- to identify the job.
     #
-    print("**Opening DB connection**")
-    
-    dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
-    # Prepare the SQL query to update the status
     print("**Updating status to 'processing - starting'**")
-    sql = """UPDATE jobs SET status = %s  WHERE datafilekey = %s;"""
 
-    # Execute the query
     try:
-        datatier.perform_action(dbConn, sql, ["processing - starting", bucketkey])
+        clients.status.progress(bucketkey, "processing - starting")
         print("**Status updated successfully**")
     except Exception as e:
         print("Error updating status:", str(e))
@@ -131,147 +459,610 @@ def lambda_handler(event, context):
     # for each page, extract text, split into words,
     # and see which words are numeric values:
     #
+    # an incremental revision of a PDF analyzed before only has
+    # its added and changed pages extracted, the others keep the
+    # histograms of the earlier job:
+    #
+    revision = None
+    if clients.revisions:
+      try:
+        if clients.jobs_has_column('datafilehash'):
+          revision = revisions.find_revision(clients.get_dbConn(), clients.storage, bucketkey, pdf_path, reader)
+      except Exception as err:
+        print("**REVISION check failed, processing all pages:", str(err))
+
+      if revision is not None:
+        print(f"**REVISION of job {revision.jobid} ({revision.base_pages} pages): "
+              f"{len(revision.rows)} of {number_of_pages} pages unchanged**")
+
+    #
+    # pages seen before (by content digest) are not extracted
+    # again, their histogram comes from the page cache (pages are
+    # digested as they come up, see pagecache.py):
+    #
+    job_cache = None
+    if clients.pagecache is not None:
+      job_cache = clients.pagecache.begin_job(reader.pages, revision.rows if revision is not None else ())
+
     # create a dictionary to maintain the counts of the first non zero digits
-    digit_count = {str(i): 0 for i in range(10)}
-    # Total count of valid first digits
-    total_count = 0  
+    digit_count = benford.new_digit_count()
+    # and keep each page's counts, to localize anomalies later:
+    matrix = pagematrix.PageMatrix(number_of_pages)
+
+    def tally_page(i):
+      page_count = None
+      if revision is not None and i in revision.rows:
+        page_count = revision.rows[i]
+        print("** Page", i+1, ", unchanged since job", revision.jobid)
+      elif job_cache is not None:
+        page_count = job_cache.get(i)
+        if page_count is not None:
+          print("** Page", i+1, ", from page cache")
+
+      if page_count is None:
+        page = reader.pages[i]
+        text = page.extract_text()
+        page_count = benford.new_digit_count()
+        num_words = benford.tally_text(text, page_count)
+        print("** Page", i+1, ", text length", len(text), ", num words", num_words)
+        if job_cache is not None:
+          job_cache.put(i, page_count)
+
+      for (digit, count) in page_count.items():
+        digit_count[digit] += count
+      matrix.set_row(i, page_count)
+
+    #
+    # a huge document is sampled first: tally a stratified random
+    # sample of its pages, and publish a provisional result with
+    # confidence intervals before the exact tally (if any):
+    #
+    tallied = set()
+    phase = "processing"
+
+    if clients.sampling.should_sample(number_of_pages, route):
+      (strata, samples) = sampling.stratified_sample(number_of_pages, clients.sampling)
+      sample = sorted(i for pages in samples for i in pages)
+
+      print("**SAMPLING", len(sample), "of", number_of_pages, "pages**")
+
+      if job_cache is not None:
+        job_cache.prefetch(sample)
+
+      for (k, i) in enumerate(sample):
+        tally_page(i)
+        tallied.add(i)
+        if (k + 1) % 10 == 0 or k + 1 == len(sample):
+          clients.status.progress(bucketkey, f"processing - sampled page {k+1} of {len(sample)}")
+
+      rows = {i: list(matrix.data[i * 10:(i + 1) * 10]) for i in sample}
+      estimate = sampling.estimate(number_of_pages, strata, samples, rows, clients.sampling.bootstrap)
+
+      publish_provisional(clients, bucketkey, bucketkey_results_file, local_results_file,
+                          sampling.format_provisional(number_of_pages, estimate), owner,
+                          final=not clients.sampling.continue_exact)
+
+      if not clients.sampling.continue_exact:
+        if job_cache is not None:
+          job_cache.finish()
+        return
+
+      #
+      # the estimate stays available while the exact tally goes
+      # on, so progress keeps the provisional marker:
+      #
+      phase = "provisional"
+
     for i in range(0, number_of_pages):
-      page = reader.pages[i]
-      text = page.extract_text()
-      words = text.split()
-      print("** Page", i+1, ", text length", len(text), ", num words", len(words))
-      for word in words:
-        word = word.translate(str.maketrans('', '', string.punctuation))
-        if word.isnumeric():
-          for digit in word:
-            if digit != '0':
-              if digit in digit_count:
-                digit_count[digit] += 1
-                # total_count += 1
-              break  # Stop once the first non-zero digit is found
-    # now that page has been processed, let's update database to
-    # show progress...
-    #
-    # TODO #4 of 8: update status column in DB for this job,
-    # change the value to "processing - page x of y completed".
-    # Use the bucketkey --- stored as datafilekey in table ---
-    # to identify the row to update. Use the datatier.
-
-      progress_status = f"processing - page {i+1} of {number_of_pages} completed"
+      if i in tallied:
+        continue
+
+      tally_page(i)
+      tallied.add(i)
+      #
+      # now that page has been processed, let's update database
+      # to show progress, "processing - page x of y completed":
+      #
+      progress_status = f"{phase} - page {len(tallied)} of {number_of_pages} completed"
       print(f"Updating status: {progress_status}")
-      datatier.perform_action(dbConn, sql, [progress_status, bucketkey])
+      clients.status.progress(bucketkey, progress_status)
+    if job_cache is not None:
+      job_cache.finish()
+      print(f"**PAGE CACHE: {job_cache.hits} hits, {job_cache.misses} misses, "
+            f"hit rate {100 * job_cache.hit_rate():.1f}%**")
+
     #
     # analysis complete, write the results to local results file:
     #
-    # TODO #5 of 8: where do we write local files? Replace
-    # the ??? with the local directory where we have access.
-    #
-    local_results_file = "/tmp/results.txt"
-
     print("local results file:", local_results_file)
 
     outfile = open(local_results_file, "w")
-    outfile.write("**RESULTS**\n")
-    outfile.write(str(number_of_pages))
-    outfile.write(" pages\n")
-    # Write each digit count on a new line in the desired format
-    for digit, count in digit_count.items():
-        outfile.write(f"{digit} {count}\n")
-
+    outfile.write(benford.format_results(number_of_pages, digit_count))
     outfile.close()
-    
+
     #
     # upload the results file to S3:
     #
-    print("**UPLOADING to S3 file", bucketkey_results_file, "**")
-
-    bucket.upload_file(local_results_file,
-                       bucketkey_results_file,
-                       ExtraArgs={
-                         'ACL': 'public-read',
-                         'ContentType': 'text/plain'
-                       })
-    
-    # 
-    # The last step is to update the database to change
-    # the status of this job, and store the results
-    # bucketkey for download:
+    print("**UPLOADING results file", bucketkey_results_file, "**")
+
+    upload_results(clients, local_results_file, bucketkey_results_file)
+
     #
-    # TODO #7 of 8: update both the status column and the 
-    # resultsfilekey for this job in the DB. The job is 
-    # identified by the bucketkey --- datafilekey in the 
-    # table. Change the status to "completed", and set
-    # resultsfilekey to the contents of your variable
-    # bucketkey_results_file.
+    # and the per-page matrix next to it:
     #
-    print("**Updating status to 'completed'**")
-    sql = """UPDATE jobs SET status = %s, resultsfilekey = %s WHERE datafilekey = %s;"""
-    datatier.perform_action(dbConn, sql, ["completed", bucketkey_results_file, bucketkey])
+    with open(local_matrix_file, "wb") as outfile:
+      outfile.write(matrix.to_bytes())
+
+    upload_results(clients, local_matrix_file, pagematrix.matrix_key(bucketkey_results_file),
+                   content_type='application/octet-stream')
+
+    for (page, total, score) in pagematrix.top_pages(matrix, 3):
+      print(f"** Page {page}: {total} numbers, chi-square {score:.2f}")
+
     #
-    # done!
+    # The last step is to update the database to change the
+    # status of this job to "completed", and store the results
+    # bucketkey for download:
     #
-    # respond in an HTTP-like way, i.e. with a status
-    # code and body in JSON format:
+    print("**Updating status to 'completed'**")
+    # queued progress updates must land before 'completed':
+    clients.status.flush(bucketkey)
+    metrics = clients.status.metrics()
+    if metrics is not None:
+      print("**STATUS metrics:", metrics, "**")
+
+    dbConn = clients.get_dbConn()
+    actions = [completion_update(clients, bucketkey, bucketkey_results_file, datafilehash, owner)]
+
     #
-    print("**DONE, returning success**")
-    
-    return {
-      'statusCode': 200,
-      'body': json.dumps("success")
-    }
-    
-  #
-  # on an error, try to upload error message to S3:
-  #
-  except Exception as err:
-    print("**ERROR**")
-    print(str(err))
-    
-    local_results_file = "/tmp/results.txt"
+    # and add this job's histogram into its user's aggregates,
+    # in the same transaction so it is counted exactly when
+    # the job completes:
+    #
+    if clients.aggregates:
+      actions += aggregates.completion_actions(dbConn, bucketkey, number_of_pages, digit_count)
+    if clients.jobstats:
+      actions += jobstats.completion_actions(dbConn, bucketkey, number_of_pages, digit_count)
+
+    rowcounts = datatier.perform_actions(dbConn, actions)
+
+    if owner is not None and rowcounts[0] == 0:
+      #
+      # our lease expired and another delivery took over the
+      # job (its aggregates count the job once either way):
+      #
+      print("**CLAIM lost, leaving the job to its new owner**")
+      return
+
+    clients.status.finished(bucketkey, "completed", bucketkey_results_file)
+
+  finally:
+    for local_file in [local_pdf, local_results_file, local_matrix_file]:
+      if os.path.exists(local_file):
+        os.remove(local_file)
+
+
+###################################################################
+#
+# process_ledger
+#
+# Streams a .csv, .tsv or .txt ledger from storage and tallies the
+# first significant digits of the columns named in its "columns"
+# metadata (all columns if none), at constant memory; see ledger.py.
+# Writes the same results format, counting rows instead of pages.
+# Raises an exception on failure.
+#
+def process_ledger(clients, bucketkey, bucketkey_results_file, owner=None):
+  print("bucketkey:", bucketkey)
+  print("bucketkey results file:", bucketkey_results_file)
+
+  local_results_file = f"/tmp/{uuid.uuid4()}.txt"
+
+  try:
+    size = clients.storage.size(bucketkey)
+    print("**STREAMING ledger of", size, "bytes**")
+
+    clients.status.progress(bucketkey, "processing - starting")
+
+    def report(bytes_read):
+      clients.status.progress(bucketkey, f"processing - {bytes_read // (1024 * 1024)} of {size // (1024 * 1024)} MB completed")
+
+    extension = pathlib.Path(bucketkey).suffix.lower()
+
+    (stream, metadata) = clients.storage.stream(bucketkey)
+    try:
+      columns = metadata.get('columns')
+      print("columns:", columns if columns else "all")
+
+      (number_of_rows, digit_count, datafilehash) = ledger.analyze_ledger(stream, extension, columns, clients.ledger, report)
+    finally:
+      stream.close()
+
+    unit = "lines" if extension == ".txt" else "rows"
+    results = benford.format_results(number_of_rows, digit_count, unit)
+
+    with open(local_results_file, "w") as outfile:
+      outfile.write(results)
+
+    print(results)
+    print("**UPLOADING results file", bucketkey_results_file, "**")
+
+    upload_results(clients, local_results_file, bucketkey_results_file)
+
+    print("**Updating status to 'completed'**")
+    clients.status.flush(bucketkey)
+
+    dbConn = clients.get_dbConn()
+    actions = [completion_update(clients, bucketkey, bucketkey_results_file, datafilehash, owner)]
+
+    if clients.jobstats:
+      actions += jobstats.completion_actions(dbConn, bucketkey, number_of_rows, digit_count, unit)
+
+    datatier.perform_actions(dbConn, actions)
+
+    clients.status.finished(bucketkey, "completed", bucketkey_results_file)
+
+  finally:
+    if os.path.exists(local_results_file):
+      os.remove(local_results_file)
+
+
+###################################################################
+#
+# publish_provisional
+#
+# Uploads a provisional (sampled) results file and marks the job
+# provisional in the jobs table, so the estimate can be downloaded
+# (status code 483 of GET /results): 'provisional' for good if no
+# exact tally follows (final), else "provisional - exact tally
+# starting", and then "provisional - page x of y completed".
+#
+def publish_provisional(clients, bucketkey, bucketkey_results_file, local_results_file, results, owner=None,
+                        final=False):
+  print("**PUBLISHING provisional results**")
+  print(results)
+
+  with open(local_results_file, "w") as outfile:
+    outfile.write(results)
+
+  upload_results(clients, local_results_file, bucketkey_results_file)
+
+  clients.status.flush(bucketkey)
+
+  status = "provisional" if final else "provisional - exact tally starting"
+
+  sql = """UPDATE jobs SET status = %s, resultsfilekey = %s WHERE datafilekey = %s;"""
+  (sql, parameters) = jobclaim.owned_update(sql, [status, bucketkey_results_file, bucketkey], owner)
+  datatier.perform_action(clients.get_dbConn(), sql, parameters)
+
+  clients.status.finished(bucketkey, status, bucketkey_results_file)
+
+
+###################################################################
+#
+# report_error
+#
+# On an error, try to upload the error message to S3 as the
+# results file, and mark the job as 'error' in the database.
+#
+def report_error(clients, bucketkey, bucketkey_results_file, err, owner=None):
+  local_results_file = f"/tmp/{uuid.uuid4()}.txt"
+
+  try:
     outfile = open(local_results_file, "w")
 
     outfile.write(str(err))
     outfile.write("\n")
     outfile.close()
-    
-    if bucketkey_results_file == "": 
+
+    if bucketkey_results_file == "":
       #
       # we can't upload the error file:
       #
       pass
     else:
-      # 
+      #
       # upload the error file to S3
       #
       print("**UPLOADING**")
       #
-      bucket.upload_file(local_results_file,
-                         bucketkey_results_file,
-                         ExtraArgs={
-                           'ACL': 'public-read',
-                           'ContentType': 'text/plain'
-                         })
-
-    #
-    # update jobs row in database:
-    #
-    # TODO #8 of 8: open connection, update job in database
-    # to reflect that an error has occurred. The job is 
-    # identified by the bucketkey --- datafilekey in the 
-    # table. Set the status column to 'error' and set the
-    # resultsfilekey column to the contents of the variable
-    # bucketkey_results_file.
-    print("**Updating DB status to 'error'**")
+      upload_results(clients, local_results_file, bucketkey_results_file)
+  except Exception as s3_err:
+    print("Error uploading error file:", str(s3_err))
+
+  finally:
+    if os.path.exists(local_results_file):
+      os.remove(local_results_file)
+
+  #
+  # update jobs row in database to reflect that an error has
+  # occurred. Set the status column to 'error' and the
+  # resultsfilekey column to bucketkey_results_file. The
+  # connection may be what failed, so start with a fresh one:
+  #
+  print("**Updating DB status to 'error'**")
+  try:
+    clients.status.flush(bucketkey)
+  except Exception as status_err:
+    print("Error flushing status updates:", str(status_err))
+
+  try:
+    clients.reset_dbConn()
+    dbConn = clients.get_dbConn()
+    sql = """UPDATE jobs SET status = %s, resultsfilekey = %s WHERE datafilekey = %s;"""
+    (sql, parameters) = jobclaim.owned_update(sql, ["error", bucketkey_results_file, bucketkey], owner)
+    datatier.perform_action(dbConn, sql, parameters)
+  except Exception as db_err:
+    print("Error updating DB status for error:", str(db_err))
+
+  try:
+    clients.status.finished(bucketkey, "error", bucketkey_results_file)
+  except Exception as status_err:
+    print("Error reporting status for error:", str(status_err))
+
+
+###################################################################
+#
+# upload_profile
+#
+# Uploads the profile of a job next to its results file.
+#
+def upload_profile(clients, profiler, bucketkey_results_file):
+  (key_dump, key_summary) = profiling.profile_keys(bucketkey_results_file)
+
+  local_id = uuid.uuid4()
+  local_dump = f"/tmp/{local_id}.prof"
+  local_summary = f"/tmp/{local_id}.profile.txt"
+
+  try:
+    print("**UPLOADING profile to", key_dump, "**")
+
+    profiler.dump(local_dump)
+    with open(local_summary, "w") as outfile:
+      outfile.write(profiler.summary())
+
+    upload_results(clients, local_dump, key_dump, content_type='application/octet-stream')
+    upload_results(clients, local_summary, key_summary)
+
+  except Exception as err:
+    print("Error uploading profile:", str(err))
+
+  finally:
+    for local_file in [local_dump, local_summary]:
+      if os.path.exists(local_file):
+        os.remove(local_file)
+
+
+###################################################################
+#
+# job_exists
+#
+# Returns True if there is a job row for the bucket key.
+#
+def job_exists(clients, bucketkey):
+  sql = "SELECT jobid FROM jobs WHERE datafilekey = %s;"
+  return datatier.retrieve_one_row(clients.get_dbConn(), sql, [bucketkey]) != ()
+
+
+###################################################################
+#
+# process_item
+#
+# Processes every bucket key of one event item (a direct S3 record
+# or one SQS message). Returns None on success, or the error
+# message of the first failure.
+#
+def process_item(clients, bucketkeys, profile=False):
+  error = None
+
+  for bucketkey in bucketkeys:
+    #
+    # in case we get an exception, initial this filename
+    # so we can write an error message if need be:
+    #
+    bucketkey_results_file = ""
+    owner = None
+
     try:
-      dbConn = datatier.get_dbConn(rds_endpoint, rds_portnum, rds_username, rds_pwd, rds_dbname)
-      sql = """UPDATE jobs SET status = %s, resultsfilekey = %s WHERE datafilekey = %s;"""
-      datatier.perform_action(dbConn, sql, ["error", bucketkey_results_file, bucketkey])
-    except Exception as db_err:
-      print("Error updating DB status for error:", str(db_err))
-    #
-    # done, return:
-    #    
+      extension = pathlib.Path(bucketkey).suffix.lower()
+
+      #
+      # results and profiles are written to the same bucket, and
+      # fire this trigger again; never take them for input:
+      #
+      if bucketkey.lower().endswith(tuple(OUTPUT_SUFFIXES)):
+        print("**SKIPPING", bucketkey, "- an output of this lambda**")
+        continue
+
+      if extension == ".pdf":
+        process = process_pdf
+      elif extension in ledger.LEDGER_EXTENSIONS:
+        process = process_ledger
+      else:
+        # raise an exception if pdf is not found
+        raise Exception("expecting S3 document to have .pdf, .csv, .tsv or .txt extension")
+
+      #
+      # claim the job; if another delivery of the same event
+      # owns it, there is nothing to do:
+      #
+      if clients.claims.enabled:
+        (claimed, owner) = clients.claims.claim(clients.get_dbConn(), bucketkey)
+        if not claimed:
+          print("**SKIPPING duplicate delivery of", bucketkey, "**")
+          continue
+
+      #
+      # a .txt without a job is the results file of a PDF (x.pdf ->
+      # x.txt), not a ledger: only ledgers uploaded as jobs are
+      # analyzed. (PDFs still are without one, see the batch runs at
+      # the end of this file.)
+      #
+      if process == process_ledger and owner is None and not job_exists(clients, bucketkey):
+        print("**SKIPPING", bucketkey, "- no job for it**")
+        continue
+
+      # convert pdf to text file (a ledger may itself be a .txt,
+      # so its results get a name of their own):
+      if process == process_pdf:
+        bucketkey_results_file = bucketkey[0:-4] + ".txt"
+      else:
+        bucketkey_results_file = bucketkey + ".results.txt"
+
+      if not profile:
+        process(clients, bucketkey, bucketkey_results_file, owner)
+      else:
+        profiler = profiling.JobProfiler(clients.profiling_top_n)
+        try:
+          with profiler:
+            process(clients, bucketkey, bucketkey_results_file, owner)
+        finally:
+          if profiler.started:
+            upload_profile(clients, profiler, bucketkey_results_file)
+
+    except Exception as err:
+      print("**ERROR**")
+      print(bucketkey + ":", str(err))
+
+      report_error(clients, bucketkey, bucketkey_results_file, err, owner)
+
+      if error is None:
+        error = str(err)
+
+  return error
+
+
+###################################################################
+#
+# schedule_items
+#
+# Processes the items of a batch through a fair-share scheduler,
+# so one user's bulk upload cannot take every worker (and DB
+# connection) of the batch. Returns the error (or None) of each
+# item, like process_item.
+#
+def schedule_items(clients, items, profile=False):
+  #
+  # whose jobs are these? one query for the whole batch:
+  #
+  keys = [keys[0] for (_, keys) in items if len(keys) > 0]
+
+  userids = {}
+  if len(keys) > 0:
+    sql = "SELECT datafilekey, userid FROM jobs WHERE datafilekey IN (" + ", ".join(["%s"] * len(keys)) + ");"
+    userids = dict(datatier.retrieve_all_rows(clients.get_dbConn(), sql, keys))
+
+  jobs = [(userids.get(keys[0]) if len(keys) > 0 else None, keys) for (_, keys) in items]
+
+  fair = clients.scheduler.new_scheduler(clients.max_workers)
+  results = scheduler.run_jobs(fair, jobs, lambda keys: process_item(clients, keys, profile),
+                              executor=clients.executor())
+
+  print("**SCHEDULER:", fair.metrics(), "**")
+
+  return [str(result) if isinstance(result, Exception) else result for result in results]
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_compute**")
+
+    (items, malformed) = get_event_items(event)
+
+    print("**Records in event:", len(items) + len(malformed), "**")
+
+    clients = get_clients()
+
+    profile = clients.profiling or bool(event.get('profile', False))
+
+    #
+    # process the records, several at a time if the event is
+    # a batch; each record is independent of the others:
+    #
+    if len(items) <= 1 or clients.max_workers <= 1:
+      errors = [process_item(clients, keys, profile) for (_, keys) in items]
+    elif clients.scheduler.enabled:
+      errors = schedule_items(clients, items, profile)
+    else:
+      errors = list(clients.executor().map(lambda item: process_item(clients, item[1], profile), items))
+
+    if clients.claims.enabled:
+      print("**CLAIMS:", clients.claims.metrics(), "**")
+
+    #
+    # report the failed records so that only those are retried
+    # (partial batch response):
+    #
+    failures = [{'itemIdentifier': identifier}
+                for ((identifier, _), error) in zip(items, errors)
+                if error is not None]
+    failures += [{'itemIdentifier': identifier} for (identifier, _) in malformed]
+    errors += [error for (_, error) in malformed]
+
+    #
+    # done!
+    #
+    # respond in an HTTP-like way, i.e. with a status
+    # code and body in JSON format:
+    #
+    if len(failures) == 0:
+      print("**DONE, returning success**")
+
+      return {
+        'statusCode': 200,
+        'body': json.dumps("success"),
+        'batchItemFailures': []
+      }
+
+    print("**DONE,", len(failures), "of", len(errors), "records failed**")
+
+    if len(errors) == 1:
+      body = json.dumps(errors[0])
+    else:
+      body = json.dumps(f"{len(failures)} of {len(errors)} records failed")
+
+    return {
+      'statusCode': 500,
+      'body': body,
+      'batchItemFailures': failures
+    }
+
+  #
+  # the event itself could not be handled, so every record
+  # has to be retried:
+  #
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
     return {
       'statusCode': 500,
-      'body': json.dumps(str(err))
+      'body': json.dumps(str(err)),
+      'batchItemFailures': [{'itemIdentifier': r.get('messageId', '')}
+                            for r in event.get('Records', [])
+                            if r.get('eventSource') == 'aws:sqs']
     }
+
+
+#
+# Batch runs outside of AWS, e.g. over a local archive with
+# [storage] backend = filesystem:
+#
+#   python3 lambda_function.py KEY [KEY ...]
+#
+# processes the given keys as one batch event.
+#
+if __name__ == "__main__":
+  import sys
+
+  if len(sys.argv) < 2:
+    print("usage: python3 lambda_function.py KEY [KEY ...]")
+    sys.exit(0)
+
+  # keys in S3 events are URL-encoded:
+  event = {'Records': [{'s3': {'object': {'key': urllib.parse.quote_plus(key)}}} for key in sys.argv[1:]]}
+  response = lambda_handler(event, None)
+
+  print(response['body'])
+  sys.exit(0 if response['statusCode'] == 200 else 1)
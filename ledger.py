@@ -0,0 +1,280 @@
+#
+# ledger.py
+#
+# Streaming ingestion of exported ledgers: .csv, .tsv and .txt
+# objects are read from storage in chunks, never as a whole, and
+# tallied with the same rule as the words of a PDF page (see
+# benford.tally_text: a value counts if it is numeric once its
+# punctuation is removed, and its first non-zero digit is tallied),
+# so multi-GB exports are analyzed at constant memory without being
+# printed to PDF first.
+#
+# Which columns of a .csv / .tsv to analyze comes with the object,
+# as its "columns" metadata (x-amz-meta-columns on S3, "columns" in
+# a <file>.meta.json next to the file in filesystem storage):
+#
+#   columns = amount,tax      by name, from the header row
+#   columns = 3,5             by 1-based position (no header row)
+#   (none)                    every column; a first row without a
+#                             single number is a header row, and
+#                             is neither tallied nor counted
+#
+# Rows are parsed by the csv module, and the selected values of a
+# block of rows are tallied at once with numpy when it is installed
+# (one vectorized pass over the bytes of the block), else word by
+# word with benford.tally_text. .txt objects are tallied as plain
+# text, chunk by chunk.
+#
+#   [ledger]
+#   chunk_bytes = 1048576    bytes read from storage at a time
+#   block_rows = 16384       rows tallied at once
+#
+
+import benford
+import codecs
+import csv
+import hashlib
+import itertools
+import string
+
+
+LEDGER_EXTENSIONS = [".csv", ".tsv", ".txt"]
+
+
+class LedgerConfig:
+
+  def __init__(self, configur):
+    self.chunk_bytes = configur.getint('ledger', 'chunk_bytes', fallback=1024 * 1024)
+    self.block_rows = configur.getint('ledger', 'block_rows', fallback=16384)
+
+
+class LedgerError(Exception):
+  """
+  Raised when a ledger cannot be analyzed as specified (e.g. an
+  unknown column); the message is recorded on the job.
+  """
+  pass
+
+
+###################################################################
+#
+# tally_bytes
+#
+# benford.tally_text over ASCII bytes, vectorized: every byte is
+# classified as digit, punctuation, separator (whitespace) or other;
+# a word is numeric if it holds a digit and nothing "other", and
+# its first byte in '1'..'9' is its first significant digit.
+#
+_punctuation = bytes(string.punctuation, "ascii")
+_whitespace = b" \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f"
+
+
+def _tally_bytes_numpy(numpy, data, digit_count):
+  raw = numpy.frombuffer(data, dtype=numpy.uint8)
+  if raw.size == 0:
+    return
+
+  is_sep = numpy.isin(raw, numpy.frombuffer(_whitespace, dtype=numpy.uint8))
+  is_digit = (raw >= ord('0')) & (raw <= ord('9'))
+  is_punct = numpy.isin(raw, numpy.frombuffer(_punctuation, dtype=numpy.uint8))
+  is_other = ~(is_sep | is_digit | is_punct)
+
+  #
+  # word number of every byte; separators belong to no word:
+  #
+  word = numpy.cumsum(is_sep)
+  words = int(word[-1]) + 1
+  keep = ~is_sep
+
+  has_digit = numpy.bincount(word[keep & is_digit], minlength=words) > 0
+  has_other = numpy.bincount(word[keep & is_other], minlength=words) > 0
+
+  nonzero = numpy.flatnonzero(is_digit & (raw != ord('0')))
+  (first_words, first_index) = numpy.unique(word[nonzero], return_index=True)
+  first_digits = raw[nonzero[first_index]] - ord('0')
+
+  numeric = has_digit[first_words] & ~has_other[first_words]
+  counts = numpy.bincount(first_digits[numeric], minlength=10)
+
+  for d in range(1, 10):
+    digit_count[str(d)] += int(counts[d])
+
+
+def tally_bytes(data, digit_count):
+  """
+  Adds the first significant digits of the numeric words in data
+  (bytes) to digit_count, like benford.tally_text
+  """
+  try:
+    import numpy
+  except ImportError:
+    numpy = None
+
+  if numpy is not None and data.isascii():
+    _tally_bytes_numpy(numpy, data, digit_count)
+  else:
+    benford.tally_text(data.decode("utf-8", errors="replace"), digit_count)
+
+
+###################################################################
+#
+# _read_chunks / _iter_lines
+#
+# Read the object in chunks, hashing (and counting) the bytes on the
+# way, and decode them incrementally into lines for the csv module;
+# lines keep their newline, so quoted values spanning lines work.
+#
+def _read_chunks(stream, chunk_bytes, progress):
+  while True:
+    chunk = stream.read(chunk_bytes)
+    if not chunk:
+      return
+    progress.update(chunk)
+    yield chunk
+
+
+def _iter_lines(chunks):
+  decoder = codecs.getincrementaldecoder("utf-8-sig")(errors="replace")
+  pending = ""
+  for chunk in chunks:
+    text = pending + decoder.decode(chunk)
+    lines = text.splitlines(keepends=True)
+    if len(lines) > 0 and not lines[-1].endswith(("\n", "\r")):
+      pending = lines.pop()
+    else:
+      pending = ""
+    yield from lines
+  pending += decoder.decode(b"", final=True)
+  if pending != "":
+    yield pending
+
+
+class _Progress:
+
+  def __init__(self, report):
+    self.report = report
+    self.bytes = 0
+    self.sha256 = hashlib.sha256()
+
+  def update(self, chunk):
+    self.bytes += len(chunk)
+    self.sha256.update(chunk)
+    if self.report is not None:
+      self.report(self.bytes)
+
+
+_strip_punctuation = str.maketrans('', '', string.punctuation)
+
+
+def _is_header(row):
+  """
+  Returns True if no word of row is numeric (see benford.tally_text).
+  """
+  words = [word.translate(_strip_punctuation) for value in row for word in value.split()]
+  return len(words) > 0 and not any(word.isnumeric() for word in words)
+
+
+def _resolve_columns(spec, header):
+  """
+  Returns the 0-based indices of the columns in spec, or None for
+  all columns.
+  """
+  if spec is None or spec.strip() == "":
+    return None
+
+  names = [name.strip() for name in spec.split(",") if name.strip() != ""]
+
+  if all(name.isnumeric() for name in names):
+    return [int(name) - 1 for name in names]
+
+  if header is None:
+    raise LedgerError("ledger: columns are given by name, but there is no header row")
+
+  header = [name.strip() for name in header]
+  missing = [name for name in names if name not in header]
+  if len(missing) > 0:
+    raise LedgerError(f"ledger: no column(s) {', '.join(missing)} in the header row")
+
+  return [header.index(name) for name in names]
+
+
+###################################################################
+#
+# analyze_ledger
+#
+def analyze_ledger(stream, extension, columns=None, config=None, report=None):
+  """
+  Tallies the first significant digits of a ledger, streaming
+
+  Parameters
+  ----------
+  stream: binary file-like object with the ledger's contents,
+  extension: ".csv", ".tsv" or ".txt",
+  columns: the columns spec (see above), or None for all,
+  config: LedgerConfig (chunk and block sizes),
+  report: function called with the number of bytes read so far,
+    after every chunk
+
+  Returns
+  -------
+  (number of rows (lines for .txt), dict of digit -> count, hex
+  SHA-256 of the contents)
+  """
+  chunk_bytes = config.chunk_bytes if config is not None else 1024 * 1024
+  block_rows = config.block_rows if config is not None else 16384
+
+  progress = _Progress(report)
+  chunks = _read_chunks(stream, chunk_bytes, progress)
+  digit_count = benford.new_digit_count()
+
+  if extension == ".txt":
+    #
+    # plain text: cut each chunk after its last whitespace, so no
+    # word is split between two chunks:
+    #
+    rows = 0
+    pending = b""
+    for chunk in chunks:
+      data = pending + chunk
+      cut = max(data.rfind(sep) for sep in [b" ", b"\n", b"\t", b"\r"]) + 1
+      (data, pending) = (data[:cut], data[cut:])
+      rows += data.count(b"\n")
+      tally_bytes(data, digit_count)
+    if pending != b"":
+      rows += 1
+      tally_bytes(pending, digit_count)
+    return (rows, digit_count, progress.sha256.hexdigest())
+
+  if extension not in [".csv", ".tsv"]:
+    raise LedgerError(f"ledger: unsupported extension '{extension}'")
+
+  reader = csv.reader(_iter_lines(chunks), delimiter="\t" if extension == ".tsv" else ",")
+
+  header = None
+  if columns is not None and not all(c.strip().isnumeric() for c in columns.split(",") if c.strip() != ""):
+    header = next(reader, None)
+  indices = _resolve_columns(columns, header)
+
+  if indices is None:
+    #
+    # every column: skip the header row, if there is one
+    #
+    first = next(reader, None)
+    if first is not None and not _is_header(first):
+      reader = itertools.chain([first], reader)
+
+  rows = 0
+  for block in iter(lambda: list(itertools.islice(reader, block_rows)), []):
+    rows += len(block)
+
+    if indices is None:
+      values = [value for row in block for value in row]
+    elif len(indices) == 1:
+      i = indices[0]
+      values = [row[i] for row in block if i < len(row)]
+    else:
+      values = [row[i] for row in block for i in indices if i < len(row)]
+
+    tally_bytes("\n".join(values).encode("utf-8"), digit_count)
+
+  return (rows, digit_count, progress.sha256.hexdigest())
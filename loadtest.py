@@ -0,0 +1,509 @@
+#
+# loadtest.py
+#
+# End-to-end load test of lambda_handler, entirely in-process:
+# synthetic PDFs are put into a local S3 stand-in, a jobs table is
+# created in a local SQLite database behind datatier's interface,
+# and N jobs are driven through lambda_handler with synthetic S3
+# events from C concurrent "invocations".
+#
+#   python3 loadtest.py [options]
+#
+#   --jobs N            number of jobs (default 50)
+#   --concurrency C     concurrent invocations (default 4)
+#   --batch B           records per event (default 1)
+#   --pages P           pages per PDF (default 10)
+#   --numbers K         numeric values per page (default 200)
+#   --shared-pages S    first S pages identical in every PDF, like
+#                       boilerplate (default 0)
+#   --duplicates D      deliver every event D more times, like
+#                       at-least-once S3 notifications (default 0)
+#   --skew F            fraction of the jobs bulk-uploaded by one user
+#                       (80000), ahead of everyone else's (default 0)
+#   --fair              run the events through scheduler.py's fair
+#                       share scheduler (--per-user cap, default 1)
+#                       instead of in arrival order
+#   --db-latency MS     simulated round trip per SQL statement
+#   --s3-latency MS     simulated round trip per S3 request
+#   --config FILE       lambda config to use (default: built-in)
+#   --json FILE         save the report as JSON
+#   --baseline FILE     compare against a saved report
+#   --verbose           keep lambda_function's output
+#
+# Reports throughput, p50/p95/p99 job latency, and the number of
+# DB writes and S3 requests, so a change can be compared against
+# a baseline run.
+#
+
+import argparse
+import contextlib
+import io
+import json
+import random
+import re
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+import aggregates
+import jobstats
+import lambda_function
+import pagecache
+import scheduler
+
+
+DEFAULT_CONFIG = """\
+[s3]
+bucket_name = loadtest
+
+[rds]
+endpoint = localhost
+port_number = 3306
+user_name = loadtest
+user_pwd = loadtest
+db_name = loadtest
+
+[claim]
+enabled = true
+"""
+
+JOBS_TABLE = """
+  CREATE TABLE jobs (
+    jobid            INTEGER PRIMARY KEY,
+    userid           INTEGER NOT NULL,
+    status           TEXT NOT NULL,
+    originaldatafile TEXT NOT NULL,
+    datafilekey      TEXT NOT NULL,
+    resultsfilekey   TEXT NOT NULL,
+    created          TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    claimowner       TEXT,
+    leaseexpires     TEXT,
+    datafilehash     TEXT
+  );
+"""
+
+#
+# the indexes of migrations.py:
+#
+JOBS_INDEXES = [
+  "CREATE INDEX jobs_userid_status ON jobs (userid, status, created);",
+  "CREATE INDEX jobs_datafilekey ON jobs (datafilekey);",
+  "CREATE INDEX jobs_userid_datafilehash ON jobs (userid, datafilehash);"
+]
+
+
+###################################################################
+#
+# make_pdf
+#
+# Builds a valid PDF of the given number of pages, each holding
+# lines of numbers whose first digits roughly follow Benford's Law.
+#
+def make_pdf(pages, numbers_per_page, seed=0, shared_pages=0):
+  """
+  Returns the bytes of a synthetic PDF with numeric text; the first
+  shared_pages pages are the same whatever the seed
+  """
+  rnd = random.Random(-1)
+
+  objects = []
+  objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+  kids = " ".join(f"{4 + 2 * p} 0 R" for p in range(pages))
+  objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+  objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+  for p in range(pages):
+    if p == shared_pages:
+      rnd = random.Random(seed)
+    numbers = [str(int(10 ** rnd.uniform(0, 6))) for _ in range(numbers_per_page)]
+    lines = [" ".join(numbers[i:i + 8]) for i in range(0, len(numbers), 8)]
+    text = " ".join(f"({line}) '" for line in lines)
+    content = f"BT /F1 9 Tf 12 TL 40 760 Td {text} ET".encode()
+
+    objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                   f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * p} 0 R >>".encode())
+    objects.append(b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream")
+
+  out = io.BytesIO()
+  out.write(b"%PDF-1.4\n")
+  offsets = []
+  for (i, obj) in enumerate(objects):
+    offsets.append(out.tell())
+    out.write(f"{i + 1} 0 obj\n".encode() + obj + b"\nendobj\n")
+
+  startxref = out.tell()
+  out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+  for offset in offsets:
+    out.write(f"{offset:010} 00000 n \n".encode())
+  out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{startxref}\n%%EOF\n".encode())
+
+  return out.getvalue()
+
+
+###################################################################
+#
+# LocalS3
+#
+# In-memory stand-in for the subset of the boto3 S3 client that
+# lambda_function uses, counting requests by operation.
+#
+class LocalS3:
+
+  def __init__(self, latency_secs=0.0):
+    self.objects = {}
+    self.latency_secs = latency_secs
+    self.counts = {}
+    self._lock = threading.Lock()
+
+  def _request(self, operation):
+    with self._lock:
+      self.counts[operation] = self.counts.get(operation, 0) + 1
+    if self.latency_secs > 0:
+      time.sleep(self.latency_secs)
+
+  def _get(self, bucketkey):
+    with self._lock:
+      if bucketkey not in self.objects:
+        raise Exception(f"An error occurred (404) when calling the S3 API: Not Found ({bucketkey})")
+      return self.objects[bucketkey]
+
+  def put(self, bucketkey, data, **metadata):
+    with self._lock:
+      self.objects[bucketkey] = {'Body': data, **metadata}
+
+  def download_file(self, bucketname, bucketkey, filename, **kwargs):
+    self._request('GetObject')
+    with open(filename, "wb") as outfile:
+      outfile.write(self._get(bucketkey)['Body'])
+
+  def upload_file(self, filename, bucketname, bucketkey, ExtraArgs=None, **kwargs):
+    self._request('PutObject')
+    with open(filename, "rb") as infile:
+      self.put(bucketkey, infile.read(), **(ExtraArgs or {}))
+
+  def put_object(self, Bucket, Key, Body, **kwargs):
+    self._request('PutObject')
+    self.put(Key, Body if isinstance(Body, bytes) else Body.read(), **kwargs)
+
+  def head_object(self, Bucket, Key, **kwargs):
+    self._request('HeadObject')
+    obj = self._get(Key)
+    return {'ContentLength': len(obj['Body']), 'Metadata': obj.get('Metadata', {})}
+
+  def get_object(self, Bucket, Key, Range=None, **kwargs):
+    self._request('GetObject')
+    obj = self._get(Key)
+    data = obj['Body']
+
+    if Range is not None:
+      (first, last) = Range[len("bytes="):].split("-")
+      if first == "":
+        data = data[-int(last):]
+      elif last == "":
+        data = data[int(first):]
+      else:
+        data = data[int(first):int(last) + 1]
+
+    return {'Body': io.BytesIO(data), 'ContentLength': len(data), 'Metadata': obj.get('Metadata', {})}
+
+
+###################################################################
+#
+# LocalDB
+#
+# A SQLite database standing in for RDS. connect() returns objects
+# with the connection / cursor interface datatier uses, with %s
+# parameters translated to SQLite's ? (INSERT IGNORE to INSERT OR
+# IGNORE, and aggregates.py's ON DUPLICATE KEY UPDATE ... VALUES(c)
+# to SQLite's upsert). All connections share one SQLite connection,
+# serialized by a lock, like a single server.
+#
+class LocalDB:
+
+  def __init__(self, latency_secs=0.0):
+    self.latency_secs = latency_secs
+    self.writes = 0
+    self.reads = 0
+    self.commits = 0
+    self._lock = threading.RLock()
+    self._sqlite = sqlite3.connect(":memory:", check_same_thread=False, isolation_level=None)
+    self._sqlite.execute(JOBS_TABLE)
+    for sql in JOBS_INDEXES:
+      self._sqlite.execute(sql)
+    for sql in pagecache.CREATE_TABLES + jobstats.CREATE_TABLES + jobstats.CREATE_INDEXES + aggregates.CREATE_TABLES:
+      self._sqlite.execute(sql)
+
+  def connect(self):
+    return LocalConnection(self)
+
+  def query(self, sql, parameters=[]):
+    with self._lock:
+      return self._sqlite.execute(sql, parameters).fetchall()
+
+
+class LocalConnection:
+
+  def __init__(self, db):
+    self.db = db
+    self.in_transaction = False
+
+  def cursor(self):
+    return LocalCursor(self)
+
+  def commit(self):
+    with self.db._lock:
+      if self.in_transaction:
+        self.db._sqlite.execute("COMMIT")
+        self.in_transaction = False
+        self.db._lock.release()
+      self.db.commits += 1
+
+  def rollback(self):
+    with self.db._lock:
+      if self.in_transaction:
+        self.db._sqlite.execute("ROLLBACK")
+        self.in_transaction = False
+        self.db._lock.release()
+
+  def close(self):
+    self.rollback()
+
+
+class LocalCursor:
+
+  _param_re = re.compile(r"%s")
+  _values_re = re.compile(r"VALUES\((\w+)\)")
+
+  def __init__(self, conn):
+    self.conn = conn
+    self.rowcount = -1
+    self._rows = []
+
+  def execute(self, sql, parameters=[]):
+    db = self.conn.db
+    if db.latency_secs > 0:
+      time.sleep(db.latency_secs)
+
+    sql = self._param_re.sub("?", sql.strip().rstrip(";"))
+    sql = sql.replace("INSERT IGNORE", "INSERT OR IGNORE")
+    if "ON DUPLICATE KEY UPDATE" in sql:
+      (insert, update) = sql.split("ON DUPLICATE KEY UPDATE")
+      sql = insert + "ON CONFLICT DO UPDATE SET" + self._values_re.sub(r"excluded.\1", update)
+    is_write = not sql.lstrip().upper().startswith("SELECT")
+
+    with db._lock:
+      #
+      # a write starts a transaction that holds the database
+      # until commit / rollback, like row locks would:
+      #
+      if is_write and not self.conn.in_transaction:
+        db._lock.acquire()
+        db._sqlite.execute("BEGIN")
+        self.conn.in_transaction = True
+
+      cursor = db._sqlite.execute(sql, list(parameters))
+      self._rows = cursor.fetchall()
+      self.rowcount = cursor.rowcount
+
+      if is_write:
+        db.writes += 1
+      else:
+        db.reads += 1
+
+  def fetchone(self):
+    return self._rows[0] if len(self._rows) > 0 else None
+
+  def fetchall(self):
+    return self._rows
+
+  def close(self):
+    pass
+
+
+###################################################################
+#
+# run
+#
+def run(args):
+  """
+  Runs the load test described by the parsed command-line args,
+  and returns the report (dict)
+  """
+  configur = ConfigParser()
+  if args.config:
+    configur.read(args.config)
+  else:
+    configur.read_string(DEFAULT_CONFIG)
+
+  s3 = LocalS3(args.s3_latency / 1000)
+  db = LocalDB(args.db_latency / 1000)
+
+  #
+  # the jobs, as the web service would have created them when
+  # the PDFs were uploaded:
+  #
+  heavy = round(args.skew * args.jobs)
+
+  bucketkeys = []
+  userids = {}
+  for jobid in range(1, args.jobs + 1):
+    userid = 80000 if jobid <= heavy else 80001 + jobid % 9
+    bucketkey = f"loadtest/user{userid}/job{jobid:06}.pdf"
+    s3.put(bucketkey, make_pdf(args.pages, args.numbers, seed=jobid, shared_pages=args.shared_pages))
+    db.query("INSERT INTO jobs (jobid, userid, status, originaldatafile, datafilekey, resultsfilekey) "
+             "VALUES (?, ?, 'uploaded', ?, ?, '')",
+             [jobid, userid, f"job{jobid:06}.pdf", bucketkey])
+    bucketkeys.append(bucketkey)
+    userids[bucketkey] = userid
+
+  s3.counts = {}
+
+  clients = lambda_function.Clients(configur, s3=s3, connect_db=db.connect)
+  lambda_function.set_clients(clients)
+
+  events = [bucketkeys[i:i + args.batch] for i in range(0, len(bucketkeys), args.batch)]
+
+  #
+  # duplicate deliveries arrive in random order among the others:
+  #
+  if args.duplicates > 0:
+    events = events * (1 + args.duplicates)
+    random.Random(0).shuffle(events)
+
+  latencies = []
+  failures = []
+  turnarounds = {}
+
+  def invoke(keys):
+    event = {'Records': [{'s3': {'object': {'key': key}}} for key in keys]}
+    start = time.perf_counter()
+    response = lambda_function.lambda_handler(event, None)
+    finished = time.perf_counter()
+    return (keys, finished - start, finished, response)
+
+  output = sys.stdout if args.verbose else io.StringIO()
+
+  fair = None
+  start = time.perf_counter()
+  with contextlib.redirect_stdout(output):
+    if args.fair:
+      fair = scheduler.FairScheduler(max_running=args.concurrency, per_user=args.per_user)
+      results = scheduler.run_jobs(fair, [(userids[keys[0]], keys) for keys in events], invoke)
+    else:
+      with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        results = list(executor.map(invoke, events))
+  wall = time.perf_counter() - start
+
+  for (keys, elapsed, finished, response) in results:
+    latencies.extend([elapsed] * len(keys))
+    failures.extend(f['itemIdentifier'] for f in response.get('batchItemFailures', []))
+    #
+    # every job was uploaded at the start, so the time to its
+    # completion is what its user waited:
+    #
+    for key in keys:
+      turnarounds.setdefault(userids[key], []).append(finished - start)
+
+  lambda_function.set_clients(None)
+
+  claims = clients.claims.metrics()
+
+  def mean_turnaround(users):
+    values = [t for u in users for t in turnarounds.get(u, [])]
+    return statistics.mean(values) if len(values) > 0 else 0.0
+
+  completed = db.query("SELECT COUNT(*) FROM jobs WHERE status = 'completed'")[0][0]
+
+  latencies.sort()
+
+  def percentile(p):
+    return latencies[min(len(latencies) - 1, int(p / 100 * len(latencies)))]
+
+  return {
+    'jobs': args.jobs,
+    'concurrency': args.concurrency,
+    'batch': args.batch,
+    'duplicates': args.duplicates,
+    'pages': args.pages,
+    'completed': completed,
+    'failed': len(failures),
+    'wall_secs': wall,
+    'jobs_per_min': 60 * args.jobs / wall,
+    'p50_secs': percentile(50),
+    'p95_secs': percentile(95),
+    'p99_secs': percentile(99),
+    'mean_secs': statistics.mean(latencies),
+    'db_writes': db.writes,
+    'db_reads': db.reads,
+    'db_commits': db.commits,
+    'db_writes_per_job': db.writes / args.jobs,
+    's3_requests': dict(s3.counts),
+    'claims': claims,
+    'heavy_user_turnaround_secs': mean_turnaround([80000]),
+    'other_users_turnaround_secs': mean_turnaround([u for u in turnarounds if u != 80000]),
+    'scheduler': fair.metrics() if fair is not None else None,
+  }
+
+
+def print_report(report, baseline=None):
+  print("**LOAD TEST**")
+  print(f"{report['jobs']} jobs x {report['pages']} pages, concurrency {report['concurrency']}, batch {report['batch']}")
+  print(f"completed {report['completed']}, failed {report['failed']}")
+
+  rows = ['wall_secs', 'jobs_per_min', 'p50_secs', 'p95_secs', 'p99_secs', 'mean_secs',
+          'db_writes', 'db_reads', 'db_commits', 'db_writes_per_job',
+          'heavy_user_turnaround_secs', 'other_users_turnaround_secs']
+
+  for name in rows:
+    line = f"{name:<20} {report[name]:12.3f}"
+    if baseline is not None and baseline.get(name):
+      change = 100 * (report[name] - baseline[name]) / baseline[name]
+      line += f"   baseline {baseline[name]:12.3f} ({change:+.1f}%)"
+    print(line)
+
+  print("s3 requests:", report['s3_requests'])
+  print("claims:", report.get('claims'))
+
+  if report.get('scheduler') is not None:
+    print("scheduler wait per user:")
+    for (userid, stats) in sorted(report['scheduler']['users'].items()):
+      print(f"  {userid}: {stats['dispatched']} jobs, avg wait {stats['avg_wait_ms']:.0f} ms, max {stats['max_wait_ms']:.0f} ms")
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="load test lambda_handler locally")
+  parser.add_argument("--jobs", type=int, default=50)
+  parser.add_argument("--concurrency", type=int, default=4)
+  parser.add_argument("--batch", type=int, default=1)
+  parser.add_argument("--pages", type=int, default=10)
+  parser.add_argument("--numbers", type=int, default=200)
+  parser.add_argument("--shared-pages", type=int, default=0)
+  parser.add_argument("--duplicates", type=int, default=0)
+  parser.add_argument("--skew", type=float, default=0.0)
+  parser.add_argument("--fair", action="store_true")
+  parser.add_argument("--per-user", type=int, default=1)
+  parser.add_argument("--db-latency", type=float, default=0.0)
+  parser.add_argument("--s3-latency", type=float, default=0.0)
+  parser.add_argument("--config")
+  parser.add_argument("--json")
+  parser.add_argument("--baseline")
+  parser.add_argument("--verbose", action="store_true")
+  args = parser.parse_args()
+
+  report = run(args)
+
+  baseline = None
+  if args.baseline:
+    with open(args.baseline) as infile:
+      baseline = json.load(infile)
+
+  print_report(report, baseline)
+
+  if args.json:
+    with open(args.json, "w") as outfile:
+      json.dump(report, outfile, indent=2)
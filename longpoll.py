@@ -0,0 +1,228 @@
+#
+# longpoll.py
+#
+# Server side of GET /results/{jobid}, with long polling. Without
+# parameters it answers at once, as before:
+#
+#   200 {"data": <results file, base64>}   completed
+#   483 {"data": <estimate, base64>, "status": "<status>"}
+#       provisional: the sampled estimate of a huge document (see
+#       sampling.py), while the exact tally goes on ("provisional
+#       - page x of y completed") or for good ("provisional")
+#   480 "uploaded", 481 "<status>", 482 "error"
+#   400 no such job
+#
+# With ?wait=SECONDS&since=STATUS the request blocks until the job's
+# status differs from STATUS (the last one the client saw), or the
+# wait is over, and then answers as above. The client re-issues it
+# right away, so it learns of completion within one poll interval
+# of it happening. The interval doubles after every read, from
+# interval_secs up to max_interval_secs: a job that takes minutes
+# costs a read every couple of seconds per waiting client rather
+# than four a second. Progress alone ("processing - page 3 of 40" to
+# "page 4 of 40", both 481) is reported at most every progress_secs,
+# else a long PDF would cost a request per page; changes of the
+# status code (uploaded, processing, provisional, completed, error)
+# are reported at once. The wait is capped below API Gateway's 29 second
+# integration timeout.
+#
+#   [longpoll]
+#   max_wait_secs = 25
+#   interval_secs = 0.25     first wait before the jobs row is re-read
+#   max_interval_secs = 2    longest wait between reads
+#   progress_secs = 5
+#
+
+import base64
+import datatier
+import json
+import storage
+import time
+
+from configparser import ConfigParser
+
+
+def status_code(status):
+  """
+  Returns the HTTP status code of GET /results for a job status.
+  """
+  if status is None:
+    return 400
+  if status == "completed":
+    return 200
+  if status == "uploaded":
+    return 480
+  if status == "error":
+    return 482
+  if status.startswith("provisional"):
+    return 483
+  return 481
+
+
+###################################################################
+#
+# wait_for_change
+#
+def wait_for_change(read_status, since, wait_secs, interval_secs=0.25, progress_secs=5.0,
+                    max_interval_secs=2.0):
+  """
+  Re-reads a status until its status code differs from that of
+  since, or it differs from since and progress_secs have passed,
+  or wait_secs have passed
+
+  Parameters
+  ----------
+  read_status: function returning the current status,
+  since: the status the caller already knows (None: don't wait),
+  wait_secs: longest time to wait,
+  interval_secs: time between the first two reads,
+  progress_secs: shortest time to wait for a change of progress only,
+  max_interval_secs: longest time between reads (the interval
+    doubles after each read until it gets there)
+
+  Returns
+  -------
+  the last status read
+  """
+  started = time.monotonic()
+  deadline = started + wait_secs
+  interval = interval_secs
+
+  while True:
+    status = read_status()
+    if since is None or status_code(status) != status_code(since):
+      return status
+
+    now = time.monotonic()
+    if status != since and now - started >= progress_secs:
+      return status
+
+    remaining = deadline - now
+    if remaining <= 0:
+      return status
+
+    time.sleep(min(interval, remaining))
+    interval = min(interval * 2, max(interval_secs, max_interval_secs))
+
+
+###################################################################
+#
+# results_response
+#
+def results_response(dbConn, results_storage, jobid, wait_secs=0, since=None, interval_secs=0.25,
+                     progress_secs=5.0, max_interval_secs=2.0):
+  """
+  Handles GET /results/{jobid}
+
+  Parameters
+  ----------
+  dbConn: database connection,
+  results_storage: storage.Storage holding the results files,
+  jobid: the job (int),
+  wait_secs: how long to wait for a status other than since,
+  since: the status the client saw last, or None,
+  interval_secs: time between the first two reads of the jobs row,
+  progress_secs: shortest wait for a change of progress only,
+  max_interval_secs: longest time between reads of the jobs row
+
+  Returns
+  -------
+  (HTTP status code, body to serialize as JSON)
+  """
+  sql = "SELECT status, resultsfilekey FROM jobs WHERE jobid = %s;"
+
+  def read_row():
+    return datatier.retrieve_one_row(dbConn, sql, [jobid])
+
+  last = {}
+
+  def read_status():
+    last['row'] = read_row()
+    return last['row'][0] if last['row'] != () else None
+
+  if wait_secs > 0 and since is not None:
+    status = wait_for_change(read_status, since, wait_secs, interval_secs, progress_secs, max_interval_secs)
+  else:
+    status = read_status()
+
+  code = status_code(status)
+
+  if code == 400:
+    return (400, "no such job...")
+
+  if code == 200:
+    (data, _) = results_storage.read(last['row'][1])
+    return (200, {"data": base64.b64encode(data).decode("utf-8")})
+
+  if code == 483:
+    (data, _) = results_storage.read(last['row'][1])
+    return (483, {"data": base64.b64encode(data).decode("utf-8"), "status": status})
+
+  return (code, status)
+
+
+def parse_wait(params, max_wait_secs):
+  """
+  Returns (wait seconds, since status) from the query string
+  parameters, the wait capped at max_wait_secs.
+  """
+  params = params or {}
+
+  try:
+    wait_secs = float(params.get('wait', 0))
+  except ValueError:
+    wait_secs = 0.0
+
+  return (max(0.0, min(wait_secs, max_wait_secs)), params.get('since'))
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_results**")
+
+    jobid = (event.get('pathParameters') or {}).get('jobid', '')
+    if not jobid.isnumeric():
+      return {
+        'statusCode': 400,
+        'body': json.dumps("no such job...")
+      }
+
+    configur = ConfigParser()
+    configur.read('benfordapp-config.ini')
+
+    (wait_secs, since) = parse_wait(event.get('queryStringParameters'),
+                                    configur.getfloat('longpoll', 'max_wait_secs', fallback=25.0))
+
+    dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                                 int(configur.get('rds', 'port_number')),
+                                 configur.get('rds', 'user_name'),
+                                 configur.get('rds', 'user_pwd'),
+                                 configur.get('rds', 'db_name'))
+    #
+    # every read must see the latest committed status, not a
+    # snapshot from the first one:
+    #
+    dbConn.autocommit(True)
+
+    (status_code, body) = results_response(dbConn, storage.make_storage(configur), int(jobid),
+                                           wait_secs, since,
+                                           configur.getfloat('longpoll', 'interval_secs', fallback=0.25),
+                                           configur.getfloat('longpoll', 'progress_secs', fallback=5.0),
+                                           configur.getfloat('longpoll', 'max_interval_secs', fallback=2.0))
+
+    print("**DONE, returning", status_code, "**")
+
+    return {
+      'statusCode': status_code,
+      'body': json.dumps(body)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 500,
+      'body': json.dumps(str(err))
+    }
@@ -12,16 +12,22 @@
 #   CS 310
 #
 
-import requests
 import jsons
+import benford
+import clientmetrics
+import compression
 
-import uuid
+import json
 import pathlib
 import logging
 import sys
 import os
 import base64
+import hashlib
 import time
+import random
+import urllib.parse
+import atexit
 
 from configparser import ConfigParser
 
@@ -38,17 +44,6 @@ class User:
     self.pwdhash = row[2]
 
 
-class Job:
-
-  def __init__(self, row):
-    self.jobid = row[0]
-    self.userid = row[1]
-    self.status = row[2]
-    self.originaldatafile = row[3]
-    self.datafilekey = row[4]
-    self.resultsfilekey = row[5]
-
-
 ###################################################################
 #
 # web_service_get
@@ -63,9 +58,14 @@ def web_service_get(url):
   web services can fail to respond e.g. to heavy user or internet 
   traffic. If the web service responds with status code 200, 400 
   or 500, we consider this a valid response and return the response.
-  Otherwise we try again, at most 3 times. After 3 attempts the 
+  So are 403, 404 and 414 (no such route, or a URL too long for the
+  gateway): asking again would get the same answer. Otherwise we try
+  again, at most 3 times. After 3 attempts the 
   function returns with the last response.
   
+  The response may be compressed (Accept-Encoding); requests
+  decodes gzip itself, zstd is decoded here.
+  
   Parameters
   ----------
   url: url for calling the web service
@@ -77,11 +77,17 @@ def web_service_get(url):
 
   try:
     retries = 0
+
+    accept_encoding = ", ".join(compression.available_encodings() + ["deflate"])
     
     while True:
-      response = requests.get(url)
+      response = clientmetrics.request("GET", url, headers={'Accept-Encoding': accept_encoding})
+
+      encoding = response.headers.get('Content-Encoding', '')
+      if encoding == "zstd" and response.content.startswith(compression.ZSTD_MAGIC):
+        response._content = compression.decompress(response.content, "zstd")
         
-      if response.status_code in [200, 400, 480, 481, 482, 500]:
+      if response.status_code in [200, 400, 403, 404, 414, 480, 481, 482, 483, 500]:
         #
         # we consider this a successful call and response
         #
@@ -93,6 +99,7 @@ def web_service_get(url):
       retries = retries + 1
       if retries < 3:
         # try at most 3 times
+        clientmetrics.METRICS.retry("GET", url)
         time.sleep(retries)
         continue
           
@@ -111,6 +118,38 @@ def web_service_get(url):
     return None
     
 
+###################################################################
+#
+# post_json
+#
+# POSTs data as a JSON body, compressed with the given content
+# encoding ("gzip", "zstd", or "none"). PDFs are sent base64
+# encoded, which compresses well.
+#
+def post_json(url, data, encoding="none"):
+  """
+  Submits a POST request with a (compressed) JSON body
+
+  Parameters
+  ----------
+  url: url for calling the web service,
+  data: data to serialize as JSON,
+  encoding: content encoding for the body
+  
+  Returns
+  -------
+  response received from web service
+  """
+  body = json.dumps(data).encode("utf-8")
+  headers = {'Content-Type': 'application/json'}
+
+  if encoding not in ["none", "identity", ""]:
+    body = compression.compress(body, encoding)
+    headers['Content-Encoding'] = encoding
+
+  return clientmetrics.request("POST", url, data=body, headers=headers)
+
+
 ############################################################
 #
 # prompt
@@ -137,6 +176,9 @@ def prompt():
     print("   4 => upload pdf")
     print("   5 => download results")
     print("   6 => Upload and Poll")
+    print("   7 => analyze pdf locally")
+    print("   8 => query results")
+    print("   9 => download results of many jobs")
 
     cmd = input()
 
@@ -236,9 +278,55 @@ def users(baseurl):
 #
 # jobs
 #
+JOB_COLUMNS = ["jobid", "userid", "status", "originaldatafile", "datafilekey", "resultsfilekey", "created"]
+
+
+def filter_jobs_locally(rows, filters, columns):
+  """
+  Applies the filters and projection of a job listing to the full
+  rows returned by a web service that does not support them
+
+  Parameters
+  ----------
+  rows: list of rows (jobid, userid, status, originaldatafile,
+    datafilekey, resultsfilekey),
+  filters: dict of query string parameters (userid, status, since,
+    until, limit),
+  columns: list of columns to keep
+
+  Returns
+  -------
+  the filtered rows, projected on columns
+  """
+  if any(name in filters for name in ["since", "until"]):
+    print("(the web service has no job times, ignoring the time range)")
+
+  statuses = [s for s in filters.get('status', '').split(",") if s != ""]
+
+  def status_matches(status):
+    if len(statuses) == 0:
+      return True
+    return any(status.startswith(s[0:-1]) if s.endswith("*") else status == s for s in statuses)
+
+  result = []
+  for row in rows:
+    if 'userid' in filters and str(row[1]) != filters['userid']:
+      continue
+    if not status_matches(row[2]):
+      continue
+    job = dict(zip(JOB_COLUMNS, row))
+    result.append([job.get(c) for c in columns])
+
+  if 'limit' in filters:
+    result = result[0:int(filters['limit'])]
+
+  return result
+
+
 def jobs(baseurl):
   """
-  Prints out all the jobs in the database
+  Prints out the jobs in the database, optionally filtered by user,
+  status and time range, and projected on some of the columns
 
   Parameters
   ----------
@@ -250,11 +338,48 @@ def jobs(baseurl):
   """
 
   try:
+    #
+    # what jobs, and what about them?
+    #
+    filters = {}
+
+    print("Enter user id to filter by (ENTER for all users)>")
+    s = input().strip()
+    if s != "":
+      filters['userid'] = s
+
+    print("Enter status(es) to filter by, e.g. error,processing* (ENTER for all)>")
+    s = input().strip()
+    if s != "":
+      filters['status'] = s
+
+    print("Enter time range as since[,until], e.g. 2024-05-01 (ENTER for all time)>")
+    s = input().strip()
+    if s != "":
+      (since, _, until) = s.partition(",")
+      if since.strip() != "":
+        filters['since'] = since.strip()
+      if until.strip() != "":
+        filters['until'] = until.strip()
+
+    print("Enter columns to show, e.g. jobid,status (ENTER for all)>")
+    s = input().strip()
+    columns = JOB_COLUMNS[0:6]
+    if s != "":
+      columns = [c.strip() for c in s.split(",") if c.strip() != ""]
+      unknown = [c for c in columns if c not in JOB_COLUMNS]
+      if len(unknown) > 0:
+        print("**ERROR: unknown column(s)", ", ".join(unknown))
+        return
+      filters['columns'] = ",".join(columns)
+
     #
     # call the web service:
     #
     api = '/jobs'
     url = baseurl + api
+    if len(filters) > 0:
+      url += "?" + urllib.parse.urlencode(filters)
 
     # res = requests.get(url)
     res = web_service_get(url)
@@ -268,7 +393,7 @@ def jobs(baseurl):
       # failed:
       print("Failed with status code:", res.status_code)
       print("url: " + url)
-      if res.status_code == 500:
+      if res.status_code in [400, 500]:
         # we'll have an error message
         body = res.json()
         print("Error message:", body)
@@ -276,40 +401,269 @@ def jobs(baseurl):
       return
 
     #
-    # deserialize and extract jobs:
+    # deserialize; a web service that does not know about filters
+    # returns every job in full, so filter here:
     #
-    body = res.json()
-    #
-    # let's map each row into an Job object:
+    rows = res.json()
+
+    if 'X-Jobs-Columns' not in res.headers:
+      rows = filter_jobs_locally(rows, filters, columns)
+
+    if len(rows) == 0:
+      print("no jobs...")
+      return
+
+    for row in rows:
+      print(row[0])
+      for value in row[1:]:
+        print(" ", value)
     #
-    jobs = []
-    for row in body:
-      job = Job(row)
-      jobs.append(job)
+    return
+
+  except Exception as e:
+    logging.error("**ERROR: jobs() failed:")
+    logging.error("url: " + url)
+    logging.error(e)
+    return
+
+
+############################################################
+#
+# stats
+#
+def stats(baseurl):
+  """
+  Prints the completed jobs whose results match conditions such as
+  d1<25%,chisq>20 (first-digit frequencies, counts and the Benford
+  fit), queried from the server's results tables
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service
+
+  Returns
+  -------
+  nothing
+  """
+
+  try:
+    params = {}
+
+    print("Enter conditions, e.g. d1<25%,chisq>20 (fields d1..d9, c1..c9, units, total, chisq, mad)>")
+    s = input().strip()
+    if s != "":
+      params['where'] = s
+
+    print("Enter user id to filter by (ENTER for all users)>")
+    s = input().strip()
+    if s != "":
+      params['userid'] = s
+
+    print("Enter max number of jobs (ENTER for 1000)>")
+    s = input().strip()
+    if s != "":
+      params['limit'] = s
+
     #
-    # Now we can think OOP:
+    # call the web service:
     #
-    if len(jobs) == 0:
+    api = '/stats'
+    url = baseurl + api
+    if len(params) > 0:
+      url += "?" + urllib.parse.urlencode(params)
+
+    res = web_service_get(url)
+
+    if res.status_code != 200:
+      # failed:
+      print("Failed with status code:", res.status_code)
+      print("url: " + url)
+      if res.status_code in [400, 500]:
+        # we'll have an error message
+        body = res.json()
+        print("Error message:", body)
+      #
+      return
+
+    rows = res.json()
+
+    if len(rows) == 0:
       print("no jobs...")
       return
 
-    for job in jobs:
-      print(job.jobid)
-      print(" ", job.userid)
-      print(" ", job.status)
-      print(" ", job.originaldatafile)
-      print(" ", job.datafilekey)
-      print(" ", job.resultsfilekey)
+    #
+    # jobid, userid, file, unit, units, total, chisq, mad, d1..d9:
+    #
+    print(f"{'jobid':>8} {'userid':>8} {'units':>12} {'total':>10} {'chisq':>9} {'mad':>7}  "
+          + " ".join(f"{'d' + str(d):>5}" for d in range(1, 10)) + "  file")
+    for row in rows:
+      print(f"{row[0]:>8} {row[1]:>8} {str(row[4]) + ' ' + row[3]:>12} {row[5]:>10} {row[6]:>9.2f} {row[7]:>7.4f}  "
+            + " ".join(f"{f * 100:>4.1f}%" for f in row[8:17]) + f"  {row[2]}")
+    print(len(rows), "jobs")
     #
     return
 
   except Exception as e:
-    logging.error("**ERROR: jobs() failed:")
+    logging.error("**ERROR: stats() failed:")
     logging.error("url: " + url)
     logging.error(e)
     return
 
 
+############################################################
+#
+# download_batch
+#
+def parse_jobids(text):
+  """
+  Returns the job ids in text such as "1001,1002,1010-1020", in
+  order and without duplicates; raises ValueError if malformed
+  """
+  jobids = []
+  for part in text.split(","):
+    part = part.strip()
+    if part == "":
+      continue
+    (first, _, last) = part.partition("-")
+    if not first.strip().isnumeric() or (last != "" and not last.strip().isnumeric()):
+      raise ValueError(f"'{part}' is not a job id or range of job ids")
+    last = last if last != "" else first
+    jobids.extend(range(int(first), int(last) + 1))
+  return list(dict.fromkeys(jobids))
+
+
+def write_results(directory, jobid, datastr):
+  """
+  Decodes a job's base64 results and writes them to <jobid>.txt in
+  directory; returns the filename
+  """
+  raw_bytes = compression.sniff_decompress(base64.b64decode(datastr))
+  filename = os.path.join(directory, f"{jobid}.txt")
+  with open(filename, "wb") as outfile:
+    outfile.write(raw_bytes)
+  return filename
+
+
+def download_batch(baseurl, batch_size=100):
+  """
+  Prompts for a list of job ids and a directory, and writes the
+  results of the completed jobs there, one file per job, fetching
+  them batch_size jobs per call (GET /results?jobids=...) instead
+  of one call per job. Falls back to one call per job if the web
+  service has no batch endpoint.
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service,
+  batch_size: number of jobs asked for per call
+
+  Returns
+  -------
+  nothing
+  """
+
+  try:
+    print("Enter job ids, e.g. 1001,1002,1010-1020>")
+    try:
+      jobids = parse_jobids(input())
+    except ValueError as err:
+      print("**ERROR:", str(err))
+      return
+
+    if len(jobids) == 0:
+      print("no job ids...")
+      return
+
+    print("Enter directory to write results to (ENTER for ./results)>")
+    directory = input().strip() or "results"
+    os.makedirs(directory, exist_ok=True)
+
+    start = time.time()
+    calls = 0
+    written = 0
+    not_ready = []
+    provisional = []
+    failed = []
+
+    pending = list(jobids)
+    batched = True
+
+    while len(pending) > 0:
+      chunk = pending[0:batch_size]
+      pending = pending[batch_size:]
+
+      if batched:
+        url = f"{baseurl}/results?" + urllib.parse.urlencode({'jobids': ",".join(str(j) for j in chunk)})
+        res = web_service_get(url)
+        calls += 1
+
+        if res.status_code in [403, 404, 414]:
+          # no batch endpoint (or it cannot take this many ids), ask
+          # job by job:
+          print("Web service has no batch endpoint, downloading job by job...")
+          batched = False
+          pending = chunk + pending
+          continue
+
+        if res.status_code != 200:
+          print("Failed with status code:", res.status_code)
+          print("url: " + url)
+          if res.status_code in [400, 500]:
+            print("Error message:", res.json())
+          return
+
+        lines = [json.loads(line) for line in res.text.splitlines() if line.strip() != ""]
+      else:
+        lines = []
+        for jobid in chunk:
+          res = web_service_get(f"{baseurl}/results/{jobid}")
+          calls += 1
+          if res.status_code == 200:
+            lines.append({"jobid": jobid, "status": 200, "data": res.json().get("data")})
+          elif res.status_code == 483:
+            body = res.json()
+            lines.append({"jobid": jobid, "status": 483, "message": body.get("status"), "data": body.get("data")})
+          else:
+            lines.append({"jobid": jobid, "status": res.status_code, "message": res.json()})
+
+      #
+      # one line per job; jobs that did not fit in the response
+      # (503) are asked for again:
+      #
+      retry = []
+      for line in lines:
+        jobid = line["jobid"]
+        if line["status"] == 200:
+          write_results(directory, jobid, line["data"])
+          written += 1
+        elif line["status"] == 503:
+          retry.append(jobid)
+        elif line["status"] == 483:
+          # the estimate of a huge PDF, written all the same:
+          write_results(directory, jobid, line["data"])
+          written += 1
+          provisional.append((jobid, line.get("message")))
+        elif line["status"] in [480, 481]:
+          not_ready.append((jobid, line.get("message")))
+        else:
+          failed.append((jobid, line.get("message")))
+      pending = retry + pending
+
+    print(f"{written} results written to {directory}/, in {calls} calls, {time.time() - start:.2f} seconds")
+    for (jobid, message) in provisional:
+      print(f"  job {jobid}: provisional results, estimated from a sample ({message})")
+    for (jobid, message) in not_ready:
+      print(f"  job {jobid}: no results yet ({message})")
+    for (jobid, message) in failed:
+      print(f"  job {jobid}: {message}")
+    return
+
+  except Exception as e:
+    logging.error("**ERROR: download_batch() failed:")
+    logging.error(e)
+    return
+
+
 ############################################################
 #
 # reset
@@ -334,7 +688,7 @@ def reset(baseurl):
     api = '/reset'
     url = baseurl + api
 
-    res = requests.delete(url)
+    res = clientmetrics.request("DELETE", url)
 
     #
     # let's look at what we got back:
@@ -369,18 +723,76 @@ def reset(baseurl):
     return
 
 
+############################################################
+#
+# lookup before upload
+#
+# The service keeps the SHA-256 of every PDF it has analyzed, so
+# before uploading a file we ask whether the user already has
+# results for the same contents, and skip the upload on a hit.
+#
+def file_sha256(local_filename):
+  """
+  Returns the hex SHA-256 of a file's contents
+  """
+  digest = hashlib.sha256()
+  with open(local_filename, "rb") as infile:
+    for chunk in iter(lambda: infile.read(1024 * 1024), b""):
+      digest.update(chunk)
+  return digest.hexdigest()
+
+
+def lookup_results(baseurl, userid, local_filename):
+  """
+  Asks the web service for existing results of a file
+
+  Parameters
+  ----------
+  baseurl: baseurl for web service,
+  userid: user id (string),
+  local_filename: the PDF
+
+  Returns
+  -------
+  (jobid, results as a string) if the user has a completed job
+  for the same contents, otherwise None (also when the lookup
+  fails, in which case the caller simply uploads)
+  """
+  try:
+    url = f"{baseurl}/lookup/{userid}/{file_sha256(local_filename)}"
+
+    res = web_service_get(url)
+
+    if res is None or res.status_code != 200:
+      return None
+
+    body = res.json()
+    raw_bytes = base64.b64decode(body["data"].encode())
+    raw_bytes = compression.sniff_decompress(raw_bytes)  # results may be stored compressed
+
+    return (body["jobid"], raw_bytes.decode("utf-8"))
+
+  except Exception as e:
+    logging.error("lookup_results() failed, uploading instead:")
+    logging.error(e)
+    return None
+
+
 ############################################################
 #
 # upload
 #
-def upload(baseurl):
+def upload(baseurl, encoding="none", dedupe=True):
   """
   Prompts the user for a local filename and user id, 
   and uploads that asset (PDF) to S3 for processing. 
 
   Parameters
   ----------
-  baseurl: baseurl for web service
+  baseurl: baseurl for web service,
+  encoding: content encoding for the request body,
+  dedupe: look up existing results of the same file first, and
+    don't upload it again if there are any
 
   Returns
   -------
@@ -401,6 +813,17 @@ def upload(baseurl):
     print("Enter user id>")
     userid = input()
 
+    #
+    # analyzed before? then there is nothing to upload:
+    #
+    if dedupe:
+      found = lookup_results(baseurl, userid, local_filename)
+      if found is not None:
+        (jobid, results) = found
+        print("PDF already analyzed, job id =", jobid, "(not uploaded again)")
+        print(results)
+        return
+
     #
     # build the data packet. First step is read the PDF
     # as raw bytes:
@@ -427,7 +850,7 @@ def upload(baseurl):
     # call the web service:
     # using post
     url = f"{baseurl}/pdf/{userid}"
-    res = requests.post(url, json=data)  # Send data in the POST request
+    res = post_json(url, data, encoding)  # Send data in the POST request
     #
     # let's look at what we got back:
     #
@@ -496,7 +919,7 @@ def download(baseurl):
     #
     # Call the web service:
     #
-    res = requests.get(url)  # Sending a GET request to the API
+    res = web_service_get(url)  # Sending a GET request to the API
 
     
     #
@@ -504,6 +927,10 @@ def download(baseurl):
     #
     if res.status_code == 200: #success
       pass
+    elif res.status_code == 483: # provisional, estimated from a sample
+      body = res.json()
+      print("Provisional results, estimated from a sample of pages")
+      print("Job status:", body.get("status"))
     elif res.status_code == 400: # no such job
       body = res.json()
       print(body)
@@ -550,6 +977,7 @@ def download(baseurl):
     # Decode the base64 string to get raw bytes
     base64_bytes = datastr.encode()  # Convert the base64 string to bytes
     raw_bytes = base64.b64decode(base64_bytes)  # Decode the base64 bytes to get raw bytes
+    raw_bytes = compression.sniff_decompress(raw_bytes)  # results may be stored compressed
     results = raw_bytes.decode("utf-8")  # Decode the raw bytes to a printable string (assuming UTF-8)
     print(results)
     return
@@ -560,18 +988,37 @@ def download(baseurl):
     logging.error(e)
     return
 
-import requests
-import base64
-import time
-import random
+#
+# long polls are sent at least this far apart: a poll that comes
+# back early, e.g. with new progress from a server that does not
+# hold requests, is not repeated back to back
+#
+LONG_POLL_MIN_SECS = 1.0
+
 
-def upload_and_poll(baseurl):
+def upload_and_poll(baseurl, encoding="none", local_threshold=0, workers=1, dedupe=True, long_poll_secs=20):
     """
     Upload a PDF and poll the server until results are ready or an error occurs.
+    If local_threshold is set, PDFs of at most that many bytes are
+    analyzed locally instead, since the round trip costs far more than
+    the computation (but no job is created for them).
+
+    With long polling, each poll after the first passes the status seen
+    last (?wait=...&since=...) and the server holds the request until
+    the status changes, so there is one request per status change
+    instead of one every few seconds. A server that answers at once
+    with an unchanged status does not long-poll; then the client falls
+    back to sleeping between polls.
 
     Parameters
     ----------
-    baseurl: baseurl for web service
+    baseurl: baseurl for web service,
+    encoding: content encoding for the upload request body,
+    local_threshold: size in bytes up to which PDFs are analyzed locally
+      (0: never),
+    workers: number of processes for local analysis,
+    dedupe: look up existing results of the same file before uploading,
+    long_poll_secs: how long the server may hold a poll (0: don't long-poll)
 
     Returns
     -------
@@ -585,9 +1032,25 @@ def upload_and_poll(baseurl):
             print(f"PDF file '{local_filename}' does not exist...")
             return
 
+        file_size = os.path.getsize(local_filename)
+        if local_threshold > 0 and file_size <= local_threshold and local_analysis_available():
+            print(f"PDF is {file_size} bytes, analyzing locally...")
+            analyze_local(local_filename, workers)
+            return
+
         print("Enter user id>")
         userid = input()
 
+        # Analyzed before? Then skip the upload and the polling
+        if dedupe:
+            found = lookup_results(baseurl, userid, local_filename)
+            if found is not None:
+                (jobid, results) = found
+                print(f"PDF already analyzed, job ID: {jobid} (not uploaded again)")
+                print("Results:")
+                print(results)
+                return
+
         # Read and upload the PDF
         with open(local_filename, "rb") as infile:
             file_bytes = infile.read()
@@ -598,7 +1061,7 @@ def upload_and_poll(baseurl):
         # Upload the PDF by calling the API Gateway
         upload_url = f"{baseurl}/pdf/{userid}"
         print(f"Uploading to URL: {upload_url}")
-        upload_res = requests.post(upload_url, json=data)
+        upload_res = post_json(upload_url, data, encoding)
 
         if upload_res.status_code != 200:
             print(f"Failed to upload. Status code: {upload_res.status_code}")
@@ -612,9 +1075,19 @@ def upload_and_poll(baseurl):
         poll_url = f"{baseurl}/results/{jobid}"
         print(f"Polling URL: {poll_url}")
 
+        since = None  # the job status seen last
+        polls = 0
+
         while True:
-            poll_res = requests.get(poll_url)
+            url = poll_url
+            if long_poll_secs > 0 and since is not None:
+                url += "?" + urllib.parse.urlencode({'wait': long_poll_secs, 'since': since})
+
+            started = time.time()
+            poll_res = web_service_get(url)
+            elapsed = time.time() - started
             status_code = poll_res.status_code
+            polls += 1
 
             print(f"Polling... Status code: {status_code}")
 
@@ -640,14 +1113,40 @@ def upload_and_poll(baseurl):
                 # Decode base64 data
                 base64_bytes = datastr.encode()
                 raw_bytes = base64.b64decode(base64_bytes)
+                raw_bytes = compression.sniff_decompress(raw_bytes)  # results may be stored compressed
                 results = raw_bytes.decode("utf-8")  # Convert raw bytes to a printable string
 
                 print("Results:")
                 print(results)                
+                print(f"({polls} polls)")
                 return
             elif status_code == 400:  # No such job
                 print(f"Error: {poll_res.json()}")
                 return
+            elif status_code == 483:  # provisional results of a huge PDF
+                body = poll_res.json()
+                job_status = body.get("status", "provisional")
+                # show the estimate once, when it first comes in
+                if since is None or not since.startswith("provisional"):
+                    raw_bytes = compression.sniff_decompress(base64.b64decode(body.get("data", "")))
+                    print("Provisional results, estimated from a sample of pages:")
+                    print(raw_bytes.decode("utf-8"))
+                # Without an exact tally to follow, these are the results
+                if job_status == "provisional":
+                    print(f"({polls} polls)")
+                    return
+                print("Exact tally in progress...")
+                print(f"Job status: {job_status}")
+                if long_poll_secs > 0:
+                    unchanged = since is not None and job_status == since
+                    since = job_status
+                    if not unchanged or elapsed >= long_poll_secs / 2:
+                        # poll again right away, the server waits (but
+                        # not sooner than LONG_POLL_MIN_SECS apart)
+                        time.sleep(max(0.0, LONG_POLL_MIN_SECS - elapsed))
+                        continue
+                    print("Server does not long-poll, polling every few seconds...")
+                    long_poll_secs = 0
             elif status_code in [480, 481, 482]:
                 job_status = poll_res.text.strip('"')  # Extract the job status
                 print("Job still in progress...")
@@ -656,6 +1155,17 @@ def upload_and_poll(baseurl):
                 if "error" in job_status.lower():
                     print("Job encountered an error, exiting polling.")
                     return
+                if long_poll_secs > 0:
+                    job_status = poll_res.json()
+                    unchanged = since is not None and job_status == since
+                    since = job_status
+                    if not unchanged or elapsed >= long_poll_secs / 2:
+                        # poll again right away, the server waits (but
+                        # not sooner than LONG_POLL_MIN_SECS apart)
+                        time.sleep(max(0.0, LONG_POLL_MIN_SECS - elapsed))
+                        continue
+                    print("Server does not long-poll, polling every few seconds...")
+                    long_poll_secs = 0
             elif status_code >= 500:  # Server/network error
                 print(f"Server error. Status code: {status_code}")
                 print(f"Error message: {poll_res.text}")
@@ -673,96 +1183,218 @@ def upload_and_poll(baseurl):
         print(f"An unexpected error occurred: {e}")
 
 
+############################################################
+#
+# local analysis
+#
+def local_analysis_available():
+  """
+  Returns True if pypdf is installed, which local analysis needs
+  """
+  try:
+    import pypdf
+    return True
+  except ImportError:
+    return False
+
+
+def analyze_local(local_filename, workers=1):
+  """
+  Analyzes a PDF in-process with the same engine as the lambda
+  function, and prints the results in the same format
+
+  Parameters
+  ----------
+  local_filename: path of the PDF,
+  workers: number of processes to spread the pages over
+
+  Returns
+  -------
+  the results (string)
+  """
+  start = time.perf_counter()
+  (number_of_pages, digit_count) = benford.analyze_pdf(local_filename, workers)
+  elapsed = time.perf_counter() - start
+
+  results = benford.format_results(number_of_pages, digit_count)
+  print(results)
+  print(f"(analyzed locally in {elapsed:.2f} seconds)")
+  return results
+
+
+def analyze(workers=1):
+  """
+  Prompts the user for a local filename, and analyzes that PDF
+  locally, without calling the web service.
+
+  Parameters
+  ----------
+  workers: number of processes to spread the pages over
+
+  Returns
+  -------
+  nothing
+  """
+  try:
+    print("Enter PDF filename>")
+    local_filename = input()
+
+    if not pathlib.Path(local_filename).is_file():
+      print("PDF file '", local_filename, "' does not exist...")
+      return
+
+    if not local_analysis_available():
+      print("Local analysis needs the pypdf package, please install it")
+      return
+
+    analyze_local(local_filename, workers)
+    return
+
+  except Exception as e:
+    logging.error("**ERROR: analyze() failed:")
+    logging.error(e)
+    return
+
+
 ############################################################
 # main
 #
-try:
-  print('** Welcome to BenfordApp **')
-  print()
-
-  # eliminate traceback so we just get error message:
-  sys.tracebacklimit = 0
-
-  #
-  # what config file should we use for this session?
-  #
-  config_file = 'benfordapp-client-config.ini'
-
-  print("Config file to use for this session?")
-  print("Press ENTER to use default, or")
-  print("enter config file name>")
-  s = input()
-
-  if s == "":  # use default
-    pass  # already set
-  else:
-    config_file = s
-
-  #
-  # does config file exist?
-  #
-  if not pathlib.Path(config_file).is_file():
-    print("**ERROR: config file '", config_file, "' does not exist, exiting")
-    sys.exit(0)
+if __name__ == "__main__":
+  try:
+    print('** Welcome to BenfordApp **')
+    print()
 
-  #
-  # setup base URL to web service:
-  #
-  configur = ConfigParser()
-  configur.read(config_file)
-  baseurl = configur.get('client', 'webservice')
-
-  #
-  # make sure baseurl does not end with /, if so remove:
-  #
-  if len(baseurl) < 16:
-    print("**ERROR: baseurl '", baseurl, "' is not nearly long enough...")
-    sys.exit(0)
+    # eliminate traceback so we just get error message:
+    sys.tracebacklimit = 0
 
-  if baseurl == "https://YOUR_GATEWAY_API.amazonaws.com":
-    print("**ERROR: update config file with your gateway endpoint")
-    sys.exit(0)
+    #
+    # what config file should we use for this session?
+    #
+    config_file = 'benfordapp-client-config.ini'
 
-  if baseurl.startswith("http:"):
-    print("**ERROR: your URL starts with 'http', it should start with 'https'")
-    sys.exit(0)
+    print("Config file to use for this session?")
+    print("Press ENTER to use default, or")
+    print("enter config file name>")
+    s = input()
 
-  lastchar = baseurl[len(baseurl) - 1]
-  if lastchar == "/":
-    baseurl = baseurl[:-1]
-
-  #
-  # main processing loop:
-  #
-  cmd = prompt()
-
-  while cmd != 0:
-    #
-    if cmd == 1:
-      users(baseurl)
-    elif cmd == 2:
-      jobs(baseurl)
-    elif cmd == 3:
-      reset(baseurl)
-    elif cmd == 4:
-      upload(baseurl)
-    elif cmd == 5:
-      download(baseurl)
-    elif cmd == 6:
-      upload_and_poll(baseurl)
+    if s == "":  # use default
+      pass  # already set
     else:
-      print("** Unknown command, try again...")
+      config_file = s
+
+    #
+    # does config file exist?
+    #
+    if not pathlib.Path(config_file).is_file():
+      print("**ERROR: config file '", config_file, "' does not exist, exiting")
+      sys.exit(0)
+
+    #
+    # setup base URL to web service:
+    #
+    configur = ConfigParser()
+    configur.read(config_file)
+    baseurl = configur.get('client', 'webservice')
+
+    #
+    # make sure baseurl does not end with /, if so remove:
+    #
+    if len(baseurl) < 16:
+      print("**ERROR: baseurl '", baseurl, "' is not nearly long enough...")
+      sys.exit(0)
+
+    if baseurl == "https://YOUR_GATEWAY_API.amazonaws.com":
+      print("**ERROR: update config file with your gateway endpoint")
+      sys.exit(0)
+
+    # (plain http only for a local stub server, see stubserver.py)
+    if baseurl.startswith("http:") and not baseurl.startswith(("http://127.0.0.1", "http://localhost")):
+      print("**ERROR: your URL starts with 'http', it should start with 'https'")
+      sys.exit(0)
+
+    lastchar = baseurl[len(baseurl) - 1]
+    if lastchar == "/":
+      baseurl = baseurl[:-1]
+
+    #
+    # compress uploads? "gzip", "zstd" (needs the zstandard
+    # package) or "none":
+    #
+    encoding = configur.get('client', 'compression', fallback='none')
+
+    #
+    # PDFs up to this size are analyzed locally by "upload and
+    # poll", using this many processes. Off (0) unless configured:
+    # a PDF analyzed locally gets no job, so it is missing from
+    # /jobs, the aggregates and /stats.
+    #
+    local_threshold = configur.getint('client', 'local_threshold_bytes', fallback=0)
+    workers = configur.getint('client', 'local_workers', fallback=os.cpu_count() or 1)
+
+    #
+    # ask for existing results of a file before uploading it:
+    #
+    dedupe = configur.getboolean('client', 'dedupe', fallback=True)
+
+    #
+    # how long the server may hold a status poll of "upload and
+    # poll" until the job's status changes (0 to poll every few
+    # seconds instead):
+    #
+    long_poll_secs = configur.getint('client', 'long_poll_secs', fallback=20)
+
+    #
+    # jobs asked for per call when downloading the results of
+    # many jobs:
+    #
+    batch_size = configur.getint('client', 'batch_size', fallback=100)
+
+    #
+    # latency, status codes, retries and bytes per endpoint, dumped
+    # at exit: "none", "report" or "prometheus" (see clientmetrics.py):
+    #
+    metrics = configur.get('client', 'metrics', fallback='none')
+    if metrics != 'none':
+      atexit.register(clientmetrics.METRICS.dump, metrics, configur.get('client', 'metrics_file', fallback=None))
+
+    #
+    # main processing loop:
     #
     cmd = prompt()
 
-  #
-  # done
-  #
-  print()
-  print('** done **')
-  sys.exit(0)
-
-except Exception as e:
-  logging.error("**ERROR: main() failed:")
-  logging.error(e)
-  sys.exit(0)
+    while cmd != 0:
+      #
+      if cmd == 1:
+        users(baseurl)
+      elif cmd == 2:
+        jobs(baseurl)
+      elif cmd == 3:
+        reset(baseurl)
+      elif cmd == 4:
+        upload(baseurl, encoding, dedupe)
+      elif cmd == 5:
+        download(baseurl)
+      elif cmd == 6:
+        upload_and_poll(baseurl, encoding, local_threshold, workers, dedupe, long_poll_secs)
+      elif cmd == 7:
+        analyze(workers)
+      elif cmd == 8:
+        stats(baseurl)
+      elif cmd == 9:
+        download_batch(baseurl, batch_size)
+      else:
+        print("** Unknown command, try again...")
+      #
+      cmd = prompt()
+
+    #
+    # done
+    #
+    print()
+    print('** done **')
+    sys.exit(0)
+
+  except Exception as e:
+    logging.error("**ERROR: main() failed:")
+    logging.error(e)
+    sys.exit(0)
@@ -0,0 +1,154 @@
+#
+# migrations.py
+#
+# Schema migrations of the benfordapp database, applied in order
+# and recorded in the schemamigrations table, so each one runs once:
+#
+#   python3 migrations.py migrate    applies the pending migrations
+#   python3 migrations.py status     lists applied / pending ones
+#
+# The tables of the other modules (aggregates.py, pagecache.py,
+# jobstats.py) are created by migrations too, from their
+# CREATE_TABLES, so one command brings a database up to date; their
+# own "create" commands still work. New schema changes are appended to MIGRATIONS, never
+# edited once released. MySQL commits DDL statements implicitly, so
+# a migration is recorded after its statements have all run; write
+# them so a migration that failed halfway can be completed by hand.
+#
+
+import aggregates
+import datatier
+import jobstats
+import pagecache
+import sys
+
+
+CREATE_MIGRATIONS_TABLE = """
+  CREATE TABLE IF NOT EXISTS schemamigrations (
+    name      varchar(64) NOT NULL,
+    applied   datetime NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (name)
+  );
+"""
+
+#
+# (name, list of SQL statements), in the order they are applied:
+#
+MIGRATIONS = [
+  ("0001_userstats_tables", aggregates.CREATE_TABLES),
+  ("0002_pagedigests_table", pagecache.CREATE_TABLES),
+  ("0003_jobs_created", [
+    """
+    ALTER TABLE jobs ADD COLUMN created datetime NOT NULL DEFAULT CURRENT_TIMESTAMP;
+    """
+  ]),
+  #
+  # job listings filter by user and status (and time), and the
+  # lambda updates jobs by datafilekey on every page:
+  #
+  ("0004_jobs_indexes", [
+    """
+    CREATE INDEX jobs_userid_status ON jobs (userid, status, created);
+    """,
+    """
+    CREATE INDEX jobs_datafilekey ON jobs (datafilekey);
+    """
+  ]),
+  #
+  # the owner and lease of a job's claim, see jobclaim.py:
+  #
+  ("0005_jobs_claim", [
+    """
+    ALTER TABLE jobs ADD COLUMN claimowner varchar(36) NULL,
+                     ADD COLUMN leaseexpires datetime NULL;
+    """
+  ]),
+  #
+  # the SHA-256 of each processed PDF, for the client's lookup
+  # before uploading, see resultslookup.py:
+  #
+  ("0006_jobs_datafilehash", [
+    """
+    ALTER TABLE jobs ADD COLUMN datafilehash char(64) NULL;
+    """,
+    """
+    CREATE INDEX jobs_userid_datafilehash ON jobs (userid, datafilehash);
+    """
+  ]),
+  #
+  # each completed job's histogram and fit, for queries across
+  # jobs, see statsquery.py:
+  #
+  ("0007_jobstats_tables", jobstats.CREATE_TABLES + jobstats.CREATE_INDEXES)
+]
+
+
+###################################################################
+#
+# applied_migrations
+#
+def applied_migrations(dbConn):
+  """
+  Returns the set of names of the migrations already applied.
+  """
+  datatier.perform_action(dbConn, CREATE_MIGRATIONS_TABLE)
+
+  rows = datatier.retrieve_all_rows(dbConn, "SELECT name FROM schemamigrations;")
+  return set(row[0] for row in rows)
+
+
+###################################################################
+#
+# migrate
+#
+def migrate(dbConn):
+  """
+  Applies the pending migrations in order
+
+  Parameters
+  ----------
+  dbConn: database connection
+
+  Returns
+  -------
+  list of the names of the migrations applied
+  """
+  applied = applied_migrations(dbConn)
+
+  done = []
+  for (name, statements) in MIGRATIONS:
+    if name in applied:
+      continue
+
+    print("applying", name)
+    datatier.perform_actions(dbConn, [(sql, []) for sql in statements])
+    datatier.perform_action(dbConn, "INSERT INTO schemamigrations (name) VALUES (%s);", [name])
+    done.append(name)
+
+  return done
+
+
+if __name__ == "__main__":
+  from configparser import ConfigParser
+
+  if len(sys.argv) < 2 or sys.argv[1] not in ["migrate", "status"]:
+    print("usage: python3 migrations.py migrate | status")
+    sys.exit(0)
+
+  configur = ConfigParser()
+  configur.read('benfordapp-config.ini')
+
+  dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                               int(configur.get('rds', 'port_number')),
+                               configur.get('rds', 'user_name'),
+                               configur.get('rds', 'user_pwd'),
+                               configur.get('rds', 'db_name'))
+
+  if sys.argv[1] == "migrate":
+    done = migrate(dbConn)
+    print(len(done), "migrations applied")
+
+  else:
+    applied = applied_migrations(dbConn)
+    for (name, _) in MIGRATIONS:
+      print("applied" if name in applied else "pending", name)
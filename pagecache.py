@@ -0,0 +1,367 @@
+#
+# pagecache.py
+#
+# Cache of per-page digit histograms, keyed by a digest of what
+# determines a page's extracted text: its content stream, and the
+# fonts and form XObjects in its resources. Identical pages that
+# recur across filings (cover sheets, standard disclosures,
+# schedule templates) are then tallied once, and later only looked
+# up, before paying for extract_text(). A page is digested when it
+# is about to be tallied, not when the document is opened, so a
+# sampled huge document (see sampling.py) only digests its sample
+# before publishing the estimate; lookups in the backing store are
+# batched over the next batch_pages pages. The digest is salted
+# with benford.TALLY_VERSION, so histograms tallied under an older
+# rule are not reused.
+#
+# The cache is an LRU of bounded size in process memory, so it is
+# shared by every record and every warm invocation of a container.
+# It can be backed by a table in RDS, shared by all containers:
+#
+#   [pagecache]
+#   enabled = true        (default)
+#   capacity = 10000      pages kept in memory
+#   store = none | rds    persistent backing store
+#
+# The RDS table is created by "python3 pagecache.py create".
+#
+
+import benford
+import datatier
+import hashlib
+import threading
+
+from collections import OrderedDict
+
+
+CREATE_TABLES = [
+  """
+  CREATE TABLE IF NOT EXISTS pagedigests (
+    digest    char(64) NOT NULL,
+    count0    int NOT NULL,
+    count1    int NOT NULL,
+    count2    int NOT NULL,
+    count3    int NOT NULL,
+    count4    int NOT NULL,
+    count5    int NOT NULL,
+    count6    int NOT NULL,
+    count7    int NOT NULL,
+    count8    int NOT NULL,
+    count9    int NOT NULL,
+    PRIMARY KEY (digest)
+  );
+  """
+]
+
+COUNT_COLUMNS = ", ".join(f"count{i}" for i in range(10))
+
+
+###################################################################
+#
+# page_digest
+#
+# Entries left out of the digest: embedded font programs, which are
+# large and play no part in the extracted text, and references up
+# the page tree
+#
+_SKIP_KEYS = {'/FontFile', '/FontFile2', '/FontFile3', '/Parent'}
+
+
+def _hash_value(h, value, seen):
+  """
+  Feeds a PDF value into h by its content: dictionaries by sorted
+  key, streams by their decoded data, and references by the object
+  they point to, never by repr() (an IndirectObject's holds the
+  id() of its reader). seen numbers the objects hashed so far, so
+  shared and cyclic ones are hashed once.
+  """
+  if hasattr(value, 'idnum'):
+    ref = (value.idnum, value.generation)
+    if ref in seen:
+      h.update(f"@{seen[ref]}".encode())
+      return
+    seen[ref] = len(seen)
+    value = value.get_object()
+
+  if hasattr(value, 'get_data'):
+    h.update(b"stream")
+    h.update(value.get_data())
+  elif isinstance(value, dict):
+    h.update(b"<<")
+    for (key, item) in sorted(dict.items(value), key=lambda entry: entry[0]):
+      if key not in _SKIP_KEYS:
+        h.update(key.encode())
+        _hash_value(h, item, seen)
+    h.update(b">>")
+  elif isinstance(value, list):
+    h.update(b"[")
+    for item in value:
+      _hash_value(h, item, seen)
+    h.update(b"]")
+  else:
+    h.update(repr(value).encode())
+
+
+def _hash_fonts(h, resources, seen):
+  fonts = resources.get('/Font')
+  if fonts is None:
+    return
+  fonts = fonts.get_object()
+  for name in sorted(fonts.keys()):
+    h.update(name.encode())
+    # the whole font: /Subtype, /BaseFont, /Encoding, /Widths,
+    # /FontDescriptor, /ToUnicode, /DescendantFonts, ...
+    _hash_value(h, dict.__getitem__(fonts, name), seen)
+
+
+def page_digest(page):
+  """
+  Returns a hex digest of everything that determines the text
+  extract_text() gets from a pypdf page
+
+  Parameters
+  ----------
+  page: pypdf PageObject
+
+  Returns
+  -------
+  sha256 hex digest (string)
+  """
+  h = hashlib.sha256()
+  h.update(benford.TALLY_VERSION.encode())
+  seen = {}
+
+  contents = page.get_contents()
+  if contents is not None:
+    h.update(contents.get_data())
+
+  _hash_value(h, page.get('/Rotate', 0), seen)
+
+  resources = page.get('/Resources')
+  if resources is not None:
+    resources = resources.get_object()
+    _hash_fonts(h, resources, seen)
+
+    #
+    # text can also be drawn by form XObjects:
+    #
+    xobjects = resources.get('/XObject')
+    if xobjects is not None:
+      xobjects = xobjects.get_object()
+      for name in sorted(xobjects.keys()):
+        xobject = xobjects[name].get_object()
+        if xobject.get('/Subtype') == '/Form':
+          h.update(name.encode())
+          h.update(xobject.get_data())
+          if '/Resources' in xobject:
+            _hash_fonts(h, xobject['/Resources'].get_object(), seen)
+
+  return h.hexdigest()
+
+
+###################################################################
+#
+# RDSPageStore
+#
+# Persistent backing store in the pagedigests table. Lookups and
+# saves are batched: one SELECT ... IN (...) per chunk of digests
+# before a document is processed, one multi-row INSERT after.
+#
+class RDSPageStore:
+
+  def __init__(self, get_dbConn, chunk_size=500):
+    self.get_dbConn = get_dbConn
+    self.chunk_size = chunk_size
+
+  def fetch(self, digests):
+    found = {}
+    for i in range(0, len(digests), self.chunk_size):
+      chunk = digests[i:i + self.chunk_size]
+      sql = f"SELECT digest, {COUNT_COLUMNS} FROM pagedigests WHERE digest IN ({', '.join(['%s'] * len(chunk))});"
+      for row in datatier.retrieve_all_rows(self.get_dbConn(), sql, chunk):
+        found[row[0]] = [int(c) for c in row[1:]]
+    return found
+
+  def save(self, entries):
+    items = list(entries.items())
+    for i in range(0, len(items), self.chunk_size):
+      chunk = items[i:i + self.chunk_size]
+      values = ", ".join(["(" + ", ".join(["%s"] * 11) + ")"] * len(chunk))
+      sql = f"INSERT IGNORE INTO pagedigests (digest, {COUNT_COLUMNS}) VALUES {values};"
+      parameters = []
+      for (digest, counts) in chunk:
+        parameters += [digest] + counts
+      datatier.perform_action(self.get_dbConn(), sql, parameters)
+
+
+###################################################################
+#
+# PageCache
+#
+# Bounded LRU of digest -> [count0, ..., count9], safe to share
+# between threads, with an optional backing store.
+#
+class PageCache:
+
+  def __init__(self, capacity=10000, store=None):
+    self.capacity = capacity
+    self.store = store
+    self.hits = 0
+    self.misses = 0
+    self._entries = OrderedDict()
+    self._lock = threading.Lock()
+
+  def get(self, digest):
+    with self._lock:
+      counts = self._entries.get(digest)
+      if counts is not None:
+        self._entries.move_to_end(digest)
+      return counts
+
+  def put(self, digest, counts):
+    with self._lock:
+      self._entries[digest] = counts
+      self._entries.move_to_end(digest)
+      while len(self._entries) > self.capacity:
+        self._entries.popitem(last=False)
+
+  def begin_job(self, pages, skip=(), batch_pages=64):
+    """
+    Starts looking up the pages of a document; pages are digested
+    and looked up (in memory, then in the backing store) on first
+    use, see JobPageCache.prefetch
+
+    Parameters
+    ----------
+    pages: list of pypdf pages,
+    skip: indices of pages the job will not look up,
+    batch_pages: pages digested and looked up at once
+
+    Returns
+    -------
+    JobPageCache for the document
+    """
+    return JobPageCache(self, pages, skip, batch_pages)
+
+
+class JobPageCache:
+  """
+  The page cache as seen by one document: get / put by page index,
+  with hit / miss counts for the job.
+  """
+
+  def __init__(self, cache, pages, skip=(), batch_pages=64):
+    self.cache = cache
+    self.pages = pages
+    self.skip = set(skip)
+    self.batch_pages = batch_pages
+    self.digests = {}      # page index -> digest, once looked up
+    self.found = {}
+    self.new = {}
+    self.hits = 0
+    self.misses = 0
+
+  def prefetch(self, indices):
+    """
+    Digests the given pages and looks them up, with one query to
+    the backing store for those not in memory.
+    """
+    indices = [i for i in indices if i not in self.digests and i not in self.skip]
+
+    missing = set()
+    for i in indices:
+      digest = page_digest(self.pages[i])
+      self.digests[i] = digest
+      counts = self.cache.get(digest)
+      if counts is not None:
+        self.found[digest] = counts
+      elif digest not in self.found:
+        missing.add(digest)
+
+    if self.cache.store is not None and len(missing) > 0:
+      for (digest, counts) in self.cache.store.fetch(list(missing)).items():
+        self.cache.put(digest, counts)
+        self.found[digest] = counts
+
+  def get(self, i):
+    """
+    Returns page i's histogram as a dict of digit -> count, or None.
+    A page not prefetched is looked up with the pages after it.
+    """
+    if i not in self.digests:
+      self.prefetch(range(i, min(i + self.batch_pages, len(self.pages))))
+
+    counts = self.found.get(self.digests[i])
+    if counts is None:
+      counts = self.new.get(self.digests[i])
+
+    if counts is None:
+      self.misses += 1
+      return None
+
+    self.hits += 1
+    return {str(d): counts[d] for d in range(10)}
+
+  def put(self, i, digit_count):
+    if i not in self.digests:
+      self.digests[i] = page_digest(self.pages[i])
+
+    counts = [digit_count[str(d)] for d in range(10)]
+    self.new[self.digests[i]] = counts
+    self.cache.put(self.digests[i], counts)
+
+  def finish(self):
+    """
+    Saves the newly tallied pages to the backing store, and adds
+    this job's hits / misses to the cache's totals.
+    """
+    if self.cache.store is not None and len(self.new) > 0:
+      self.cache.store.save(self.new)
+
+    with self.cache._lock:
+      self.cache.hits += self.hits
+      self.cache.misses += self.misses
+
+  def hit_rate(self):
+    lookups = self.hits + self.misses
+    return self.hits / lookups if lookups > 0 else 0.0
+
+
+###################################################################
+#
+# make_page_cache
+#
+def make_page_cache(configur, get_dbConn):
+  """
+  Creates the page cache configured by the [pagecache] section,
+  or None if it is disabled
+  """
+  if not configur.getboolean('pagecache', 'enabled', fallback=True):
+    return None
+
+  store = None
+  if configur.get('pagecache', 'store', fallback='none') == 'rds':
+    store = RDSPageStore(get_dbConn)
+
+  return PageCache(configur.getint('pagecache', 'capacity', fallback=10000), store)
+
+
+if __name__ == "__main__":
+  from configparser import ConfigParser
+  import sys
+
+  if len(sys.argv) < 2 or sys.argv[1] != "create":
+    print("usage: python3 pagecache.py create")
+    sys.exit(0)
+
+  configur = ConfigParser()
+  configur.read('benfordapp-config.ini')
+
+  dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                               int(configur.get('rds', 'port_number')),
+                               configur.get('rds', 'user_name'),
+                               configur.get('rds', 'user_pwd'),
+                               configur.get('rds', 'db_name'))
+
+  datatier.perform_actions(dbConn, [(sql, []) for sql in CREATE_TABLES])
+  print("tables created")
@@ -0,0 +1,208 @@
+#
+# pagematrix.py
+#
+# Per-page digit histograms of a document, as a compact pages x 10
+# matrix of unsigned 32-bit integers. lambda_function stores it
+# next to the results file (<key>.pages.bin), so when a filing
+# fails the Benford test the pages responsible can be listed
+# without processing the PDF again:
+#
+#   python3 pagematrix.py top FILE [N]
+#     FILE is a local .pages.bin file, or s3://<key> in the bucket
+#     of benfordapp-config.ini; lists the N (default 10) pages
+#     that deviate the most from Benford's Law.
+#
+# Binary format: the 8-byte header b'BFPM' + version (uint16) +
+# number of columns (uint16), then the number of pages (uint32),
+# then the matrix row by row, all little-endian.
+#
+
+import benford
+import compression
+import struct
+import sys
+
+from array import array
+
+
+MAGIC = b'BFPM'
+VERSION = 1
+COLUMNS = 10
+
+_header = struct.Struct("<4sHHI")
+
+
+class PageMatrix:
+
+  def __init__(self, number_of_pages, data=None):
+    self.number_of_pages = number_of_pages
+    if data is None:
+      data = array('I', bytes(4 * COLUMNS * number_of_pages))
+    self.data = data
+
+  def set_row(self, i, digit_count):
+    """
+    Stores page i's histogram (dict of digit '0'..'9' -> count).
+    """
+    base = i * COLUMNS
+    for d in range(COLUMNS):
+      self.data[base + d] = digit_count[str(d)]
+
+  def row(self, i):
+    """
+    Returns page i's histogram as a dict of digit -> count.
+    """
+    base = i * COLUMNS
+    return {str(d): self.data[base + d] for d in range(COLUMNS)}
+
+  def totals(self):
+    """
+    Returns the document's histogram (the sum of all rows).
+    """
+    counts = [0] * COLUMNS
+    for i in range(self.number_of_pages):
+      base = i * COLUMNS
+      for d in range(COLUMNS):
+        counts[d] += self.data[base + d]
+    return {str(d): counts[d] for d in range(COLUMNS)}
+
+  def to_bytes(self):
+    data = self.data
+    if sys.byteorder != "little":
+      data = array('I', data)
+      data.byteswap()
+    return _header.pack(MAGIC, VERSION, COLUMNS, self.number_of_pages) + data.tobytes()
+
+  @staticmethod
+  def from_bytes(raw):
+    raw = compression.sniff_decompress(raw)
+
+    (magic, version, columns, number_of_pages) = _header.unpack_from(raw)
+    if magic != MAGIC or version != VERSION or columns != COLUMNS:
+      raise ValueError("not a page matrix file")
+
+    data = array('I')
+    data.frombytes(raw[_header.size:_header.size + 4 * COLUMNS * number_of_pages])
+    if sys.byteorder != "little":
+      data.byteswap()
+
+    return PageMatrix(number_of_pages, data)
+
+
+###################################################################
+#
+# deviation_scores
+#
+# Each page's chi-square statistic against Benford's Law, over the
+# digits 1..9. A page's chi-square grows with both how far off its
+# digits are and how many numbers it holds, i.e. how much it pulls
+# the whole document away from the expected frequencies. Computed
+# in one vectorized pass with numpy when it is installed, else in
+# a single pass over the array.
+#
+def deviation_scores(matrix):
+  """
+  Returns the list of per-page chi-square statistics (0.0 for pages
+  without numbers)
+  """
+  expected = [benford.EXPECTED[str(d)] for d in range(1, COLUMNS)]
+
+  try:
+    import numpy
+  except ImportError:
+    numpy = None
+
+  if numpy is not None:
+    counts = numpy.frombuffer(matrix.data, dtype=numpy.uint32).reshape(matrix.number_of_pages, COLUMNS)[:, 1:]
+    counts = counts.astype(numpy.float64)
+    totals = counts.sum(axis=1, keepdims=True)
+    expected_counts = totals * numpy.array(expected)
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+      chisq = ((counts - expected_counts) ** 2 / expected_counts).sum(axis=1)
+    return numpy.nan_to_num(chisq).tolist()
+
+  scores = []
+  data = matrix.data
+  for i in range(matrix.number_of_pages):
+    base = i * COLUMNS + 1
+    row = data[base:base + COLUMNS - 1]
+    total = sum(row)
+    if total == 0:
+      scores.append(0.0)
+      continue
+    scores.append(sum((c - total * p) ** 2 / (total * p) for (c, p) in zip(row, expected)))
+
+  return scores
+
+
+###################################################################
+#
+# top_pages
+#
+def top_pages(matrix, n=10):
+  """
+  Returns the n pages that deviate the most from Benford's Law
+
+  Parameters
+  ----------
+  matrix: PageMatrix,
+  n: number of pages to return
+
+  Returns
+  -------
+  list of (page number (1-based), numbers on the page, chi-square),
+  largest chi-square first
+  """
+  scores = deviation_scores(matrix)
+
+  order = sorted(range(matrix.number_of_pages), key=lambda i: scores[i], reverse=True)
+
+  top = []
+  for i in order[:n]:
+    base = i * COLUMNS + 1
+    top.append((i + 1, sum(matrix.data[base:base + COLUMNS - 1]), scores[i]))
+
+  return top
+
+
+def matrix_key(bucketkey_results_file):
+  """
+  Returns the bucket key of the matrix stored next to a results file.
+  """
+  return bucketkey_results_file[0:-4] + ".pages.bin"
+
+
+if __name__ == "__main__":
+  if len(sys.argv) < 3 or sys.argv[1] != "top":
+    print("usage: python3 pagematrix.py top FILE|s3://KEY [N]")
+    sys.exit(0)
+
+  source = sys.argv[2]
+  n = int(sys.argv[3]) if len(sys.argv) > 3 else 10
+
+  if source.startswith("s3://"):
+    from configparser import ConfigParser
+    import boto3
+    import os
+
+    config_file = 'benfordapp-config.ini'
+    os.environ['AWS_SHARED_CREDENTIALS_FILE'] = config_file
+
+    configur = ConfigParser()
+    configur.read(config_file)
+
+    boto3.setup_default_session(profile_name='s3readwrite')
+    s3 = boto3.client('s3')
+    response = s3.get_object(Bucket=configur.get('s3', 'bucket_name'), Key=source[len("s3://"):])
+    raw = response['Body'].read()
+  else:
+    with open(source, "rb") as infile:
+      raw = infile.read()
+
+  matrix = PageMatrix.from_bytes(raw)
+  whole = benford.fit(matrix.totals())
+
+  print(matrix.number_of_pages, "pages,", whole['total'], "numbers, document chi-square", f"{whole['chisq']:.2f}")
+  print(f"{'page':>6} {'numbers':>8} {'chi-square':>11}")
+  for (page, total, score) in top_pages(matrix, n):
+    print(f"{page:6} {total:8} {score:11.2f}")
@@ -0,0 +1,214 @@
+#
+# preflight.py
+#
+# Cheap validation of a PDF sitting in storage (S3 or a file
+# tree, see storage.py), before we pay for downloading it, opening
+# a DB connection and parsing it. Only a few small ranged reads of
+# the object are made: the head (for
+# the %PDF- header and the page tree), the tail (for startxref /
+# trailer / encryption) and the start of the cross-reference
+# section that startxref points to, whose subsections must hold as
+# many entries as their headers say.
+#
+
+import re
+
+
+class PreflightError(Exception):
+  """
+  Raised when a PDF is rejected by the preflight checks; the
+  message is the reason, and is recorded on the job.
+  """
+  pass
+
+
+class PreflightResult:
+
+  def __init__(self, size, est_pages, route, reason):
+    self.size = size
+    self.est_pages = est_pages
+    self.route = route
+    self.reason = reason
+
+
+class PreflightLimits:
+
+  def __init__(self, configur):
+    self.enabled = configur.getboolean('preflight', 'enabled', fallback=True)
+    self.head_bytes = configur.getint('preflight', 'head_bytes', fallback=4096)
+    self.tail_bytes = configur.getint('preflight', 'tail_bytes', fallback=4096)
+    #
+    # documents beyond these limits are rejected outright:
+    #
+    self.max_bytes = configur.getint('preflight', 'max_bytes', fallback=200 * 1024 * 1024)
+    self.max_pages = configur.getint('preflight', 'max_pages', fallback=20000)
+    #
+    # documents beyond these limits are routed to the large path:
+    #
+    self.large_bytes = configur.getint('preflight', 'large_bytes', fallback=20 * 1024 * 1024)
+    self.large_pages = configur.getint('preflight', 'large_pages', fallback=500)
+    #
+    # used to estimate the page count if the page tree is not
+    # visible in the bytes we read:
+    #
+    self.bytes_per_page = configur.getint('preflight', 'bytes_per_page', fallback=50 * 1024)
+
+
+_startxref_re = re.compile(rb'startxref\s+(\d+)\s+%%EOF')
+_trailer_re = re.compile(rb'trailer\s*(<<)?')
+_xref_re = re.compile(rb'\s*(xref|\d+\s+\d+\s+obj)')
+_subsection_re = re.compile(rb'(\d+)[ \t]+(\d+)[ \t]*\r?\n')
+_entry_re = re.compile(rb'\d{10}[ \t]\d{5}[ \t][nf][ \t]*\r?\n?')
+_count_re = re.compile(rb'/Type\s*/Pages\b[^>]*?/Count\s+(\d+)|/Count\s+(\d+)[^>]*?/Type\s*/Pages\b')
+
+
+###################################################################
+#
+# check_xref_table
+#
+def check_xref_table(xref):
+  """
+  Checks the subsections of a classic cross-reference table against
+  their headers, as far as xref (the start of the table) reaches:
+  a subsection "first count" must be followed by count 20-byte
+  entries, and then by another subsection or the trailer
+
+  Parameters
+  ----------
+  xref: bytes starting with the "xref" keyword
+
+  Returns
+  -------
+  nothing; raises PreflightError if a subsection does not match
+  its header
+  """
+  position = xref.index(b'xref') + len(b'xref')
+
+  while True:
+    while position < len(xref) and xref[position:position + 1].isspace():
+      position += 1
+    if position >= len(xref) or xref.startswith(b'trailer', position):
+      return
+
+    header = _subsection_re.match(xref, position)
+    if header is None:
+      if len(xref) - position < 32:
+        # cut off by the end of what we read:
+        return
+      raise PreflightError("preflight: cross-reference table is malformed")
+
+    (first, count) = (int(header.group(1)), int(header.group(2)))
+    position = header.end()
+
+    for entry in range(count):
+      match = _entry_re.match(xref, position)
+      if match is None:
+        if len(xref) - position < 20:
+          return
+        raise PreflightError(f"preflight: cross-reference subsection {first} {count} "
+                             f"has {entry} entries")
+      position = match.end()
+
+    #
+    # what follows must be the trailer or another subsection, not
+    # one more entry:
+    #
+    if _entry_re.match(xref, position) is not None:
+      raise PreflightError(f"preflight: cross-reference subsection {first} {count} "
+                           f"has more than {count} entries")
+
+
+###################################################################
+#
+# preflight_pdf
+#
+def preflight_pdf(storage, bucketkey, limits):
+  """
+  Validates the structure of a PDF in storage using ranged reads,
+  and decides how it should be processed
+
+  Parameters
+  ----------
+  storage: storage.Storage holding the PDF,
+  bucketkey: key of the PDF,
+  limits: PreflightLimits
+
+  Returns
+  -------
+  PreflightResult whose route is "standard" or "large"; raises
+  PreflightError if the document should be rejected
+  """
+
+  size = storage.size(bucketkey)
+
+  if size < 32:
+    raise PreflightError(f"preflight: file is too small to be a PDF ({size} bytes)")
+
+  if size > limits.max_bytes:
+    raise PreflightError(f"preflight: file is too large ({size} bytes, limit {limits.max_bytes})")
+
+  #
+  # the header must be in the first 1024 bytes:
+  #
+  head = storage.read_range(bucketkey, 0, limits.head_bytes)
+
+  if b'%PDF-' not in head[:1024]:
+    raise PreflightError("preflight: missing %PDF- header")
+
+  #
+  # the last startxref in the tail tells us where the
+  # (most recent) cross-reference section starts:
+  #
+  if size <= limits.head_bytes:
+    tail = head
+  else:
+    tail = storage.read_range(bucketkey, -limits.tail_bytes, limits.tail_bytes)
+
+  matches = list(_startxref_re.finditer(tail))
+  if len(matches) == 0:
+    raise PreflightError("preflight: missing startxref / %%EOF, file is truncated or corrupt")
+
+  startxref = int(matches[-1].group(1))
+  if startxref <= 0 or startxref >= size:
+    raise PreflightError(f"preflight: startxref offset {startxref} is outside the file")
+
+  #
+  # a classic trailer must be a dictionary; if there is none,
+  # the document uses a cross-reference stream instead:
+  #
+  for match in _trailer_re.finditer(tail):
+    if match.group(1) is None:
+      raise PreflightError("preflight: trailer is not followed by a dictionary")
+
+  xref = storage.read_range(bucketkey, startxref, 1024)
+  if _xref_re.match(xref) is None:
+    raise PreflightError(f"preflight: startxref offset {startxref} does not point to a cross-reference section")
+
+  if xref.lstrip().startswith(b'xref'):
+    check_xref_table(xref)
+
+  if b'/Encrypt' in tail or b'/Encrypt' in xref:
+    raise PreflightError("preflight: document is encrypted")
+
+  #
+  # estimate the page count from the root of the page tree if
+  # we saw it (the largest /Count is the root), otherwise from
+  # the file size:
+  #
+  counts = [int(m.group(1) or m.group(2)) for m in _count_re.finditer(head + b'\n' + tail)]
+  if len(counts) > 0:
+    est_pages = max(counts)
+  else:
+    est_pages = max(1, size // limits.bytes_per_page)
+
+  if est_pages > limits.max_pages:
+    raise PreflightError(f"preflight: too many pages (about {est_pages}, limit {limits.max_pages})")
+
+  if est_pages > limits.large_pages or size > limits.large_bytes:
+    route = "large"
+    reason = f"large document (about {est_pages} pages, {size} bytes)"
+  else:
+    route = "standard"
+    reason = ""
+
+  return PreflightResult(size, est_pages, route, reason)
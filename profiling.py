@@ -0,0 +1,134 @@
+#
+# profiling.py
+#
+# Opt-in profiling of the processing of one document, to capture
+# what makes a specific PDF pathologically slow. When enabled, by
+#
+#   [profiling]
+#   enabled = true
+#   top_n = 25
+#
+# or by "profile": true in the event, lambda_function runs each
+# record under cProfile and tracemalloc, and uploads next to the
+# results file:
+#
+#   <key>.profile.prof   cProfile dump, for pstats / snakeviz
+#   <key>.profile.txt    top-N functions by cumulative time and
+#                        top-N allocation sites
+#
+# When disabled nothing is wrapped, so there is no overhead.
+#
+# Only one cProfile profiler can be active per process (enforced
+# from Python 3.12 on), so profiled records run one at a time, even
+# in a batch processed concurrently. If the profiler cannot be
+# started anyway, the record is processed unprofiled.
+#
+
+import cProfile
+import io
+import pstats
+import threading
+import time
+import tracemalloc
+
+
+#
+# held while a record is profiled:
+#
+_profile_lock = threading.Lock()
+
+#
+# tracemalloc is process-wide, so it runs while at least one
+# profiler is active:
+#
+_tracemalloc_users = 0
+_tracemalloc_lock = threading.Lock()
+
+
+class JobProfiler:
+
+  def __init__(self, top_n=25):
+    self.top_n = top_n
+    self.profile = cProfile.Profile()
+    self.elapsed = 0.0
+    self.snapshot = None
+    self.peak_bytes = 0
+    self.started = False
+
+  def __enter__(self):
+    global _tracemalloc_users
+
+    _profile_lock.acquire()
+
+    try:
+      self.profile.enable()
+    except ValueError as err:
+      # another profiler is active, e.g. a debugger's:
+      _profile_lock.release()
+      print("**PROFILING not possible, processing unprofiled:", str(err))
+      return self
+
+    with _tracemalloc_lock:
+      if _tracemalloc_users == 0:
+        tracemalloc.start()
+      _tracemalloc_users += 1
+
+    self.started = True
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    global _tracemalloc_users
+
+    if not self.started:
+      return False
+
+    self.profile.disable()
+    self.elapsed = time.perf_counter() - self.start
+
+    with _tracemalloc_lock:
+      self.snapshot = tracemalloc.take_snapshot()
+      self.peak_bytes = tracemalloc.get_traced_memory()[1]
+      _tracemalloc_users -= 1
+      if _tracemalloc_users == 0:
+        tracemalloc.stop()
+
+    _profile_lock.release()
+
+    # don't swallow the exception:
+    return False
+
+  def dump(self, filename):
+    """
+    Writes the cProfile data to filename (pstats format).
+    """
+    self.profile.dump_stats(filename)
+
+  def summary(self):
+    """
+    Returns the top-N hot functions and allocation sites as text.
+    """
+    out = io.StringIO()
+
+    out.write("**PROFILE**\n")
+    out.write(f"elapsed {self.elapsed:.3f} seconds, peak traced memory {self.peak_bytes / 1024 / 1024:.1f} MiB\n")
+    out.write("(allocations include any records processed concurrently)\n\n")
+
+    out.write(f"**TOP {self.top_n} FUNCTIONS by cumulative time**\n")
+    stats = pstats.Stats(self.profile, stream=out)
+    stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(self.top_n)
+
+    out.write(f"**TOP {self.top_n} ALLOCATION SITES**\n")
+    if self.snapshot is not None:
+      for stat in self.snapshot.statistics("lineno")[:self.top_n]:
+        out.write(f"{stat}\n")
+
+    return out.getvalue()
+
+
+def profile_keys(bucketkey_results_file):
+  """
+  Returns the bucket keys (dump, summary) of the profile of a job.
+  """
+  base = bucketkey_results_file[0:-4]
+  return (base + ".profile.prof", base + ".profile.txt")
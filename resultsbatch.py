@@ -0,0 +1,173 @@
+#
+# resultsbatch.py
+#
+# Server side of GET /results?jobids=1001,1002,...: the results of
+# many jobs in one call, instead of one GET /results/{jobid} (and
+# one gateway round trip and Lambda invocation) per job. The jobs
+# are looked up with one query, their results files read in
+# parallel, and the body is JSON lines, one per job id asked for,
+# in the order asked:
+#
+#   {"jobid": 1001, "status": 200, "data": <results file, base64>}
+#   {"jobid": 1005, "status": 483, "message": "provisional", "data": ...}
+#   {"jobid": 1002, "status": 481, "message": "processing - ..."}
+#   {"jobid": 1003, "status": 400, "message": "no such job..."}
+#   {"jobid": 1004, "status": 503, "message": "response full, ..."}
+#
+# with the status codes of GET /results/{jobid} (see longpoll.py).
+# At most MAX_JOBIDS ids are taken per call, and once the body
+# would exceed max_bytes (Lambda responses are limited to 6 MB) the
+# remaining jobs come back as 503, for the client to ask again.
+#
+#   [resultsbatch]
+#   max_bytes = 5000000
+#   max_workers = 16         results files read at once
+#
+
+import base64
+import datatier
+import json
+import longpoll
+import storage
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+
+MAX_JOBIDS = 500
+
+
+###################################################################
+#
+# parse_jobids
+#
+def parse_jobids(params):
+  """
+  Returns the list of job ids (ints) of the jobids query string
+  parameter; raises ValueError if it is missing or malformed.
+  """
+  value = (params or {}).get('jobids', '')
+
+  jobids = [s.strip() for s in value.split(",") if s.strip() != ""]
+  if len(jobids) == 0:
+    raise ValueError("jobids: expecting a comma-separated list of job ids")
+
+  bad = [s for s in jobids if not s.isnumeric()]
+  if len(bad) > 0:
+    raise ValueError(f"jobids: '{bad[0]}' is not a number")
+
+  if len(jobids) > MAX_JOBIDS:
+    raise ValueError(f"jobids: at most {MAX_JOBIDS} job ids per call")
+
+  return [int(s) for s in jobids]
+
+
+###################################################################
+#
+# batch_results
+#
+def batch_results(dbConn, results_storage, jobids, max_bytes=5000000, max_workers=16):
+  """
+  Returns the results of the given jobs
+
+  Parameters
+  ----------
+  dbConn: database connection,
+  results_storage: storage.Storage holding the results files,
+  jobids: list of job ids,
+  max_bytes: approximate limit on the size of the body,
+  max_workers: number of results files read at once
+
+  Returns
+  -------
+  the body: JSON lines, one per job id (string)
+  """
+  sql = "SELECT jobid, status, resultsfilekey FROM jobs WHERE jobid IN (" + \
+        ", ".join(["%s"] * len(jobids)) + ");"
+  rows = datatier.retrieve_all_rows(dbConn, sql, list(set(jobids)))
+  jobs = {row[0]: row for row in rows}
+
+  #
+  # the jobs with a results file: completed, or provisional
+  #
+  ready = [jobid for jobid in jobids if jobid in jobs and longpoll.status_code(jobs[jobid][1]) in [200, 483]]
+
+  def read(jobid):
+    (data, _) = results_storage.read(jobs[jobid][2])
+    return data
+
+  with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(ready) or 1))) as executor:
+    datas = dict(zip(ready, executor.map(read, ready)))
+
+  lines = []
+  size = 0
+  full = False
+
+  for jobid in jobids:
+    if jobid not in jobs:
+      line = {"jobid": jobid, "status": 400, "message": "no such job..."}
+    else:
+      status = jobs[jobid][1]
+      code = longpoll.status_code(status)
+      if code == 200:
+        line = {"jobid": jobid, "status": 200, "data": base64.b64encode(datas[jobid]).decode("utf-8")}
+      elif code == 483:
+        line = {"jobid": jobid, "status": 483, "message": status,
+                "data": base64.b64encode(datas[jobid]).decode("utf-8")}
+      else:
+        line = {"jobid": jobid, "status": code, "message": status}
+
+    text = json.dumps(line)
+    if "data" in line and (full or (size + len(text) > max_bytes and size > 0)):
+      full = True
+      text = json.dumps({"jobid": jobid, "status": 503, "message": "response full, ask again"})
+
+    lines.append(text)
+    size += len(text) + 1
+
+  return "\n".join(lines) + "\n"
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_results_batch**")
+
+    try:
+      jobids = parse_jobids(event.get('queryStringParameters'))
+    except ValueError as err:
+      print("**ERROR:", str(err))
+      return {
+        'statusCode': 400,
+        'body': json.dumps(str(err))
+      }
+
+    configur = ConfigParser()
+    configur.read('benfordapp-config.ini')
+
+    dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                                 int(configur.get('rds', 'port_number')),
+                                 configur.get('rds', 'user_name'),
+                                 configur.get('rds', 'user_pwd'),
+                                 configur.get('rds', 'db_name'))
+
+    body = batch_results(dbConn, storage.make_storage(configur), jobids,
+                         configur.getint('resultsbatch', 'max_bytes', fallback=5000000),
+                         configur.getint('resultsbatch', 'max_workers', fallback=16))
+
+    print("**DONE,", len(jobids), "jobs**")
+
+    return {
+      'statusCode': 200,
+      'headers': {'Content-Type': 'application/x-ndjson'},
+      'body': body
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 500,
+      'body': json.dumps(str(err))
+    }
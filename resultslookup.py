@@ -0,0 +1,121 @@
+#
+# resultslookup.py
+#
+# Server side of GET /lookup/{userid}/{sha256}: has this user
+# already analyzed a file with these contents? lambda_function
+# stores the SHA-256 of every PDF it processes in jobs.datafilehash,
+# so the client hashes a file locally and asks before uploading it;
+# on a hit it gets the existing job and its results, and skips the
+# upload entirely.
+#
+#   200 {"jobid": ..., "data": <results file, base64>}
+#   404 "no results for this file"
+#   400 malformed userid or hash
+#
+# Only the user's own completed jobs are considered, so the lookup
+# says nothing about what other users uploaded.
+#
+
+import base64
+import datatier
+import json
+import re
+import storage
+
+from configparser import ConfigParser
+
+
+_sha256_re = re.compile(r'^[0-9a-f]{64}$')
+
+
+###################################################################
+#
+# find_completed_job
+#
+def find_completed_job(dbConn, userid, datafilehash):
+  """
+  Returns (jobid, resultsfilekey) of the user's latest completed
+  job of a file with the given SHA-256, or None
+  """
+  sql = """
+    SELECT jobid, resultsfilekey FROM jobs
+     WHERE userid = %s AND datafilehash = %s AND status = 'completed'
+     ORDER BY jobid DESC LIMIT 1;
+  """
+  row = datatier.retrieve_one_row(dbConn, sql, [userid, datafilehash])
+
+  if row == ():
+    return None
+
+  return (row[0], row[1])
+
+
+###################################################################
+#
+# lookup
+#
+def lookup(dbConn, results_storage, userid, datafilehash):
+  """
+  Handles a lookup
+
+  Parameters
+  ----------
+  dbConn: database connection,
+  results_storage: storage.Storage holding the results files,
+  userid, datafilehash: the path parameters (strings)
+
+  Returns
+  -------
+  (HTTP status code, body to serialize as JSON)
+  """
+  if not userid.isnumeric():
+    return (400, f"userid: '{userid}' is not a number")
+
+  datafilehash = datafilehash.lower()
+  if _sha256_re.match(datafilehash) is None:
+    return (400, "hash: expecting a hex SHA-256 digest")
+
+  found = find_completed_job(dbConn, int(userid), datafilehash)
+  if found is None:
+    return (404, "no results for this file")
+
+  (jobid, resultsfilekey) = found
+  (data, _) = results_storage.read(resultsfilekey)
+
+  return (200, {"jobid": jobid, "data": base64.b64encode(data).decode("utf-8")})
+
+
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_lookup**")
+
+    params = event.get('pathParameters') or {}
+
+    configur = ConfigParser()
+    configur.read('benfordapp-config.ini')
+
+    dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                                 int(configur.get('rds', 'port_number')),
+                                 configur.get('rds', 'user_name'),
+                                 configur.get('rds', 'user_pwd'),
+                                 configur.get('rds', 'db_name'))
+
+    (status_code, body) = lookup(dbConn, storage.make_storage(configur),
+                                 params.get('userid', ''), params.get('hash', ''))
+
+    print("**DONE, returning", status_code, "**")
+
+    return {
+      'statusCode': status_code,
+      'body': json.dumps(body)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 500,
+      'body': json.dumps(str(err))
+    }
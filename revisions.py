@@ -0,0 +1,290 @@
+#
+# revisions.py
+#
+# Incremental revisions of documents analyzed before. A PDF revised
+# by an incremental update is the original file, byte for byte,
+# followed by update sections: the objects that were added or
+# replaced, a new xref section and another %%EOF. So for every
+# %%EOF before the last, the file up to it is an earlier version of
+# the document, and its SHA-256 is the jobs.datafilehash of that
+# version if the user had it analyzed.
+#
+# When one is found, the pages of the new version that the update
+# left alone take their histograms from the page matrix of the
+# earlier job (<results>.pages.bin, see pagematrix.py) and are not
+# extracted again; only added and changed pages are. A page is left
+# alone if it is the same page object as in the earlier version,
+# its /Contents, /Resources and /Rotate entries are the same, and
+# no object they reach was redefined by the update sections.
+#
+#   [revisions]
+#   enabled = true           (default)
+#
+# Only the user's own completed jobs are considered.
+#
+
+import datatier
+import hashlib
+import io
+import mmap
+import pagematrix
+
+
+#
+# what determines the text of a page, see pagecache.page_digest:
+#
+PAGE_KEYS = ['/Contents', '/Resources', '/Rotate']
+
+#
+# references not to follow: up the page tree, or to annotations,
+# which extract_text() ignores
+#
+_SKIP_KEYS = {'/Parent', '/P', '/Annots', '/B', '/Thumb'}
+
+
+###################################################################
+#
+# prefix_hashes
+#
+def prefix_hashes(path):
+  """
+  Returns {sha256 hex digest: length} of the earlier versions a
+  PDF file may contain: the file up to each %%EOF marker but the
+  last (with and without the end of line after it)
+  """
+  hashes = {}
+
+  with open(path, "rb") as infile:
+    size = infile.seek(0, io.SEEK_END)
+    if size == 0:
+      return hashes
+
+    with mmap.mmap(infile.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      markers = []
+      p = data.find(b"%%EOF")
+      while p != -1:
+        end = p + len(b"%%EOF")
+        marker = [end]
+        for eol in [b"\r\n", b"\n", b"\r"]:
+          if data[end:end + len(eol)] == eol:
+            marker.append(end + len(eol))
+            break
+        markers.append(marker)
+        p = data.find(b"%%EOF", end)
+
+      #
+      # the last marker ends the file itself (a file with only one
+      # has no earlier version, and needs no lookup):
+      #
+      ends = sorted(set(e for marker in markers[:-1] for e in marker))
+
+      #
+      # one pass over the file, taking a digest at each boundary:
+      #
+      h = hashlib.sha256()
+      position = 0
+      view = memoryview(data)
+      try:
+        for end in ends:
+          h.update(view[position:end])
+          position = end
+          hashes[h.hexdigest()] = end
+      finally:
+        view.release()
+
+  return hashes
+
+
+###################################################################
+#
+# find_base_job
+#
+def find_base_job(dbConn, bucketkey, hashes):
+  """
+  Returns (jobid, resultsfilekey, length) of the latest version
+  among hashes (see prefix_hashes) the same user has a completed job
+  of, or None
+  """
+  if len(hashes) == 0:
+    return None
+
+  sql = f"""
+    SELECT b.jobid, b.resultsfilekey, b.datafilehash
+      FROM jobs j JOIN jobs b ON b.userid = j.userid
+     WHERE j.datafilekey = %s AND b.status = 'completed'
+       AND b.datafilehash IN ({", ".join(["%s"] * len(hashes))})
+     ORDER BY b.jobid DESC;
+  """
+  rows = datatier.retrieve_all_rows(dbConn, sql, [bucketkey] + list(hashes))
+
+  if len(rows) == 0:
+    return None
+
+  (jobid, resultsfilekey, datafilehash) = max(rows, key=lambda row: hashes[row[2]])
+  return (jobid, resultsfilekey, hashes[datafilehash])
+
+
+###################################################################
+#
+# changed objects
+#
+def updated_objects(reader, base_length):
+  """
+  Returns the numbers of the objects defined after base_length
+  bytes, i.e. by the update sections
+  """
+  updated = set()
+
+  for table in reader.xref.values():
+    for (idnum, offset) in table.items():
+      if offset >= base_length:
+        updated.add(idnum)
+
+  for (idnum, (stmnum, _)) in reader.xref_objStm.items():
+    if stmnum in updated:
+      updated.add(idnum)
+
+  return updated
+
+
+#
+# (pypdf values are tested by duck typing: its IndirectObject has an
+# idnum, DictionaryObject is a dict and ArrayObject a list, so pypdf
+# is not imported before it is needed)
+#
+def _shape(obj):
+  """
+  Returns a comparable form of a PDF value, references as object
+  numbers (not followed).
+  """
+  if hasattr(obj, 'idnum'):
+    return ('ref', obj.idnum, obj.generation)
+  if isinstance(obj, dict):
+    return tuple(sorted((str(k), _shape(v)) for (k, v) in obj.items()))
+  if isinstance(obj, list):
+    return tuple(_shape(v) for v in obj)
+  return repr(obj)
+
+
+def _touches(obj, updated, memo):
+  """
+  Returns True if obj reaches an object in updated.
+  """
+  if hasattr(obj, 'idnum'):
+    if obj.idnum in updated:
+      return True
+    if obj.idnum in memo:
+      return memo[obj.idnum]
+    memo[obj.idnum] = False   # cycles
+    memo[obj.idnum] = _touches(obj.get_object(), updated, memo)
+    return memo[obj.idnum]
+
+  if isinstance(obj, dict):
+    return any(_touches(v, updated, memo) for (k, v) in obj.items() if k not in _SKIP_KEYS)
+
+  if isinstance(obj, list):
+    return any(_touches(v, updated, memo) for v in obj)
+
+  return False
+
+
+###################################################################
+#
+# unchanged_pages
+#
+def unchanged_pages(reader, base_reader, base_length):
+  """
+  Returns {page index in reader: page index in base_reader} of the
+  pages the update sections left alone
+
+  Parameters
+  ----------
+  reader: pypdf PdfReader of the new version,
+  base_reader: pypdf PdfReader of the earlier version,
+  base_length: length of the earlier version in bytes
+  """
+  updated = updated_objects(reader, base_length)
+
+  base_index = {}
+  for (k, page) in enumerate(base_reader.pages):
+    if page.indirect_reference is not None:
+      base_index[page.indirect_reference.idnum] = k
+
+  memo = {}
+  unchanged = {}
+
+  for (i, page) in enumerate(reader.pages):
+    if page.indirect_reference is None:
+      continue
+    k = base_index.get(page.indirect_reference.idnum)
+    if k is None:
+      continue
+    base_page = base_reader.pages[k]
+
+    if any(_shape(page.get(key)) != _shape(base_page.get(key)) for key in PAGE_KEYS):
+      continue
+    if any(_touches(page.get(key), updated, memo) for key in PAGE_KEYS):
+      continue
+
+    unchanged[i] = k
+
+  return unchanged
+
+
+class Revision:
+  """
+  A document found to revise the one of an earlier job: rows holds
+  the histograms of its unchanged pages, by page index.
+  """
+
+  def __init__(self, jobid, base_pages, rows):
+    self.jobid = jobid
+    self.base_pages = base_pages
+    self.rows = rows
+
+
+###################################################################
+#
+# find_revision
+#
+def find_revision(dbConn, results_storage, bucketkey, pdf_path, reader):
+  """
+  Checks if a PDF is an incremental revision of a document the user
+  had analyzed, and if so, collects the histograms of the pages it
+  did not change
+
+  Parameters
+  ----------
+  dbConn: database connection,
+  results_storage: storage.Storage holding the results files,
+  bucketkey: the PDF's datafilekey,
+  pdf_path: local file of the PDF,
+  reader: pypdf PdfReader of the PDF
+
+  Returns
+  -------
+  Revision, or None
+  """
+  from pypdf import PdfReader
+
+  if reader.is_encrypted:
+    return None
+
+  found = find_base_job(dbConn, bucketkey, prefix_hashes(pdf_path))
+  if found is None:
+    return None
+
+  (jobid, resultsfilekey, base_length) = found
+
+  (raw, _) = results_storage.read(pagematrix.matrix_key(resultsfilekey))
+  matrix = pagematrix.PageMatrix.from_bytes(raw)
+
+  with open(pdf_path, "rb") as infile:
+    base_reader = PdfReader(io.BytesIO(infile.read(base_length)))
+
+  if len(base_reader.pages) != matrix.number_of_pages:
+    return None
+
+  rows = {i: matrix.row(k) for (i, k) in unchanged_pages(reader, base_reader, base_length).items()}
+
+  return Revision(jobid, matrix.number_of_pages, rows)
@@ -0,0 +1,233 @@
+#
+# sampling.py
+#
+# Approximate-first processing of huge documents: a stratified
+# random sample of pages is tallied first, and a provisional result
+# with 95% confidence intervals is published before (optionally)
+# continuing to the exact tally of every page. GET /results
+# returns the provisional result with status code 483 until the
+# exact one is done; with continue = false it is the final result.
+#
+# The pages are split into contiguous strata of equal size, and
+# the same fraction of pages is drawn at random from each, so the
+# whole document is covered. Pages are clusters of numbers, so the
+# digit frequencies are ratio estimates (digit count / all counts)
+# whose variance comes from the variation between sampled pages,
+# not from treating every number as independent.
+#
+#   [sampling]
+#   enabled = true       (default)
+#   min_pages = 1000     documents with at least this many pages
+#                        (or routed "large" by preflight) are sampled
+#   fraction = 0.05      fraction of pages in the sample
+#   min_sample = 100     ... but at least this many pages
+#   strata = 20          number of strata
+#   continue = true      continue to the exact tally afterwards
+#   bootstrap = 200      resamples for the fit statistic's interval
+#
+
+import benford
+import math
+import random
+
+
+Z95 = 1.959964
+
+
+class SamplingConfig:
+
+  def __init__(self, configur):
+    self.enabled = configur.getboolean('sampling', 'enabled', fallback=True)
+    self.min_pages = configur.getint('sampling', 'min_pages', fallback=1000)
+    self.fraction = configur.getfloat('sampling', 'fraction', fallback=0.05)
+    self.min_sample = configur.getint('sampling', 'min_sample', fallback=100)
+    self.strata = configur.getint('sampling', 'strata', fallback=20)
+    self.continue_exact = configur.getboolean('sampling', 'continue', fallback=True)
+    self.bootstrap = configur.getint('sampling', 'bootstrap', fallback=200)
+
+  def should_sample(self, number_of_pages, route):
+    """
+    Returns True if a document should be sampled first.
+    """
+    if not self.enabled:
+      return False
+    return number_of_pages >= self.min_pages or (route == "large" and number_of_pages > self.min_sample)
+
+
+###################################################################
+#
+# stratified_sample
+#
+def stratified_sample(number_of_pages, config, rng=None):
+  """
+  Draws a stratified random sample of page indices
+
+  Parameters
+  ----------
+  number_of_pages: pages in the document,
+  config: SamplingConfig,
+  rng: random.Random to draw with (default: a new one)
+
+  Returns
+  -------
+  (list of strata as (first, last) page index ranges,
+   list of lists of sampled page indices, one per stratum)
+  """
+  if rng is None:
+    rng = random.Random()
+
+  n = max(config.min_sample, math.ceil(config.fraction * number_of_pages))
+  n = min(n, number_of_pages)
+
+  strata_count = max(1, min(config.strata, n // 2, number_of_pages))
+  bounds = [number_of_pages * h // strata_count for h in range(strata_count + 1)]
+  strata = [(bounds[h], bounds[h + 1]) for h in range(strata_count)]
+
+  #
+  # proportional allocation, at least 2 pages per stratum so its
+  # variance can be estimated:
+  #
+  samples = []
+  for (first, last) in strata:
+    size = last - first
+    n_h = min(size, max(2, round(n * size / number_of_pages)))
+    samples.append(sorted(rng.sample(range(first, last), n_h)))
+
+  return (strata, samples)
+
+
+def _ratio_estimate(strata, samples, rows):
+  """
+  Estimated digit totals and total count, from the sampled rows
+  (dict page index -> list of 10 counts).
+  """
+  totals = [0.0] * 10
+  for ((first, last), pages) in zip(strata, samples):
+    weight = (last - first) / len(pages)
+    for i in pages:
+      for d in range(10):
+        totals[d] += weight * rows[i][d]
+  return totals
+
+
+###################################################################
+#
+# estimate
+#
+def estimate(number_of_pages, strata, samples, rows, bootstrap=200, rng=None):
+  """
+  Estimates the document's digit frequencies and Benford fit from
+  the sampled pages
+
+  Parameters
+  ----------
+  number_of_pages: pages in the document,
+  strata, samples: as returned by stratified_sample,
+  rows: dict of sampled page index -> list of 10 digit counts,
+  bootstrap: number of stratified resamples for the intervals of
+    the fit statistics,
+  rng: random.Random for the bootstrap
+
+  Returns
+  -------
+  dict with sampled (pages), counts (estimated count per digit
+  '0'..'9'), freqs (digit '1'..'9' -> (frequency, low, high)),
+  chisq and mad (each (value, low, high))
+  """
+  if rng is None:
+    rng = random.Random()
+
+  totals = _ratio_estimate(strata, samples, rows)
+  x_hat = sum(totals[1:])
+
+  freqs = {}
+  for d in range(1, 10):
+    p_hat = totals[d] / x_hat if x_hat > 0 else 0.0
+
+    #
+    # linearized variance of the ratio estimator: residuals
+    # e = y - p x per page, variance between pages per stratum,
+    # with the finite population correction:
+    #
+    variance = 0.0
+    for ((first, last), pages) in zip(strata, samples):
+      size = last - first
+      n_h = len(pages)
+      if n_h < 2 or x_hat == 0:
+        continue
+      residuals = [rows[i][d] - p_hat * sum(rows[i][1:]) for i in pages]
+      mean = sum(residuals) / n_h
+      s2 = sum((e - mean) ** 2 for e in residuals) / (n_h - 1)
+      variance += size * size * (1 - n_h / size) * s2 / n_h
+    half = Z95 * math.sqrt(variance) / x_hat if x_hat > 0 else 0.0
+
+    freqs[str(d)] = (p_hat, max(0.0, p_hat - half), min(1.0, p_hat + half))
+
+  estimated = {str(d): round(totals[d]) for d in range(10)}
+  whole = benford.fit(estimated)
+
+  #
+  # the fit statistics are not linear in the counts, so their
+  # intervals come from resampling pages within each stratum:
+  #
+  chisqs = []
+  mads = []
+  for _ in range(bootstrap):
+    resampled_rows = {}
+    resampled = []
+    for pages in samples:
+      picks = [rng.choice(pages) for _ in pages]
+      keys = []
+      for (k, i) in enumerate(picks):
+        resampled_rows[(i, k)] = rows[i]
+        keys.append((i, k))
+      resampled.append(keys)
+    boot = _ratio_estimate(strata, resampled, resampled_rows)
+    stats = benford.fit({str(d): boot[d] for d in range(10)})
+    chisqs.append(stats['chisq'])
+    mads.append(stats['mad'])
+
+  def interval(value, values):
+    if len(values) == 0:
+      return (value, value, value)
+    values.sort()
+    return (value, values[int(0.025 * (len(values) - 1))], values[int(0.975 * (len(values) - 1))])
+
+  return {
+    'sampled': sum(len(pages) for pages in samples),
+    'counts': estimated,
+    'freqs': freqs,
+    'chisq': interval(whole['chisq'], chisqs),
+    'mad': interval(whole['mad'], mads)
+  }
+
+
+###################################################################
+#
+# format_provisional
+#
+def format_provisional(number_of_pages, result):
+  """
+  Returns the contents of a provisional results file:
+
+    **PROVISIONAL RESULTS**
+    <n> pages, <k> sampled
+    <digit> <estimated count> <frequency> <95% low> <95% high>
+    ...
+    chi-square <value> <95% low> <95% high>
+    MAD <value> <95% low> <95% high>
+  """
+  lines = ["**PROVISIONAL RESULTS**\n",
+           f"{number_of_pages} pages, {result['sampled']} sampled\n",
+           f"0 {result['counts']['0']}\n"]
+
+  for d in range(1, 10):
+    (p, low, high) = result['freqs'][str(d)]
+    lines.append(f"{d} {result['counts'][str(d)]} {p:.4f} {low:.4f} {high:.4f}\n")
+
+  (value, low, high) = result['chisq']
+  lines.append(f"chi-square {value:.2f} {low:.2f} {high:.2f}\n")
+  (value, low, high) = result['mad']
+  lines.append(f"MAD {value:.4f} {low:.4f} {high:.4f}\n")
+
+  return "".join(lines)
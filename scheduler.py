@@ -0,0 +1,285 @@
+#
+# scheduler.py
+#
+# Per-user fair-share scheduling of jobs. Jobs are queued per user
+# (FIFO within a user) and dispatched to workers under a global cap
+# on the number of jobs running at once, which bounds the RDS
+# connections, and a per-user cap, so one user bulk-uploading
+# thousands of PDFs cannot take every worker while others wait.
+# Among the users with queued jobs and room under their cap, the
+# next job goes to the user with the smallest virtual time (stride
+# scheduling): every dispatch advances a user's virtual time by
+# 1 / weight, so a user of weight 2 gets twice the share of a user
+# of weight 1 while both have jobs waiting. A user who arrives (or
+# comes back after being idle) starts at the current minimum, so
+# idleness earns no credit. The per-user cap is work-conserving:
+# when no user under their cap has a job queued, the idle workers
+# take the jobs of users over it, so a batch from a single user
+# still runs max_running jobs at once.
+#
+#   [scheduler]
+#   enabled = false        schedule the records of a batch event
+#                          by user, instead of in arrival order
+#   per_user = 2           jobs of one user running at once
+#                          while other users have jobs waiting
+#   weights = 80001:2, 80002:0.5
+#   default_weight = 1
+#
+# The global cap is [lambda] max_workers. run_jobs() is the
+# in-process queue plus worker pool used by lambda_function (and
+# loadtest.py); FairScheduler.metrics() reports queue depth and wait
+# times per user.
+#
+# Scope: this is fair share within one batch, i.e. one invocation
+# of the compute lambda (at most 10 records from SQS), not across
+# all uploads; there is no queue shared between invocations. A bulk
+# upload spread over many invocations still competes with everyone
+# else's, and nothing here limits the jobs (or RDS connections) of
+# concurrent invocations: each container holds up to max_workers + 1
+# connections, and Lambda starts as many containers as events keep
+# arriving. That limit belongs to the deployment, as reserved
+# concurrency of the compute lambda or maximum concurrency of its
+# SQS event source, e.g.
+#
+#   aws lambda put-function-concurrency --function-name proj03_compute \
+#     --reserved-concurrent-executions 10
+#   aws lambda update-event-source-mapping --uuid <mapping> \
+#     --scaling-config MaximumConcurrency=10
+#
+# for at most 10 x (max_workers + 1) connections from the lambda.
+#
+
+import threading
+import time
+
+from collections import deque
+
+
+class FairScheduler:
+
+  def __init__(self, max_running=4, per_user=2, weights=None, default_weight=1.0):
+    self.max_running = max_running
+    self.per_user = per_user
+    self.weights = weights or {}
+    self.default_weight = default_weight
+
+    self._cond = threading.Condition()
+    self._queues = {}      # userid -> deque of (item, submitted)
+    self._running = {}     # userid -> jobs running
+    self._vtime = {}       # userid -> virtual time
+    self._total_running = 0
+    self._closed = False
+
+    self._stats = {}       # userid -> dict of counters
+
+  def _user_stats(self, userid):
+    if userid not in self._stats:
+      self._stats[userid] = {'submitted': 0, 'dispatched': 0, 'wait_secs': 0.0, 'max_wait_secs': 0.0}
+    return self._stats[userid]
+
+  def weight(self, userid):
+    return self.weights.get(str(userid), self.default_weight)
+
+  def submit(self, userid, item):
+    """
+    Queues an item (a job) of a user.
+    """
+    with self._cond:
+      if self._closed:
+        raise Exception("scheduler is closed")
+
+      queue = self._queues.setdefault(userid, deque())
+      if len(queue) == 0 and self._running.get(userid, 0) == 0:
+        #
+        # (re)joining: start at the current minimum virtual time
+        # of the active users, or keep our own if it is later:
+        #
+        active = [self._vtime[u] for u in self._queues if u != userid and (len(self._queues[u]) > 0 or self._running.get(u, 0) > 0)]
+        floor = min(active) if len(active) > 0 else 0.0
+        self._vtime[userid] = max(self._vtime.get(userid, 0.0), floor)
+
+      queue.append((item, time.perf_counter()))
+      self._user_stats(userid)['submitted'] += 1
+      self._cond.notify()
+
+  def close(self):
+    """
+    No more submissions; get() returns None once the queues are
+    empty.
+    """
+    with self._cond:
+      self._closed = True
+      self._cond.notify_all()
+
+  def _pick(self):
+    if self._total_running >= self.max_running:
+      return None
+
+    #
+    # the users under their cap first; if none of them has a job
+    # queued, anyone's (work-conserving):
+    #
+    for capped in [True, False]:
+      best = None
+      for (userid, queue) in self._queues.items():
+        if len(queue) == 0 or (capped and self._running.get(userid, 0) >= self.per_user):
+          continue
+        if best is None or self._vtime[userid] < self._vtime[best]:
+          best = userid
+      if best is not None:
+        return best
+
+    return None
+
+  def get(self):
+    """
+    Blocks until a job may run, and returns it as (userid, item);
+    returns None when the scheduler is closed and drained. Call
+    done(userid) when the job has finished.
+    """
+    with self._cond:
+      while True:
+        userid = self._pick()
+        if userid is not None:
+          break
+        if self._closed and all(len(q) == 0 for q in self._queues.values()):
+          return None
+        self._cond.wait()
+
+      (item, submitted) = self._queues[userid].popleft()
+      self._running[userid] = self._running.get(userid, 0) + 1
+      self._total_running += 1
+      self._vtime[userid] += 1.0 / self.weight(userid)
+
+      wait = time.perf_counter() - submitted
+      stats = self._user_stats(userid)
+      stats['dispatched'] += 1
+      stats['wait_secs'] += wait
+      stats['max_wait_secs'] = max(stats['max_wait_secs'], wait)
+
+      return (userid, item)
+
+  def done(self, userid):
+    """
+    Marks a job of the user, returned by get(), as finished.
+    """
+    with self._cond:
+      self._running[userid] -= 1
+      self._total_running -= 1
+      self._cond.notify_all()
+
+  def metrics(self):
+    """
+    Returns per-user queue depth, running jobs and wait times, and
+    the totals, as a dict
+    """
+    with self._cond:
+      users = {}
+      for (userid, stats) in self._stats.items():
+        dispatched = stats['dispatched']
+        users[userid] = {
+          'queued': len(self._queues.get(userid, ())),
+          'running': self._running.get(userid, 0),
+          'submitted': stats['submitted'],
+          'dispatched': dispatched,
+          'avg_wait_ms': 1000 * stats['wait_secs'] / dispatched if dispatched > 0 else 0.0,
+          'max_wait_ms': 1000 * stats['max_wait_secs']
+        }
+
+      return {
+        'queued': sum(len(q) for q in self._queues.values()),
+        'running': self._total_running,
+        'users': users
+      }
+
+
+###################################################################
+#
+# run_jobs
+#
+def run_jobs(scheduler, jobs, process, workers=None, executor=None):
+  """
+  Runs jobs through a scheduler with a pool of worker threads
+
+  Parameters
+  ----------
+  scheduler: FairScheduler (closed by this function),
+  jobs: list of (userid, item),
+  process: function called with an item, in a worker thread,
+  workers: number of worker threads (default: the scheduler's
+    global cap),
+  executor: run the workers on this executor's threads instead of
+    new ones (lambda_function keeps one per container)
+
+  Returns
+  -------
+  list of process(item) results, in the order of jobs; an
+  exception raised by process is returned as the result
+  """
+  if workers is None:
+    workers = scheduler.max_running
+
+  results = [None] * len(jobs)
+
+  for (index, (userid, item)) in enumerate(jobs):
+    scheduler.submit(userid, (index, item))
+  scheduler.close()
+
+  def worker():
+    while True:
+      job = scheduler.get()
+      if job is None:
+        return
+      (userid, (index, item)) = job
+      try:
+        results[index] = process(item)
+      except Exception as err:
+        results[index] = err
+      finally:
+        scheduler.done(userid)
+
+  if executor is not None:
+    futures = [executor.submit(worker) for _ in range(workers)]
+    for future in futures:
+      future.result()
+    return results
+
+  threads = [threading.Thread(target=worker, name=f"scheduler-{i}", daemon=True) for i in range(workers)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  return results
+
+
+def parse_weights(text):
+  """
+  Parses "userid:weight, userid:weight, ..." into a dict.
+  """
+  weights = {}
+  for entry in text.split(","):
+    if entry.strip() == "":
+      continue
+    (userid, _, weight) = entry.partition(":")
+    weights[userid.strip()] = float(weight)
+  return weights
+
+
+class SchedulerConfig:
+
+  def __init__(self, configur):
+    self.enabled = configur.getboolean('scheduler', 'enabled', fallback=False)
+    self.per_user = configur.getint('scheduler', 'per_user', fallback=2)
+    self.weights = parse_weights(configur.get('scheduler', 'weights', fallback=''))
+    self.default_weight = configur.getfloat('scheduler', 'default_weight', fallback=1.0)
+
+  def new_scheduler(self, max_running):
+    """
+    Returns a new FairScheduler with this configuration and the
+    given global cap.
+    """
+    return FairScheduler(max_running=max_running,
+                         per_user=self.per_user,
+                         weights=self.weights,
+                         default_weight=self.default_weight)
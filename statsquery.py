@@ -0,0 +1,245 @@
+#
+# statsquery.py
+#
+# Server side of GET /stats: finds completed jobs by their results,
+# from the jobstats / jobdigits tables (see jobstats.py) rather than
+# the results files. The query string parameters are all optional:
+#
+#   where=d1<0.25,chisq>20    conditions, all of which must hold
+#   userid=80001              jobs of this user
+#   limit=100                 at most this many jobs (default 1000)
+#
+# A condition is <field><op><number>, op one of < <= > >= =, and
+# field one of
+#
+#   d1 .. d9     frequency of a first digit, 0..1 (or in %: d1<25%)
+#   c1 .. c9     count of a first digit
+#   units        pages (rows, lines for ledgers)
+#   total        first digits counted
+#   chisq, mad   the Benford fit, see benford.fit
+#
+# Conditions become a parameterized query over whitelisted columns;
+# each digit filtered on joins jobdigits once, through its (digit,
+# frequency) index. The response body is the list of matching jobs,
+# as rows of STATS_COLUMNS, in jobid order.
+#
+
+import datatier
+import json
+import re
+
+from configparser import ConfigParser
+
+
+STATS_COLUMNS = ["jobid", "userid", "originaldatafile", "unit", "units", "total", "chisq", "mad"] + \
+                [f"d{d}" for d in range(1, 10)]
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+
+_condition_re = re.compile(r'^\s*([a-z]+[1-9]?)\s*(<=|>=|<|>|=)\s*([-+]?[0-9]*\.?[0-9]+)\s*(%?)\s*$')
+
+#
+# fields on jobstats:
+#
+_STATS_FIELDS = {
+  "units": "s.numunits",
+  "total": "s.total",
+  "chisq": "s.chisq",
+  "mad": "s.mad",
+}
+
+
+###################################################################
+#
+# parse_filters
+#
+def parse_filters(params):
+  """
+  Validates the query string parameters of GET /stats
+
+  Parameters
+  ----------
+  params: dict of query string parameters (or None)
+
+  Returns
+  -------
+  dict with conditions (list of (field, op, value)), limit and
+  possibly userid
+
+  Raises ValueError if a parameter is malformed.
+  """
+  params = params or {}
+  filters = {'conditions': [], 'limit': DEFAULT_LIMIT}
+
+  for condition in params.get('where', '').split(","):
+    if condition.strip() == "":
+      continue
+
+    match = _condition_re.match(condition)
+    if match is None:
+      raise ValueError(f"where: '{condition.strip()}' is not <field><op><number>")
+
+    (field, op, value, percent) = match.groups()
+    if field not in _STATS_FIELDS and re.match(r'^[dc][1-9]$', field) is None:
+      raise ValueError(f"where: unknown field '{field}'")
+    if percent == "%" and not field.startswith("d"):
+      raise ValueError("where: only digit frequencies (d1..d9) can be given in %")
+
+    value = float(value)
+    if percent == "%":
+      value = value / 100
+
+    filters['conditions'].append((field, op, value))
+
+  if params.get('userid', '') != '':
+    if not params['userid'].isnumeric():
+      raise ValueError(f"userid: '{params['userid']}' is not a number")
+    filters['userid'] = int(params['userid'])
+
+  if params.get('limit', '') != '':
+    if not params['limit'].isnumeric() or int(params['limit']) == 0:
+      raise ValueError(f"limit: '{params['limit']}' is not a positive number")
+    filters['limit'] = min(int(params['limit']), MAX_LIMIT)
+
+  return filters
+
+
+###################################################################
+#
+# build_query
+#
+def build_query(filters):
+  """
+  Builds the parameterized SELECT of the jobs matching the filters
+
+  Parameters
+  ----------
+  filters: as returned by parse_filters
+
+  Returns
+  -------
+  (sql, list of parameters)
+  """
+  joins = []
+  where = []
+  parameters = []
+
+  #
+  # one join per digit, whatever the number of conditions on it:
+  #
+  digits = []
+  for (field, _, _) in filters['conditions']:
+    if field[0] in "dc" and field[1:].isnumeric() and int(field[1:]) not in digits:
+      digits.append(int(field[1:]))
+
+  for digit in digits:
+    joins.append(f"JOIN jobdigits g{digit} ON g{digit}.jobid = s.jobid AND g{digit}.digit = {digit}")
+
+  for (field, op, value) in filters['conditions']:
+    if field in _STATS_FIELDS:
+      column = _STATS_FIELDS[field]
+    elif field[0] == "d":
+      column = f"g{field[1:]}.frequency"
+    else:
+      column = f"g{field[1:]}.count"
+    where.append(f"{column} {op} %s")
+    parameters.append(value)
+
+  if 'userid' in filters:
+    where.append("j.userid = %s")
+    parameters.append(filters['userid'])
+
+  sql = "SELECT s.jobid, j.userid, j.originaldatafile, s.unit, s.numunits, s.total, s.chisq, s.mad" \
+        " FROM jobstats s JOIN jobs j ON j.jobid = s.jobid"
+  for join in joins:
+    sql += " " + join
+  if len(where) > 0:
+    sql += " WHERE " + " AND ".join(where)
+
+  sql += " ORDER BY s.jobid LIMIT %s"
+  parameters.append(filters['limit'])
+
+  return (sql + ";", parameters)
+
+
+###################################################################
+#
+# get_stats
+#
+def get_stats(dbConn, filters):
+  """
+  Retrieves the jobs matching the filters, with their frequencies
+
+  Parameters
+  ----------
+  dbConn: database connection,
+  filters: as returned by parse_filters
+
+  Returns
+  -------
+  list of rows (lists of the values of STATS_COLUMNS)
+  """
+  (sql, parameters) = build_query(filters)
+
+  rows = [list(row) for row in datatier.retrieve_all_rows(dbConn, sql, parameters)]
+  if len(rows) == 0:
+    return []
+
+  #
+  # the frequencies of the matching jobs, in one more query:
+  #
+  jobids = [row[0] for row in rows]
+  sql = "SELECT jobid, digit, frequency FROM jobdigits WHERE jobid IN (" + ", ".join(["%s"] * len(jobids)) + ");"
+
+  freqs = {}
+  for (jobid, digit, frequency) in datatier.retrieve_all_rows(dbConn, sql, jobids):
+    freqs[(jobid, int(digit))] = frequency
+
+  return [row + [freqs.get((row[0], d), 0.0) for d in range(1, 10)] for row in rows]
+
+
+###################################################################
+#
+# lambda_handler
+#
+def lambda_handler(event, context):
+  try:
+    print("**STARTING**")
+    print("**lambda: proj03_stats**")
+
+    try:
+      filters = parse_filters(event.get('queryStringParameters'))
+    except ValueError as err:
+      print("**ERROR:", str(err))
+      return {
+        'statusCode': 400,
+        'body': json.dumps(str(err))
+      }
+
+    configur = ConfigParser()
+    configur.read('benfordapp-config.ini')
+
+    dbConn = datatier.get_dbConn(configur.get('rds', 'endpoint'),
+                                 int(configur.get('rds', 'port_number')),
+                                 configur.get('rds', 'user_name'),
+                                 configur.get('rds', 'user_pwd'),
+                                 configur.get('rds', 'db_name'))
+
+    rows = get_stats(dbConn, filters)
+
+    print("**DONE,", len(rows), "jobs**")
+
+    return {
+      'statusCode': 200,
+      'body': json.dumps(rows)
+    }
+
+  except Exception as err:
+    print("**ERROR**")
+    print(str(err))
+
+    return {
+      'statusCode': 500,
+      'body': json.dumps(str(err))
+    }
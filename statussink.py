@@ -0,0 +1,222 @@
+#
+# statussink.py
+#
+# Where lambda_function reports the progress of a job. Progress
+# messages ("processing - page x of y completed") are frequent, so
+# they can go to a fast key-value store instead of the jobs table
+# in RDS; only terminal states ('completed' / 'error' with the
+# resultsfilekey) are always written back to the jobs table, by
+# the handler itself.
+#
+# Backends, selected by the [status] section of the config file:
+#   backend = rds     -- UPDATE jobs ... (the default); with
+#                        write_behind = true (the default) the
+#                        updates are queued and written by a
+#                        background thread, see writebehind.py
+#   backend = redis   -- Redis hash per job (redis_host, redis_port,
+#                        redis_db, ttl_secs)
+#   backend = memory  -- in-process stand-in for Redis, for tests
+#                        and local runs
+#
+
+import datatier
+import threading
+import time
+import writebehind
+
+
+class StatusSink:
+  """
+  Interface: receives the status of jobs, identified by their
+  datafilekey.
+  """
+
+  def progress(self, datafilekey, status):
+    """
+    Reports a non-terminal status of a job.
+    """
+    raise NotImplementedError()
+
+  def finished(self, datafilekey, status, resultsfilekey):
+    """
+    Reports a terminal status ('completed' or 'error'), or a
+    provisional one that comes with results; the jobs table has
+    already been updated by the caller.
+    """
+    raise NotImplementedError()
+
+  def flush(self, datafilekey=None):
+    """
+    Makes sure every progress reported so far has been written;
+    called before the caller writes a terminal status itself.
+    Raises an error of the job's writes (any job's if datafilekey
+    is None).
+    """
+    pass
+
+  def metrics(self):
+    """
+    Returns a dict of metrics about the sink, or None.
+    """
+    return None
+
+
+###################################################################
+#
+# RDSStatusSink
+#
+# Writes progress into the status column of the jobs table, i.e.
+# the original behavior, either directly or through a write-behind
+# queue.
+#
+class RDSStatusSink(StatusSink):
+
+  def __init__(self, get_dbConn, write_behind=None):
+    self.get_dbConn = get_dbConn
+    self.write_behind = write_behind
+
+  def progress(self, datafilekey, status):
+    sql = """UPDATE jobs SET status = %s  WHERE datafilekey = %s;"""
+    if self.write_behind is not None:
+      self.write_behind.submit(datafilekey, sql, [status, datafilekey], coalesce=True)
+    else:
+      datatier.perform_action(self.get_dbConn(), sql, [status, datafilekey])
+
+  def finished(self, datafilekey, status, resultsfilekey):
+    # already in the jobs table:
+    pass
+
+  def flush(self, datafilekey=None):
+    if self.write_behind is not None:
+      self.write_behind.flush(datafilekey)
+
+  def metrics(self):
+    if self.write_behind is not None:
+      return self.write_behind.metrics()
+    return None
+
+
+###################################################################
+#
+# KVStatusSink
+#
+# Writes status into a hash per job in a Redis-style key-value
+# store: HSET <prefix><datafilekey> status ... updated ...
+#
+class KVStatusSink(StatusSink):
+
+  def __init__(self, kv, prefix="benfordapp:job:", ttl_secs=86400):
+    self.kv = kv
+    self.prefix = prefix
+    self.ttl_secs = ttl_secs
+
+  def _write(self, datafilekey, fields):
+    key = self.prefix + datafilekey
+    fields['updated'] = str(time.time())
+    self.kv.hset(key, mapping=fields)
+    self.kv.expire(key, self.ttl_secs)
+
+  def progress(self, datafilekey, status):
+    self._write(datafilekey, {'status': status})
+
+  def finished(self, datafilekey, status, resultsfilekey):
+    self._write(datafilekey, {'status': status, 'resultsfilekey': resultsfilekey})
+
+  def get_status(self, datafilekey):
+    """
+    Returns the job's fields as a dict of strings, {} if unknown.
+    """
+    fields = self.kv.hgetall(self.prefix + datafilekey)
+    return {self._str(k): self._str(v) for (k, v) in fields.items()}
+
+  @staticmethod
+  def _str(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+###################################################################
+#
+# InMemoryKV
+#
+# Implements the few Redis hash commands KVStatusSink uses, in
+# process memory.
+#
+class InMemoryKV:
+
+  def __init__(self):
+    self._hashes = {}
+    self._expires = {}
+    self._lock = threading.Lock()
+
+  def _expire_if_needed(self, key):
+    expires = self._expires.get(key)
+    if expires is not None and expires <= time.time():
+      self._hashes.pop(key, None)
+      self._expires.pop(key, None)
+
+  def hset(self, key, mapping):
+    with self._lock:
+      self._expire_if_needed(key)
+      self._hashes.setdefault(key, {}).update(mapping)
+      return len(mapping)
+
+  def hgetall(self, key):
+    with self._lock:
+      self._expire_if_needed(key)
+      return dict(self._hashes.get(key, {}))
+
+  def expire(self, key, seconds):
+    with self._lock:
+      if key not in self._hashes:
+        return False
+      self._expires[key] = time.time() + seconds
+      return True
+
+  def delete(self, key):
+    with self._lock:
+      self._expires.pop(key, None)
+      return 1 if self._hashes.pop(key, None) is not None else 0
+
+
+###################################################################
+#
+# make_status_sink
+#
+def make_status_sink(configur, get_dbConn, connect_db=None):
+  """
+  Creates the status sink selected by the [status] config section
+
+  Parameters
+  ----------
+  configur: ConfigParser with the lambda's configuration,
+  get_dbConn: function returning the caller's DB connection,
+  connect_db: function opening a new DB connection, for the
+    write-behind thread
+
+  Returns
+  -------
+  a StatusSink
+  """
+  backend = configur.get('status', 'backend', fallback='rds')
+  ttl_secs = configur.getint('status', 'ttl_secs', fallback=86400)
+
+  if backend == 'rds':
+    write_behind = None
+    if connect_db is not None and configur.getboolean('status', 'write_behind', fallback=True):
+      write_behind = writebehind.WriteBehind(connect_db,
+                                             maxsize=configur.getint('status', 'queue_size', fallback=1000),
+                                             batch_size=configur.getint('status', 'batch_size', fallback=50))
+    return RDSStatusSink(get_dbConn, write_behind)
+
+  if backend == 'memory':
+    return KVStatusSink(InMemoryKV(), ttl_secs=ttl_secs)
+
+  if backend == 'redis':
+    import redis
+
+    kv = redis.Redis(host=configur.get('status', 'redis_host'),
+                     port=configur.getint('status', 'redis_port', fallback=6379),
+                     db=configur.getint('status', 'redis_db', fallback=0))
+    return KVStatusSink(kv, ttl_secs=ttl_secs)
+
+  raise Exception(f"unknown status backend '{backend}'")
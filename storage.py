@@ -0,0 +1,225 @@
+#
+# storage.py
+#
+# Where the PDFs are read from and the results written to. The
+# lambda addresses documents by bucket key; a Storage maps keys to
+# objects in an S3 bucket (the default), or to files under a root
+# directory, e.g. a local disk or NFS mount on a batch node, so
+# runs over a local archive go at disk speed with no S3 round trip:
+#
+#   [storage]
+#   backend = s3           (default) the bucket of [s3] bucket_name
+#   backend = filesystem
+#   root = /mnt/archive    key a/b.pdf is the file /mnt/archive/a/b.pdf
+#
+# The filesystem backend reads PDFs in place (no copy) and writes
+# results straight into the tree. It keeps no content type or
+# encoding; readers of a compressed results file recognize it by
+# its magic bytes (compression.sniff_decompress). The user metadata
+# of a file, if any, is the JSON object in <file>.meta.json.
+#
+
+import datetime
+import json
+import os
+import shutil
+import uuid
+
+
+class Storage:
+  """
+  Interface: objects addressed by key.
+  """
+
+  def size(self, key):
+    """
+    Returns the size of an object in bytes.
+    """
+    raise NotImplementedError()
+
+  def read_range(self, key, offset, length):
+    """
+    Returns up to length bytes of an object starting at offset; a
+    negative offset counts from the end (the last -offset bytes).
+    """
+    raise NotImplementedError()
+
+  def read(self, key):
+    """
+    Returns (the contents of an object, its last-modified datetime).
+    """
+    raise NotImplementedError()
+
+  def stream(self, key):
+    """
+    Returns (a binary file-like object reading the object from the
+    start, the object's user metadata as a dict); the caller closes
+    the stream.
+    """
+    raise NotImplementedError()
+
+  def local_path(self, key, local_tmp):
+    """
+    Returns the path of a local file holding the object: local_tmp,
+    after downloading the object to it, or the object itself if it
+    is already a local file. The caller removes local_tmp.
+    """
+    raise NotImplementedError()
+
+  def put_file(self, local_file, key, content_type='text/plain', content_encoding=None):
+    """
+    Stores the contents of a local file as an object, publicly
+    readable.
+    """
+    raise NotImplementedError()
+
+
+###################################################################
+#
+# S3Storage
+#
+class S3Storage(Storage):
+
+  def __init__(self, s3, bucketname):
+    self.s3 = s3
+    self.bucketname = bucketname
+
+  def size(self, key):
+    return self.s3.head_object(Bucket=self.bucketname, Key=key)['ContentLength']
+
+  def read_range(self, key, offset, length):
+    if offset < 0:
+      byte_range = f"bytes={offset}"
+    else:
+      byte_range = f"bytes={offset}-{offset + length - 1}"
+    response = self.s3.get_object(Bucket=self.bucketname, Key=key, Range=byte_range)
+    return response['Body'].read()
+
+  def read(self, key):
+    response = self.s3.get_object(Bucket=self.bucketname, Key=key)
+    return (response['Body'].read(), response.get('LastModified'))
+
+  def stream(self, key):
+    response = self.s3.get_object(Bucket=self.bucketname, Key=key)
+    return (response['Body'], response.get('Metadata', {}))
+
+  def local_path(self, key, local_tmp):
+    self.s3.download_file(self.bucketname, key, local_tmp)
+    return local_tmp
+
+  def put_file(self, local_file, key, content_type='text/plain', content_encoding=None):
+    extra_args = {
+      'ACL': 'public-read',
+      'ContentType': content_type
+    }
+    if content_encoding is not None:
+      extra_args['ContentEncoding'] = content_encoding
+
+    self.s3.upload_file(local_file, self.bucketname, key, ExtraArgs=extra_args)
+
+
+###################################################################
+#
+# FilesystemStorage
+#
+class FilesystemStorage(Storage):
+
+  def __init__(self, root):
+    self.root = os.path.realpath(root)
+
+  def path(self, key):
+    """
+    Returns the file of a key; keys cannot leave the root, neither
+    by .. or an absolute path, nor through a symbolic link.
+    """
+    path = os.path.realpath(os.path.join(self.root, key))
+    if os.path.commonpath([self.root, path]) != self.root:
+      raise Exception(f"storage: key '{key}' is outside of {self.root}")
+    return path
+
+  def size(self, key):
+    return os.path.getsize(self.path(key))
+
+  def read_range(self, key, offset, length):
+    with open(self.path(key), "rb") as infile:
+      if offset < 0:
+        infile.seek(max(0, os.fstat(infile.fileno()).st_size + offset))
+        length = -offset
+      else:
+        infile.seek(offset)
+      return infile.read(length)
+
+  def read(self, key):
+    path = self.path(key)
+    with open(path, "rb") as infile:
+      data = infile.read()
+    modified = datetime.datetime.fromtimestamp(os.path.getmtime(path), datetime.timezone.utc)
+    return (data, modified)
+
+  def stream(self, key):
+    path = self.path(key)
+
+    metadata = {}
+    if os.path.isfile(path + ".meta.json"):
+      with open(path + ".meta.json", "r") as infile:
+        metadata = json.load(infile)
+
+    return (open(path, "rb"), metadata)
+
+  def local_path(self, key, local_tmp):
+    path = self.path(key)
+    if not os.path.isfile(path):
+      raise FileNotFoundError(f"storage: no such file '{path}'")
+    return path
+
+  def put_file(self, local_file, key, content_type='text/plain', content_encoding=None):
+    #
+    # copy next to the target and rename, so readers never see a
+    # partial file:
+    #
+    path = self.path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    partial = f"{path}.{uuid.uuid4()}.partial"
+    try:
+      shutil.copyfile(local_file, partial)
+      os.chmod(partial, 0o644)
+      os.replace(partial, path)
+    finally:
+      if os.path.exists(partial):
+        os.remove(partial)
+
+
+###################################################################
+#
+# make_storage
+#
+def make_storage(configur, s3=None):
+  """
+  Creates the storage selected by the [storage] config section
+
+  Parameters
+  ----------
+  configur: ConfigParser with the lambda's configuration,
+  s3: S3 client to use (default: a boto3 client with the
+    s3readwrite profile)
+
+  Returns
+  -------
+  a Storage
+  """
+  backend = configur.get('storage', 'backend', fallback='s3')
+
+  if backend == 's3':
+    if s3 is None:
+      import boto3
+
+      boto3.setup_default_session(profile_name='s3readwrite')
+      s3 = boto3.client('s3')
+
+    return S3Storage(s3, configur.get('s3', 'bucket_name'))
+
+  if backend == 'filesystem':
+    return FilesystemStorage(configur.get('storage', 'root'))
+
+  raise Exception(f"unknown storage backend '{backend}'")
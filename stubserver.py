@@ -0,0 +1,251 @@
+#
+# stubserver.py
+#
+# A local stand-in for the API Gateway web service, to test the
+# client (main.py) without AWS. Jobs live in loadtest.py's SQLite
+# database, files in a temporary directory (storage.py's filesystem
+# backend), and uploaded PDFs are processed in a background thread
+# by lambda_function itself, so the client sees the same statuses
+# and results as against the real service:
+#
+#   GET  /jobs                     jobsquery.py
+#   POST /pdf/{userid}             returns the new job id
+#   GET  /results/{jobid}          longpoll.py, ?wait=&since= too
+#   GET  /results?jobids=...       resultsbatch.py
+#   GET  /lookup/{userid}/{hash}   resultslookup.py
+#   GET  /stats                    statsquery.py
+#
+#   python3 stubserver.py [PORT [LATENCY_MS]]
+#
+# then answer the client's config file prompt with a config whose
+# webservice is the printed http://127.0.0.1:PORT URL. In tests,
+# start a StubServer and call main's functions with its baseurl;
+# requests counts the calls per route and uploaded_bytes the bytes
+# received, e.g. to check that an upload was skipped. latency_secs
+# delays every request, standing in for the gateway and Lambda
+# overhead of the real service.
+#
+
+import base64
+import compression
+import jobsquery
+import json
+import lambda_function
+import loadtest
+import longpoll
+import os
+import resultsbatch
+import resultslookup
+import shutil
+import statsquery
+import storage
+import sys
+import tempfile
+import threading
+import time
+import urllib.parse
+import uuid
+
+from configparser import ConfigParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+
+  def __init__(self, port=0, latency_secs=0.0):
+    self.latency_secs = latency_secs
+    self.root = tempfile.mkdtemp(prefix="benfordstub-")
+    self.storage = storage.FilesystemStorage(self.root)
+    self.db = loadtest.LocalDB()
+    self._lock = threading.Lock()
+    self._next_jobid = 1001
+    self._threads = []
+
+    self.requests = {}
+    self.uploaded_bytes = 0
+
+    configur = ConfigParser()
+    configur.read_string(loadtest.DEFAULT_CONFIG)
+    configur.read_dict({'storage': {'backend': 'filesystem', 'root': self.root},
+                        'jobstats': {'enabled': 'true'}})
+    self.clients = lambda_function.Clients(configur, connect_db=self.db.connect)
+
+    stub = self
+
+    class Handler(StubHandler):
+      server_stub = stub
+
+    self.httpd = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    self.baseurl = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+
+  def start(self):
+    lambda_function.set_clients(self.clients)
+    thread = threading.Thread(target=self.httpd.serve_forever, name="stubserver", daemon=True)
+    thread.start()
+    return self
+
+  def stop(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    self.wait()
+    lambda_function.set_clients(None)
+    shutil.rmtree(self.root, ignore_errors=True)
+
+  def wait(self):
+    """
+    Waits until every uploaded PDF has been processed.
+    """
+    for thread in list(self._threads):
+      thread.join()
+
+  def count(self, route):
+    with self._lock:
+      self.requests[route] = self.requests.get(route, 0) + 1
+    if self.latency_secs > 0:
+      time.sleep(self.latency_secs)
+
+  def create_job(self, userid, filename, pdf):
+    """
+    Stores an uploaded PDF, creates its job and starts processing
+    it; returns the job id.
+    """
+    with self._lock:
+      jobid = self._next_jobid
+      self._next_jobid += 1
+      self.uploaded_bytes += len(pdf)
+
+    datafilekey = f"stub/user{userid}/{uuid.uuid4()}.pdf"
+    path = self.storage.path(datafilekey)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as outfile:
+      outfile.write(pdf)
+
+    self.db.query("INSERT INTO jobs (jobid, userid, status, originaldatafile, datafilekey, resultsfilekey) "
+                  "VALUES (?, ?, 'uploaded', ?, ?, '')",
+                  [jobid, userid, os.path.basename(filename), datafilekey])
+
+    event = {'Records': [{'s3': {'object': {'key': urllib.parse.quote_plus(datafilekey)}}}]}
+    thread = threading.Thread(target=lambda_function.lambda_handler, args=(event, None), daemon=True)
+    self._threads.append(thread)
+    thread.start()
+
+    return jobid
+
+  def results(self, jobid, wait_secs=0, since=None):
+    """
+    Returns (HTTP status code, body) of GET /results/{jobid}; a
+    long poll re-reads the job every 10 to 100 ms.
+    """
+    return longpoll.results_response(self.db.connect(), self.storage, jobid,
+                                     wait_secs, since, interval_secs=0.01,
+                                     max_interval_secs=0.1)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+  server_stub = None
+
+  def log_message(self, format, *args):
+    pass
+
+  def _reply(self, status_code, body, headers={}):
+    payload = json.dumps(body).encode("utf-8")
+    self.send_response(status_code)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(payload)))
+    for (name, value) in headers.items():
+      self.send_header(name, value)
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def _reply_text(self, status_code, text, content_type):
+    payload = text.encode("utf-8")
+    self.send_response(status_code)
+    self.send_header("Content-Type", content_type)
+    self.send_header("Content-Length", str(len(payload)))
+    self.end_headers()
+    self.wfile.write(payload)
+
+  def do_GET(self):
+    stub = self.server_stub
+    url = urllib.parse.urlsplit(self.path)
+    parts = [p for p in url.path.split("/") if p != ""]
+
+    try:
+      if parts == ["jobs"]:
+        stub.count("jobs")
+        params = dict(urllib.parse.parse_qsl(url.query))
+        try:
+          (filters, columns) = jobsquery.parse_filters(params)
+        except ValueError as err:
+          return self._reply(400, str(err))
+        rows = jobsquery.get_jobs(stub.db.connect(), filters, columns)
+        return self._reply(200, rows, {'X-Jobs-Columns': ",".join(columns)})
+
+      if parts == ["results"]:
+        stub.count("results batch")
+        try:
+          jobids = resultsbatch.parse_jobids(dict(urllib.parse.parse_qsl(url.query)))
+        except ValueError as err:
+          return self._reply(400, str(err))
+        body = resultsbatch.batch_results(stub.db.connect(), stub.storage, jobids)
+        return self._reply_text(200, body, "application/x-ndjson")
+
+      if len(parts) == 2 and parts[0] == "results" and parts[1].isnumeric():
+        stub.count("results")
+        (wait_secs, since) = longpoll.parse_wait(dict(urllib.parse.parse_qsl(url.query)), 25.0)
+        return self._reply(*stub.results(int(parts[1]), wait_secs, since))
+
+      if parts == ["stats"]:
+        stub.count("stats")
+        try:
+          filters = statsquery.parse_filters(dict(urllib.parse.parse_qsl(url.query)))
+        except ValueError as err:
+          return self._reply(400, str(err))
+        return self._reply(200, statsquery.get_stats(stub.db.connect(), filters))
+
+      if len(parts) == 3 and parts[0] == "lookup":
+        stub.count("lookup")
+        return self._reply(*resultslookup.lookup(stub.db.connect(), stub.storage, parts[1], parts[2]))
+
+      return self._reply(404, "no such route")
+
+    except Exception as err:
+      return self._reply(500, str(err))
+
+  def do_POST(self):
+    stub = self.server_stub
+    parts = [p for p in urllib.parse.urlsplit(self.path).path.split("/") if p != ""]
+
+    try:
+      if len(parts) == 2 and parts[0] == "pdf":
+        stub.count("pdf")
+        if not parts[1].isnumeric():
+          return self._reply(400, "no such user...")
+
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        encoding = self.headers.get("Content-Encoding", "none")
+        if encoding not in ["none", "identity"]:
+          body = compression.decompress(body, encoding)
+        data = json.loads(body)
+
+        jobid = stub.create_job(int(parts[1]), data["filename"], base64.b64decode(data["data"]))
+        return self._reply(200, jobid)
+
+      return self._reply(404, "no such route")
+
+    except Exception as err:
+      return self._reply(500, str(err))
+
+
+if __name__ == "__main__":
+  port = int(sys.argv[1]) if len(sys.argv) > 1 else 8080
+  latency_secs = int(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0
+
+  stub = StubServer(port, latency_secs).start()
+  print("stub web service at", stub.baseurl, "(ctrl-c to stop)")
+
+  try:
+    threading.Event().wait()
+  except KeyboardInterrupt:
+    stub.stop()
@@ -0,0 +1,74 @@
+#
+# conftest.py
+#
+# Fixtures shared by the tests: the lambda runs against loadtest.py's
+# stand-ins, a SQLite database behind datatier's interface and an
+# in-memory S3, so no AWS account is needed.
+#
+#   python3 -m pytest -q
+#
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from configparser import ConfigParser
+
+import lambda_function
+import loadtest
+
+
+@pytest.fixture
+def db():
+  return loadtest.LocalDB()
+
+
+@pytest.fixture
+def s3():
+  return loadtest.LocalS3()
+
+
+@pytest.fixture
+def make_clients(db, s3):
+  """
+  Returns a function creating the lambda's Clients over db and s3,
+  with the built-in load-test config plus the given sections, and
+  installing them for lambda_handler.
+  """
+  def make(sections={}, connect_db=None):
+    configur = ConfigParser()
+    configur.read_string(loadtest.DEFAULT_CONFIG)
+    configur.read_dict(sections)
+    clients = lambda_function.Clients(configur, s3=s3, connect_db=connect_db or db.connect)
+    lambda_function.set_clients(clients)
+    return clients
+
+  yield make
+
+  lambda_function.set_clients(None)
+
+
+def add_job(db, jobid, datafilekey, userid=80001, status="uploaded"):
+  """
+  Inserts a jobs row, as the web service does on upload.
+  """
+  db.query("INSERT INTO jobs (jobid, userid, status, originaldatafile, datafilekey, resultsfilekey) "
+           "VALUES (?, ?, ?, ?, ?, '')",
+           [jobid, userid, status, os.path.basename(datafilekey), datafilekey])
+
+
+def job_status(db, datafilekey):
+  """
+  Returns the status of the job of a datafilekey.
+  """
+  return db.query("SELECT status FROM jobs WHERE datafilekey = ?", [datafilekey])[0][0]
+
+
+def s3_event(keys):
+  """
+  Returns a batched S3 event for the keys.
+  """
+  return {'Records': [{'s3': {'object': {'key': key}}} for key in keys]}
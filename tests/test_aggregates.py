@@ -0,0 +1,53 @@
+#
+# test_aggregates.py
+#
+
+import aggregates
+import datatier
+import lambda_function
+import loadtest
+import storage
+
+from conftest import add_job, s3_event
+
+
+def user_rows(db, userid):
+  return db.query("SELECT period, numjobs, numpages, count1 FROM userstats WHERE userid = ? ORDER BY period",
+                  [userid])
+
+
+def test_repeated_completion_counts_once(db, s3, make_clients):
+  # (no claims, so that the second delivery completes the job again)
+  make_clients({'aggregates': {'enabled': 'true'}, 'claim': {'enabled': 'false'}})
+
+  key = "test/job1.pdf"
+  s3.put(key, loadtest.make_pdf(3, 20))
+  add_job(db, 1, key)
+
+  for delivery in range(2):
+    assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+
+  rows = user_rows(db, 80001)
+  period = aggregates.current_period()
+
+  assert sorted(row[0] for row in rows) == sorted(["all", period])
+  assert all(row[1:3] == (1, 3) for row in rows)
+  assert rows[0][3] == rows[1][3] > 0
+  assert db.query("SELECT COUNT(*) FROM userstatsjobs")[0][0] == 1
+
+
+def test_backfill_adds_each_job_once(db, tmp_path):
+  results = storage.FilesystemStorage(str(tmp_path))
+  (tmp_path / "test").mkdir()
+  (tmp_path / "test" / "job1.txt").write_text("**RESULTS**\n3 pages\n1 10\n2 5\n3 1\n")
+
+  add_job(db, 1, "test/job1.pdf", status="completed")
+  db.query("UPDATE jobs SET resultsfilekey = 'test/job1.txt' WHERE jobid = 1")
+  add_job(db, 2, "test/job2.pdf", status="completed")
+  db.query("UPDATE jobs SET resultsfilekey = 'test/missing.txt' WHERE jobid = 2")
+
+  assert aggregates.backfill(db.connect(), results) == (1, 1)
+  assert aggregates.backfill(db.connect(), results) == (0, 1)
+
+  stats = aggregates.get_user_stats(db.connect(), 80001)
+  assert stats['numjobs'] == 1
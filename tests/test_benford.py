@@ -0,0 +1,28 @@
+#
+# test_benford.py
+#
+
+import benford
+import lambda_function
+import loadtest
+
+from conftest import add_job, s3_event
+
+
+def test_local_analysis_matches_the_lambda(db, s3, make_clients, tmp_path):
+  make_clients()
+
+  pdf = loadtest.make_pdf(20, 30, seed=7)
+  local_pdf = tmp_path / "doc.pdf"
+  local_pdf.write_bytes(pdf)
+
+  key = "test/doc.pdf"
+  s3.put(key, pdf)
+  add_job(db, 1, key)
+
+  assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+  lambda_results = s3.objects["test/doc.txt"]["Body"].decode("utf-8")
+
+  for workers in [1, 2]:
+    local_results = benford.format_results(*benford.analyze_pdf(str(local_pdf), workers))
+    assert local_results == lambda_results
@@ -0,0 +1,72 @@
+#
+# test_clientmetrics.py
+#
+
+import clientmetrics
+
+
+def test_endpoint_of_routes():
+  assert clientmetrics.endpoint_of("https://x/prod/results/1003") == "/results/{jobid}"
+  assert clientmetrics.endpoint_of("https://x/prod/pdf/80001") == "/pdf/{userid}"
+  assert clientmetrics.endpoint_of("https://x/prod/lookup/80001/ab12") == "/lookup/{userid}/{hash}"
+  assert clientmetrics.endpoint_of("https://x/prod/users") == "/users"
+
+
+def test_endpoint_of_long_poll_is_its_own_endpoint():
+  assert clientmetrics.endpoint_of("https://x/prod/results/1003?wait=20") == "/results/{jobid} (long poll)"
+  assert clientmetrics.endpoint_of("https://x/prod/results/1003?since=uploaded") == "/results/{jobid}"
+
+
+def test_endpoint_of_unknown_keeps_last_two_segments():
+  assert clientmetrics.endpoint_of("https://x/prod/a/b/c") == "/b/c"
+  assert clientmetrics.endpoint_of("https://x/prod/a/b/c?wait=5") == "/b/c (long poll)"
+  assert clientmetrics.endpoint_of("https://x/") == "/"
+
+
+def test_prometheus_format():
+  metrics = clientmetrics.ClientMetrics()
+  url = "https://x/prod/results/1003"
+  metrics.observe("GET", url, 200, 0.003, 0, 100)
+  metrics.observe("GET", url, 480, 0.2, 0, 20)
+  metrics.observe("GET", url, None, 60.0)
+  metrics.retry("GET", url)
+
+  lines = metrics.prometheus().splitlines()
+
+  name = "benford_client_request_duration_seconds"
+  assert f"# HELP {name} Latency of web service calls." in lines
+  assert f"# TYPE {name} histogram" in lines
+  assert "# TYPE benford_client_responses_total counter" in lines
+
+  labels = 'method="GET",endpoint="/results/{jobid}"'
+  buckets = [line for line in lines if line.startswith(name + "_bucket")]
+  assert len(buckets) == len(clientmetrics.LATENCY_BUCKETS) + 1
+  # cumulative counts, the last bucket holding every call
+  assert f'{name}_bucket{{{labels},le="0.005"}} 1' in lines
+  assert f'{name}_bucket{{{labels},le="0.25"}} 2' in lines
+  assert f'{name}_bucket{{{labels},le="30.0"}} 2' in lines
+  assert f'{name}_bucket{{{labels},le="+Inf"}} 3' in lines
+  assert f'{name}_sum{{{labels}}} 60.203000' in lines
+  assert f'{name}_count{{{labels}}} 3' in lines
+
+  assert f'benford_client_responses_total{{{labels},code="200"}} 1' in lines
+  assert f'benford_client_responses_total{{{labels},code="480"}} 1' in lines
+  assert f'benford_client_failures_total{{{labels}}} 1' in lines
+  assert f'benford_client_retries_total{{{labels}}} 1' in lines
+  assert f'benford_client_received_bytes_total{{{labels}}} 120' in lines
+
+  # every sample line is "name{labels} value"
+  for line in lines:
+    if not line.startswith("#"):
+      (sample, value) = line.rsplit(" ", 1)
+      assert sample.endswith("}")
+      float(value)
+
+
+def test_prometheus_escapes_labels():
+  metrics = clientmetrics.ClientMetrics()
+  metrics.observe("GET", 'https://x/prod/a"b/c\\d', 200, 0.01)
+
+  text = metrics.prometheus()
+
+  assert 'endpoint="/a\\"b/c\\\\d"' in text
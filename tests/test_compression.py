@@ -0,0 +1,68 @@
+#
+# test_compression.py
+#
+
+import sys
+
+import pytest
+
+import compression
+import lambda_function
+
+
+DATA = b"**RESULTS**\n12 pages\n" + b"1 301\n2 176\n3 125\n" * 200
+
+
+@pytest.mark.parametrize("encoding", ["gzip", "zstd"])
+def test_round_trip(encoding):
+  if encoding == "zstd":
+    pytest.importorskip("zstandard")
+
+  compressed = compression.compress(DATA, encoding)
+
+  assert len(compressed) < len(DATA)
+  assert compression.decompress(compressed, encoding) == DATA
+  assert compression.sniff_decompress(compressed) == DATA
+
+
+def test_sniff_leaves_plain_data_alone():
+  assert compression.sniff_decompress(DATA) == DATA
+  assert compression.sniff_decompress(b"") == b""
+  assert compression.compress(DATA, "none") == DATA
+
+
+def test_magic_numbers():
+  assert compression.compress(DATA, "gzip").startswith(compression.GZIP_MAGIC)
+  if compression._zstandard() is not None:
+    assert compression.compress(DATA, "zstd").startswith(compression.ZSTD_MAGIC)
+
+
+def test_without_zstandard(monkeypatch):
+  # a None entry in sys.modules makes the import fail
+  monkeypatch.setitem(sys.modules, "zstandard", None)
+
+  assert compression.available_encodings() == ["gzip"]
+  with pytest.raises(Exception, match="zstandard"):
+    compression.compress(DATA, "zstd")
+  with pytest.raises(Exception, match="zstandard"):
+    compression.sniff_decompress(compression.ZSTD_MAGIC + b"\x00" * 8)
+
+  assert compression.sniff_decompress(compression.compress(DATA, "gzip")) == DATA
+
+
+def test_results_compressed_from_min_bytes(s3, make_clients, tmp_path):
+  clients = make_clients({'s3': {'compress_results': 'gzip', 'compress_min_bytes': '1000'}})
+
+  small = tmp_path / "small.txt"
+  small.write_bytes(DATA[0:999])
+  large = tmp_path / "large.txt"
+  large.write_bytes(DATA[0:1000])
+
+  lambda_function.upload_results(clients, str(small), "test/small.txt")
+  lambda_function.upload_results(clients, str(large), "test/large.txt")
+
+  assert s3.objects["test/small.txt"]["Body"] == DATA[0:999]
+  assert "ContentEncoding" not in s3.objects["test/small.txt"]
+
+  assert s3.objects["test/large.txt"]["ContentEncoding"] == "gzip"
+  assert compression.sniff_decompress(s3.objects["test/large.txt"]["Body"]) == DATA[0:1000]
@@ -0,0 +1,98 @@
+#
+# test_jobclaim.py
+#
+
+import threading
+
+import lambda_function
+import loadtest
+
+from concurrent.futures import ThreadPoolExecutor
+from configparser import ConfigParser
+
+from conftest import add_job, job_status, s3_event
+
+
+def test_claims_are_off_by_default():
+  configur = ConfigParser()
+  configur.read_string(loadtest.DEFAULT_CONFIG.replace("[claim]\nenabled = true\n", ""))
+  assert not lambda_function.Clients(configur, s3=loadtest.LocalS3(), connect_db=loadtest.LocalDB().connect).claims.enabled
+
+
+def test_failed_record_is_retried_on_redelivery(db, s3, make_clients):
+  clients = make_clients({'status': {'write_behind': 'false'}})
+  assert clients.claims.enabled
+
+  key = "test/job1.pdf"
+  s3.put(key, b"%PDF-1.4\nnot really a PDF at all, but long enough\n")
+  add_job(db, 1, key)
+
+  response = lambda_function.lambda_handler(s3_event([key]), None)
+  assert response['statusCode'] == 500
+  assert job_status(db, key) == "error"
+
+  #
+  # the record is redelivered (and by then the problem is gone):
+  #
+  s3.put(key, loadtest.make_pdf(2, 20))
+
+  response = lambda_function.lambda_handler(s3_event([key]), None)
+  assert response['statusCode'] == 200
+  assert job_status(db, key) == "completed"
+  assert clients.claims.metrics()['reclaimed'] == 1
+
+
+def test_completed_job_is_not_claimed_again(db, s3, make_clients):
+  clients = make_clients({'status': {'write_behind': 'false'}})
+
+  key = "test/job1.pdf"
+  s3.put(key, loadtest.make_pdf(2, 20))
+  add_job(db, 1, key)
+
+  for delivery in range(3):
+    assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+
+  metrics = clients.claims.metrics()
+  assert (metrics['claimed'], metrics['reclaimed'], metrics['duplicates']) == (1, 0, 2)
+
+
+def test_concurrent_deliveries_process_a_job_once(db, s3, make_clients):
+  clients = make_clients()
+
+  keys = [f"test/job{jobid}.pdf" for jobid in range(1, 5)]
+  for (jobid, key) in enumerate(keys, start=1):
+    s3.put(key, loadtest.make_pdf(4, 50, seed=jobid))
+    add_job(db, jobid, key)
+
+  uploads = []
+  upload_file = s3.upload_file
+
+  def counting_upload(filename, bucketname, bucketkey, **kwargs):
+    uploads.append(bucketkey)
+    return upload_file(filename, bucketname, bucketkey, **kwargs)
+
+  s3.upload_file = counting_upload
+
+  #
+  # every event delivered 4 times, all at once:
+  #
+  deliveries = 4
+  start = threading.Barrier(len(keys) * deliveries)
+
+  def deliver(key):
+    start.wait()
+    return lambda_function.lambda_handler(s3_event([key]), None)
+
+  with ThreadPoolExecutor(max_workers=len(keys) * deliveries) as executor:
+    responses = list(executor.map(deliver, keys * deliveries))
+
+  assert all(response['statusCode'] == 200 for response in responses)
+  assert all(job_status(db, key) == "completed" for key in keys)
+
+  metrics = clients.claims.metrics()
+  assert metrics['claimed'] == len(keys)
+  assert metrics['duplicates'] == len(keys) * (deliveries - 1)
+  assert metrics['reclaimed'] == 0
+
+  results = [key[0:-4] + ".txt" for key in keys]
+  assert sorted(k for k in uploads if k in results) == sorted(results)
@@ -0,0 +1,65 @@
+#
+# test_jobsquery.py
+#
+
+import datetime
+
+import pytest
+
+import jobsquery
+
+from conftest import add_job
+
+
+def test_rejects_columns_not_in_the_whitelist():
+  for columns in ["jobid,password", "jobid;DROP TABLE jobs", "*", "status FROM users --"]:
+    with pytest.raises(ValueError, match="columns"):
+      jobsquery.parse_filters({'columns': columns})
+
+
+def test_projection_keeps_the_order_asked():
+  (_, columns) = jobsquery.parse_filters({'columns': "status, jobid"})
+  assert columns == ["status", "jobid"]
+
+  (_, columns) = jobsquery.parse_filters({})
+  assert columns == jobsquery.DEFAULT_COLUMNS
+
+
+def test_rejects_malformed_values():
+  for params in [{'userid': "80001 OR 1=1"}, {'limit': "0"}, {'limit': "-5"},
+                 {'since': "yesterday"}, {'until': "2024-13-01"}]:
+    with pytest.raises(ValueError):
+      jobsquery.parse_filters(params)
+
+
+def test_since_and_until():
+  (filters, _) = jobsquery.parse_filters({'since': "2024-05-01", 'until': "2024-05-01T12:30"})
+
+  assert filters['since'] == datetime.datetime(2024, 5, 1)
+  assert filters['until'] == datetime.datetime(2024, 5, 1, 12, 30)
+
+  (sql, parameters) = jobsquery.build_query(filters, ["jobid"])
+  assert "created >= %s AND created < %s" in sql
+  assert "ORDER BY created DESC" in sql
+  assert parameters == [filters['since'], filters['until']]
+
+
+def test_prefix_status_escapes_like_wildcards():
+  (filters, _) = jobsquery.parse_filters({'status': "error, processing*, 100%_done*"})
+  (sql, parameters) = jobsquery.build_query(filters, ["jobid"])
+
+  assert "(status = %s OR status LIKE %s OR status LIKE %s)" in sql
+  assert parameters == ["error", "processing%", "100\\%\\_done%"]
+
+
+def test_filters_against_the_database(db):
+  add_job(db, 1, "a.pdf", userid=80001, status="completed")
+  add_job(db, 2, "b.pdf", userid=80001, status="processing - page 1 of 3 completed")
+  add_job(db, 3, "c.pdf", userid=80002, status="processing - page 2 of 3 completed")
+  add_job(db, 4, "d.pdf", userid=80001, status="error")
+
+  (filters, columns) = jobsquery.parse_filters({'userid': "80001", 'status': "processing*,error",
+                                                'columns': "jobid,status"})
+  rows = jobsquery.get_jobs(db.connect(), filters, columns)
+
+  assert rows == [[2, "processing - page 1 of 3 completed"], [4, "error"]]
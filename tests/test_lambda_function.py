@@ -0,0 +1,237 @@
+#
+# test_lambda_function.py
+#
+
+import base64
+import hashlib
+import json
+import threading
+
+import pytest
+
+import lambda_function
+import loadtest
+import longpoll
+import resultsbatch
+
+from conftest import add_job, job_status, s3_event
+
+
+def test_warm_invocations_reuse_db_connections(db, s3, make_clients):
+  opened = []
+  lock = threading.Lock()
+
+  def connect():
+    with lock:
+      opened.append(threading.current_thread().name)
+    return db.connect()
+
+  clients = make_clients({'lambda': {'max_workers': '3'}, 'status': {'write_behind': 'false'}}, connect)
+
+  for invocation in range(4):
+    keys = []
+    for j in range(6):
+      jobid = 10 * invocation + j + 1
+      key = f"test/job{jobid}.pdf"
+      s3.put(key, loadtest.make_pdf(2, 20, seed=jobid))
+      add_job(db, jobid, key)
+      keys.append(key)
+
+    response = lambda_function.lambda_handler(s3_event(keys), None)
+
+    assert response['statusCode'] == 200
+    assert all(job_status(db, key) == "completed" for key in keys)
+
+  # the handler's thread and the executor's, whatever the number
+  # of invocations:
+  assert len(opened) <= clients.max_workers + 1
+
+
+def test_warm_invocations_reuse_db_connections_when_scheduled(db, s3, make_clients):
+  opened = []
+
+  def connect():
+    opened.append(threading.current_thread().name)
+    return db.connect()
+
+  clients = make_clients({'lambda': {'max_workers': '2'}, 'scheduler': {'enabled': 'true'},
+                          'status': {'write_behind': 'false'}}, connect)
+
+  for invocation in range(3):
+    keys = []
+    for j in range(4):
+      jobid = 10 * invocation + j + 1
+      key = f"test/user{j % 2}/job{jobid}.pdf"
+      s3.put(key, loadtest.make_pdf(2, 20, seed=jobid))
+      add_job(db, jobid, key, userid=80000 + j % 2)
+      keys.append(key)
+
+    assert lambda_function.lambda_handler(s3_event(keys), None)['statusCode'] == 200
+
+  assert len(opened) <= clients.max_workers + 1
+
+
+SAMPLING = {'sampling': {'min_pages': '20', 'min_sample': '6', 'fraction': '0.25', 'strata': '3', 'bootstrap': '10'},
+            'status': {'write_behind': 'false'}}
+
+
+def test_exact_pass_keeps_provisional_marker(db, s3, make_clients):
+  clients = make_clients(SAMPLING)
+
+  statuses = []
+  progress = clients.status.progress
+  clients.status.progress = lambda key, status: (statuses.append(status), progress(key, status))
+
+  key = "test/huge.pdf"
+  s3.put(key, loadtest.make_pdf(24, 20, seed=7))
+  add_job(db, 1, key)
+
+  assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+
+  sampled = [i for (i, status) in enumerate(statuses) if status.startswith("processing - sampled")]
+  exact = statuses[sampled[-1] + 1:]
+
+  assert len(exact) > 0
+  assert all(status.startswith("provisional - page") for status in exact)
+  assert job_status(db, key) == "completed"
+
+
+def test_provisional_only_job_is_final(db, s3, make_clients):
+  make_clients({**SAMPLING, 'sampling': {**SAMPLING['sampling'], 'continue': 'false'}, 'claim': {'enabled': 'true'}})
+
+  key = "test/huge.pdf"
+  s3.put(key, loadtest.make_pdf(24, 20, seed=7))
+  add_job(db, 1, key)
+
+  assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+  assert job_status(db, key) == "provisional"
+
+  (code, body) = longpoll.results_response(db.connect(), lambda_function.get_clients().storage, 1)
+  assert code == 483
+  assert b"PROVISIONAL" in base64.b64decode(body["data"]).upper()
+
+  # even once its lease has run out, no other delivery takes it over:
+  db.query("UPDATE jobs SET leaseexpires = '2000-01-01 00:00:00'")
+  assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+  assert lambda_function.get_clients().claims.metrics()['reclaimed'] == 0
+
+
+def test_results_return_the_estimate_during_the_exact_pass(db, s3, make_clients):
+  clients = make_clients()
+
+  s3.put("test/huge.txt", b"estimate")
+  add_job(db, 1, "test/huge.pdf", status="provisional - page 7 of 24 completed")
+  db.query("UPDATE jobs SET resultsfilekey = 'test/huge.txt'")
+
+  (code, body) = longpoll.results_response(db.connect(), clients.storage, 1)
+
+  assert code == 483
+  assert body["status"] == "provisional - page 7 of 24 completed"
+  assert base64.b64decode(body["data"]) == b"estimate"
+
+  lines = [json.loads(line) for line in resultsbatch.batch_results(db.connect(), clients.storage, [1]).splitlines()]
+  assert lines[0]["status"] == 483
+  assert base64.b64decode(lines[0]["data"]) == b"estimate"
+
+
+def test_jobs_complete_before_the_datafilehash_migration(db, s3, make_clients):
+  db.query("DROP INDEX jobs_userid_datafilehash")
+  db.query("ALTER TABLE jobs DROP COLUMN datafilehash")
+
+  make_clients({'status': {'write_behind': 'false'}})
+
+  keys = []
+  for jobid in range(1, 3):
+    key = f"test/job{jobid}.pdf"
+    s3.put(key, loadtest.make_pdf(2, 20, seed=jobid))
+    add_job(db, jobid, key)
+    keys.append(key)
+
+  assert lambda_function.lambda_handler(s3_event(keys), None)['statusCode'] == 200
+  assert all(job_status(db, key) == "completed" for key in keys)
+
+
+def test_completed_jobs_store_their_hash(db, s3, make_clients):
+  make_clients({'status': {'write_behind': 'false'}})
+
+  key = "test/job1.pdf"
+  pdf = loadtest.make_pdf(2, 20)
+  s3.put(key, pdf)
+  add_job(db, 1, key)
+
+  assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+  assert db.query("SELECT datafilehash FROM jobs")[0][0] == hashlib.sha256(pdf).hexdigest()
+
+
+def test_outputs_do_not_trigger_processing(db, s3, make_clients):
+  for enabled in ['true', 'false']:
+    make_clients({'claim': {'enabled': enabled}})
+    s3.objects.clear()
+    db.query("DELETE FROM jobs")
+
+    s3.put("test/report.pdf", loadtest.make_pdf(2, 20, seed=1))
+    add_job(db, 1, "test/report.pdf")
+    s3.put("test/ledger.csv", b"amount\n100\n200\n")
+    add_job(db, 2, "test/ledger.csv")
+
+    response = lambda_function.lambda_handler(s3_event(["test/report.pdf", "test/ledger.csv"]), None)
+    assert response['statusCode'] == 200
+    assert "test/report.txt" in s3.objects
+    assert "test/ledger.csv.results.txt" in s3.objects
+
+    #
+    # the results files fire the trigger in turn:
+    #
+    written = set(s3.objects)
+    response = lambda_function.lambda_handler(s3_event(["test/report.txt", "test/ledger.csv.results.txt"]), None)
+
+    assert response['statusCode'] == 200
+    assert set(s3.objects) == written
+    assert job_status(db, "test/report.pdf") == "completed"
+    assert job_status(db, "test/ledger.csv") == "completed"
+
+
+def test_malformed_queue_message_fails_alone(db, s3, make_clients):
+  make_clients()
+
+  key = "test/job1.pdf"
+  s3.put(key, loadtest.make_pdf(2, 20))
+  add_job(db, 1, key)
+
+  event = {'Records': [
+    {'eventSource': 'aws:sqs', 'messageId': 'm1', 'body': json.dumps(s3_event([key]))},
+    {'eventSource': 'aws:sqs', 'messageId': 'm2', 'body': "not json"},
+    {'eventSource': 'aws:sqs', 'messageId': 'm3', 'body': json.dumps({'Records': [{'s3': {}}]})},
+  ]}
+
+  response = lambda_function.lambda_handler(event, None)
+
+  assert response['statusCode'] == 500
+  assert response['batchItemFailures'] == [{'itemIdentifier': 'm2'}, {'itemIdentifier': 'm3'}]
+  assert job_status(db, key) == "completed"
+
+
+def test_column_check_caches_only_unknown_columns(db, s3, make_clients, monkeypatch):
+  clients = make_clients()
+
+  retrieve_all_rows = lambda_function.datatier.retrieve_all_rows
+  failures = []
+
+  def flaky(dbConn, sql, parameters=[]):
+    if len(failures) > 0:
+      raise failures.pop()
+    return retrieve_all_rows(dbConn, sql, parameters)
+
+  monkeypatch.setattr(lambda_function.datatier, "retrieve_all_rows", flaky)
+
+  #
+  # a lost connection is not a missing column:
+  #
+  failures.append(Exception(2013, "Lost connection to MySQL server during query"))
+  with pytest.raises(Exception):
+    clients.jobs_has_column('datafilehash')
+  assert clients.jobs_has_column('datafilehash')
+
+  failures.append(Exception(1054, "Unknown column 'nosuch' in 'field list'"))
+  assert not clients.jobs_has_column('nosuch')
+  assert not clients.jobs_has_column('nosuch')
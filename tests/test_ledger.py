@@ -0,0 +1,27 @@
+#
+# test_ledger.py
+#
+
+import io
+
+import ledger
+
+
+def test_header_row_is_not_tallied():
+  data = b"invoice,amount\n1001,250.00\n1002,31.50\n"
+
+  (rows, digit_count, _) = ledger.analyze_ledger(io.BytesIO(data), ".csv")
+
+  assert rows == 2
+  assert digit_count['1'] == 2
+  assert digit_count['2'] == 1
+  assert digit_count['3'] == 1
+
+
+def test_first_row_with_numbers_is_data():
+  data = b"1001,250.00\n1002,31.50\n"
+
+  (rows, digit_count, _) = ledger.analyze_ledger(io.BytesIO(data), ".csv")
+
+  assert rows == 2
+  assert sum(digit_count.values()) == 4
@@ -0,0 +1,54 @@
+#
+# test_longpoll.py
+#
+
+import longpoll
+
+
+class FakeClock:
+
+  def __init__(self):
+    self.now = 0.0
+    self.sleeps = []
+
+  def monotonic(self):
+    return self.now
+
+  def sleep(self, secs):
+    self.sleeps.append(secs)
+    self.now += secs
+
+
+def test_wait_backs_off_to_max_interval(monkeypatch):
+  clock = FakeClock()
+  monkeypatch.setattr(longpoll.time, "monotonic", clock.monotonic)
+  monkeypatch.setattr(longpoll.time, "sleep", clock.sleep)
+
+  reads = []
+
+  def read_status():
+    reads.append(clock.now)
+    return "processing - page 1 of 40 completed"
+
+  status = longpoll.wait_for_change(read_status, "processing - page 1 of 40 completed", 25.0,
+                                    interval_secs=0.25, max_interval_secs=2.0)
+
+  assert status == "processing - page 1 of 40 completed"
+  assert clock.sleeps[:4] == [0.25, 0.5, 1.0, 2.0]
+  assert max(clock.sleeps) == 2.0
+  # 25 s at a fixed 0.25 s would be 101 reads:
+  assert len(reads) < 20
+
+
+def test_wait_returns_on_completion(monkeypatch):
+  clock = FakeClock()
+  monkeypatch.setattr(longpoll.time, "monotonic", clock.monotonic)
+  monkeypatch.setattr(longpoll.time, "sleep", clock.sleep)
+
+  def read_status():
+    return "completed" if clock.now >= 3.0 else "processing - page 1 of 40 completed"
+
+  status = longpoll.wait_for_change(read_status, "processing - page 1 of 40 completed", 25.0)
+
+  assert status == "completed"
+  assert clock.now < 3.0 + 2.0
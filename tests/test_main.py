@@ -0,0 +1,143 @@
+#
+# test_main.py
+#
+
+import base64
+import http.server
+import json
+import threading
+import time
+import urllib.parse
+
+import pytest
+
+import clientmetrics
+import main
+
+
+class GatewayHandler(http.server.BaseHTTPRequestHandler):
+  """
+  Like API Gateway without the batch route: GET /results?jobids=...
+  gets 403 (Missing Authentication Token), GET /results/{jobid}
+  the job's results.
+  """
+
+  def do_GET(self):
+    url = urllib.parse.urlsplit(self.path)
+    self.server.paths.append(self.path)
+
+    if url.path == "/results":
+      (code, body) = (403, {"message": "Missing Authentication Token"})
+    else:
+      jobid = url.path.split("/")[-1]
+      (code, body) = (200, {"data": base64.b64encode(f"results of {jobid}\n".encode()).decode()})
+
+    data = json.dumps(body).encode()
+    self.send_response(code)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture
+def gateway():
+  server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), GatewayHandler)
+  server.paths = []
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+
+  yield server
+
+  server.shutdown()
+  server.server_close()
+
+
+def baseurl_of(server):
+  return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def test_403_is_not_retried(gateway):
+  res = main.web_service_get(baseurl_of(gateway) + "/results?jobids=1001")
+
+  assert res.status_code == 403
+  assert len(gateway.paths) == 1
+
+
+def test_download_batch_falls_back_at_once(gateway, tmp_path, monkeypatch):
+  answers = iter(["1001,1002", str(tmp_path)])
+  monkeypatch.setattr("builtins.input", lambda *args: next(answers))
+
+  main.download_batch(baseurl_of(gateway))
+
+  assert [p for p in gateway.paths if p.startswith("/results?")] == ["/results?jobids=1001%2C1002"]
+  assert (tmp_path / "1001.txt").read_text() == "results of 1001\n"
+  assert (tmp_path / "1002.txt").read_text() == "results of 1002\n"
+
+
+def test_batch_and_stats_routes():
+  assert clientmetrics.endpoint_of("https://x/prod/results?jobids=1001,1002") == "/results"
+  assert clientmetrics.endpoint_of("https://x/prod/results/1001") == "/results/{jobid}"
+  assert clientmetrics.endpoint_of("https://x/prod/results/1001?wait=20&since=uploaded") == \
+         "/results/{jobid} (long poll)"
+  assert clientmetrics.endpoint_of("https://x/prod/stats?where=d1<0.25") == "/stats"
+
+
+class NoWaitHandler(http.server.BaseHTTPRequestHandler):
+  """
+  A server that ignores ?wait=...: every poll of GET /results/{jobid}
+  answers at once with new progress, until the job is done.
+  """
+
+  def do_POST(self):
+    self.rfile.read(int(self.headers["Content-Length"]))
+    self.reply(200, 1001)
+
+  def do_GET(self):
+    self.server.poll_times.append(time.time())
+    polls = len(self.server.poll_times)
+    if polls < 5:
+      self.reply(481, f"processing - page {polls}")
+    else:
+      self.reply(200, {"data": base64.b64encode(b"results\n").decode()})
+
+  def reply(self, code, body):
+    data = json.dumps(body).encode()
+    self.send_response(code)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def test_long_poll_keeps_a_minimum_interval(tmp_path, monkeypatch):
+  server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), NoWaitHandler)
+  server.poll_times = []
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+
+  pdf = tmp_path / "test.pdf"
+  pdf.write_bytes(b"%PDF-1.4\n%%EOF\n")
+  answers = iter([str(pdf), "80001"])
+  monkeypatch.setattr("builtins.input", lambda *args: next(answers))
+  monkeypatch.setattr(main, "LONG_POLL_MIN_SECS", 0.2)
+
+  try:
+    main.upload_and_poll(baseurl_of(server), dedupe=False, long_poll_secs=20)
+  finally:
+    server.shutdown()
+    server.server_close()
+
+  times = server.poll_times
+  assert len(times) == 5
+  # the status changed every time, so no fallback to random sleeps,
+  # but the polls were not sent back to back either (the server sees
+  # the first one late, after the connection is set up)
+  gaps = [b - a for (a, b) in zip(times, times[1:])]
+  assert all(0.1 < gap < 1.0 for gap in gaps), gaps
+  assert times[-1] - times[0] > 0.7
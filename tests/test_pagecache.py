@@ -0,0 +1,130 @@
+#
+# test_pagecache.py
+#
+
+import io
+
+import benford
+import lambda_function
+import loadtest
+import pagecache
+
+from pypdf import PdfReader
+
+from conftest import add_job, job_status, s3_event
+
+
+def make_pdf(widths="278 278"):
+  """
+  Returns a one-page PDF whose font has an indirect /Encoding,
+  /Widths and /FontDescriptor.
+  """
+  content = b"BT /F1 9 Tf 40 760 Td (1234 5678 910) Tj ET"
+  objects = [
+    b"<< /Type /Catalog /Pages 2 0 R >>",
+    b"<< /Type /Pages /Kids [4 0 R] /Count 1 >>",
+    b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding 6 0 R"
+    b" /FirstChar 32 /LastChar 33 /Widths 7 0 R /FontDescriptor 8 0 R >>",
+    b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents 5 0 R >>",
+    b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream",
+    b"/WinAnsiEncoding",
+    f"[{widths}]".encode(),
+    b"<< /Type /FontDescriptor /FontName /Helvetica /Flags 32 /Parent 3 0 R >>",
+  ]
+
+  out = io.BytesIO()
+  out.write(b"%PDF-1.4\n")
+  offsets = []
+  for (i, obj) in enumerate(objects):
+    offsets.append(out.tell())
+    out.write(f"{i + 1} 0 obj\n".encode() + obj + b"\nendobj\n")
+
+  startxref = out.tell()
+  out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+  for offset in offsets:
+    out.write(f"{offset:010} 00000 n \n".encode())
+  out.write(f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{startxref}\n%%EOF\n".encode())
+
+  return out.getvalue()
+
+
+def test_digest_is_the_same_from_a_fresh_reader():
+  data = make_pdf()
+
+  first = PdfReader(io.BytesIO(data))
+  second = PdfReader(io.BytesIO(data))
+
+  assert pagecache.page_digest(first.pages[0]) == pagecache.page_digest(second.pages[0])
+
+
+def test_digest_covers_widths():
+  before = pagecache.page_digest(PdfReader(io.BytesIO(make_pdf("278 278"))).pages[0])
+  after = pagecache.page_digest(PdfReader(io.BytesIO(make_pdf("278 556"))).pages[0])
+
+  assert before != after
+
+
+class CountingStore:
+
+  def __init__(self):
+    self.fetches = []
+    self.rows = {}
+
+  def fetch(self, digests):
+    self.fetches.append(len(digests))
+    return {d: self.rows[d] for d in digests if d in self.rows}
+
+  def save(self, entries):
+    self.rows.update(entries)
+
+
+def test_pages_are_digested_on_first_use(monkeypatch):
+  digested = []
+  page_digest = pagecache.page_digest
+  monkeypatch.setattr(pagecache, "page_digest", lambda page: (digested.append(page), page_digest(page))[1])
+
+  reader = PdfReader(io.BytesIO(loadtest.make_pdf(30, 10)))
+  store = CountingStore()
+  job = pagecache.PageCache(store=store).begin_job(reader.pages, skip={1}, batch_pages=8)
+
+  assert digested == []
+
+  job.prefetch([3, 20])
+  assert len(digested) == 2
+  assert store.fetches == [2]
+
+  #
+  # a page not prefetched brings the next ones along, but not the
+  # skipped or already digested ones:
+  #
+  assert job.get(0) is None
+  assert len(digested) == 2 + 6
+  assert store.fetches == [2, 6]
+  assert job.get(5) is None
+  assert len(digested) == 8
+
+
+def test_digest_is_salted_with_the_tally_version(monkeypatch):
+  page = PdfReader(io.BytesIO(make_pdf())).pages[0]
+  before = pagecache.page_digest(page)
+
+  monkeypatch.setattr(benford, "TALLY_VERSION", "tally-test")
+
+  assert pagecache.page_digest(page) != before
+
+
+def test_sampled_document_digests_only_its_sample(db, s3, make_clients, monkeypatch):
+  make_clients({'sampling': {'min_pages': '20', 'min_sample': '6', 'fraction': '0.1', 'strata': '3',
+                             'bootstrap': '10', 'continue': 'false'}})
+
+  digested = []
+  page_digest = pagecache.page_digest
+  monkeypatch.setattr(pagecache, "page_digest", lambda page: (digested.append(page), page_digest(page))[1])
+
+  key = "test/huge.pdf"
+  s3.put(key, loadtest.make_pdf(200, 5, seed=3))
+  add_job(db, 1, key)
+
+  assert lambda_function.lambda_handler(s3_event([key]), None)['statusCode'] == 200
+  assert job_status(db, key) == "provisional"
+  assert 0 < len(digested) < 30
@@ -0,0 +1,58 @@
+#
+# test_pagematrix.py
+#
+
+import random
+import sys
+
+import pytest
+
+import compression
+import pagematrix
+
+
+def random_matrix(number_of_pages, seed=0):
+  rng = random.Random(seed)
+  matrix = pagematrix.PageMatrix(number_of_pages)
+  for i in range(number_of_pages):
+    # some pages without numbers at all:
+    if i % 7 == 3:
+      continue
+    matrix.set_row(i, {str(d): rng.randrange(0, 500) for d in range(10)})
+  return matrix
+
+
+def test_round_trip():
+  matrix = random_matrix(25)
+
+  raw = matrix.to_bytes()
+  again = pagematrix.PageMatrix.from_bytes(raw)
+
+  assert again.number_of_pages == 25
+  assert [again.row(i) for i in range(25)] == [matrix.row(i) for i in range(25)]
+  assert again.totals() == matrix.totals()
+
+  # stored compressed, read the same:
+  again = pagematrix.PageMatrix.from_bytes(compression.compress(raw, "gzip"))
+  assert again.data == matrix.data
+
+
+def test_rejects_other_files():
+  with pytest.raises(ValueError):
+    pagematrix.PageMatrix.from_bytes(b"**RESULTS**\n3 pages\n" + bytes(20))
+
+
+def test_numpy_and_fallback_scores_agree(monkeypatch):
+  pytest.importorskip("numpy")
+  matrix = random_matrix(40, seed=3)
+
+  with_numpy = pagematrix.deviation_scores(matrix)
+
+  # a None entry in sys.modules makes the import fail
+  monkeypatch.setitem(sys.modules, "numpy", None)
+  without_numpy = pagematrix.deviation_scores(matrix)
+
+  assert len(with_numpy) == len(without_numpy) == 40
+  assert with_numpy == pytest.approx(without_numpy, rel=1e-9)
+  assert without_numpy[3] == 0.0
+  assert pagematrix.top_pages(matrix, 5)[0][2] == pytest.approx(max(with_numpy))
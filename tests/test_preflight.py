@@ -0,0 +1,55 @@
+#
+# test_preflight.py
+#
+
+import os
+import pytest
+
+import loadtest
+import preflight
+import storage
+
+from configparser import ConfigParser
+
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def limits():
+  return preflight.PreflightLimits(ConfigParser())
+
+
+def test_rejects_malformed_xref(limits):
+  # its xref says "0 27" but lists 28 entries:
+  with pytest.raises(preflight.PreflightError, match="cross-reference"):
+    preflight.preflight_pdf(storage.FilesystemStorage(REPO), "malformed.pdf", limits)
+
+
+def test_accepts_incremental_update(limits):
+  result = preflight.preflight_pdf(storage.FilesystemStorage(REPO), "update09.pdf", limits)
+  assert result.route == "standard"
+
+
+def test_accepts_generated_pdf(tmp_path, limits):
+  (tmp_path / "ok.pdf").write_bytes(loadtest.make_pdf(60, 10))
+  result = preflight.preflight_pdf(storage.FilesystemStorage(str(tmp_path)), "ok.pdf", limits)
+  assert result.est_pages == 60
+
+
+def test_rejects_short_subsection():
+  xref = b"xref\n0 3\n0000000000 65535 f \n0000000010 00000 n \ntrailer\n<< /Size 3 >>\n"
+  with pytest.raises(preflight.PreflightError, match="has 2 entries"):
+    preflight.check_xref_table(xref)
+
+
+def test_accepts_table_cut_off_by_the_read():
+  xref = b"xref\n0 300\n0000000000 65535 f \n" + b"0000000010 00000 n \n" * 40 + b"00000"
+  preflight.check_xref_table(xref)
+
+
+def test_accepts_several_subsections():
+  xref = (b"xref\n0 1\n0000000000 65535 f \n"
+          b"3 2\n0000000100 00000 n \n0000000200 00000 n \n"
+          b"trailer\n<< /Size 5 >>\n")
+  preflight.check_xref_table(xref)
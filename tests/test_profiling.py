@@ -0,0 +1,99 @@
+#
+# test_profiling.py
+#
+
+import cProfile
+import threading
+import time
+import tracemalloc
+
+import lambda_function
+import loadtest
+import profiling
+
+from conftest import add_job, job_status, s3_event
+
+
+class ExclusiveProfile(cProfile.Profile):
+  """
+  cProfile.Profile as of Python 3.12: enable() raises ValueError
+  while another profiler is active.
+  """
+  _active = None
+  _lock = threading.Lock()
+
+  def enable(self, *args, **kwargs):
+    with ExclusiveProfile._lock:
+      if ExclusiveProfile._active is not None and ExclusiveProfile._active is not self:
+        raise ValueError("Another profiling tool is already active")
+      ExclusiveProfile._active = self
+    super().enable(*args, **kwargs)
+
+  def disable(self):
+    super().disable()
+    with ExclusiveProfile._lock:
+      ExclusiveProfile._active = None
+
+
+def test_concurrent_profilers_run_one_at_a_time(monkeypatch):
+  monkeypatch.setattr(profiling.cProfile, "Profile", ExclusiveProfile)
+
+  spans = []
+
+  def work():
+    with profiling.JobProfiler() as profiler:
+      start = time.perf_counter()
+      time.sleep(0.02)
+      spans.append((start, time.perf_counter(), profiler.started))
+
+  threads = [threading.Thread(target=work) for _ in range(4)]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  spans.sort()
+  assert all(started for (_, _, started) in spans)
+  assert all(spans[i][1] <= spans[i + 1][0] for i in range(len(spans) - 1))
+  assert not tracemalloc.is_tracing()
+
+
+def test_profiler_that_cannot_start_runs_unprofiled(monkeypatch):
+  other = cProfile.Profile()
+  monkeypatch.setattr(profiling.cProfile, "Profile", ExclusiveProfile)
+  monkeypatch.setattr(ExclusiveProfile, "_active", other)
+
+  ran = []
+  with profiling.JobProfiler() as profiler:
+    ran.append(True)
+
+  assert ran == [True]
+  assert not profiler.started
+  assert not tracemalloc.is_tracing()
+
+  # the lock was released:
+  monkeypatch.setattr(ExclusiveProfile, "_active", None)
+  with profiling.JobProfiler() as profiler:
+    pass
+  assert profiler.started
+
+
+def test_profiled_batch(db, s3, make_clients, monkeypatch):
+  monkeypatch.setattr(profiling.cProfile, "Profile", ExclusiveProfile)
+  make_clients({'lambda': {'max_workers': '3'}, 'status': {'write_behind': 'false'}})
+
+  keys = []
+  for jobid in range(1, 7):
+    key = f"test/job{jobid}.pdf"
+    s3.put(key, loadtest.make_pdf(2, 20, seed=jobid))
+    add_job(db, jobid, key)
+    keys.append(key)
+
+  event = s3_event(keys)
+  event['profile'] = True
+
+  assert lambda_function.lambda_handler(event, None)['statusCode'] == 200
+
+  assert all(job_status(db, key) == "completed" for key in keys)
+  assert all(key[0:-4] + ".profile.txt" in s3.objects for key in keys)
+  assert not tracemalloc.is_tracing()
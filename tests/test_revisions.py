@@ -0,0 +1,130 @@
+#
+# test_revisions.py
+#
+
+import hashlib
+import io
+import re
+
+import datatier
+import lambda_function
+import loadtest
+import revisions
+
+from pypdf import PdfReader
+
+from conftest import add_job, job_status, s3_event
+
+
+#
+# objects of loadtest.make_pdf: the font is 3, shared by every page,
+# and page p is object 4 + 2p with its content stream 5 + 2p
+#
+FONT = 3
+
+
+def content_of(p):
+  return 5 + 2 * p
+
+
+def incremental_update(data, objects):
+  """
+  Returns data followed by an update section (re)defining objects,
+  a dict of object number -> bytes, as a PDF editor saving
+  incrementally writes it.
+  """
+  prev = int(re.findall(rb"startxref\s+(\d+)", data)[-1])
+  size = int(re.findall(rb"/Size (\d+)", data)[-1])
+
+  out = io.BytesIO()
+  out.write(data)
+  offsets = {}
+  for (idnum, obj) in sorted(objects.items()):
+    offsets[idnum] = out.tell()
+    out.write(f"{idnum} 0 obj\n".encode() + obj + b"\nendobj\n")
+
+  startxref = out.tell()
+  out.write(b"xref\n")
+  for (idnum, offset) in offsets.items():
+    out.write(f"{idnum} 1\n{offset:010} 00000 n \n".encode())
+  out.write(f"trailer\n<< /Size {max([size] + [i + 1 for i in offsets])} /Root 1 0 R /Prev {prev} >>\n"
+            f"startxref\n{startxref}\n%%EOF\n".encode())
+
+  return out.getvalue()
+
+
+def stream(content):
+  return b"<< /Length " + str(len(content)).encode() + b" >>\nstream\n" + content + b"\nendstream"
+
+
+def readers(base, revised):
+  return (PdfReader(io.BytesIO(revised)), PdfReader(io.BytesIO(base)))
+
+
+def test_prefix_hashes_find_the_earlier_version(tmp_path):
+  base = loadtest.make_pdf(3, 20)
+  path = tmp_path / "revised.pdf"
+  path.write_bytes(incremental_update(base, {content_of(1): stream(b"BT /F1 9 Tf 40 760 Td (777) Tj ET")}))
+
+  hashes = revisions.prefix_hashes(str(path))
+
+  # up to the first %%EOF, with and without its end of line:
+  assert hashes == {hashlib.sha256(base).hexdigest(): len(base),
+                    hashlib.sha256(base[:-1]).hexdigest(): len(base) - 1}
+
+
+def test_changed_page_is_extracted_again():
+  base = loadtest.make_pdf(3, 20)
+  revised = incremental_update(base, {content_of(1): stream(b"BT /F1 9 Tf 40 760 Td (777) Tj ET")})
+
+  (reader, base_reader) = readers(base, revised)
+
+  assert revisions.updated_objects(reader, len(base)) == {content_of(1)}
+  assert revisions.unchanged_pages(reader, base_reader, len(base)) == {0: 0, 2: 2}
+
+
+def test_redefined_shared_font_changes_every_page():
+  base = loadtest.make_pdf(3, 20)
+  revised = incremental_update(base, {FONT: b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier >>"})
+
+  (reader, base_reader) = readers(base, revised)
+
+  assert revisions.updated_objects(reader, len(base)) == {FONT}
+  assert revisions.unchanged_pages(reader, base_reader, len(base)) == {}
+
+
+def test_single_version_skips_the_lookup(db, tmp_path, monkeypatch):
+  path = tmp_path / "plain.pdf"
+  path.write_bytes(loadtest.make_pdf(3, 20))
+
+  queries = []
+  monkeypatch.setattr(datatier, "retrieve_all_rows", lambda *args: queries.append(args) or [])
+
+  hashes = revisions.prefix_hashes(str(path))
+
+  assert hashes == {}
+  assert revisions.find_base_job(db.connect(), "test/plain.pdf", hashes) is None
+  assert queries == []
+
+
+def test_revision_reuses_the_earlier_job(db, s3, make_clients, capsys):
+  make_clients()
+
+  base = loadtest.make_pdf(3, 20)
+  revised = incremental_update(base, {content_of(1): stream(b"BT /F1 9 Tf 40 760 Td (777) Tj ET")})
+
+  s3.put("test/v1.pdf", base)
+  add_job(db, 1, "test/v1.pdf")
+  assert lambda_function.lambda_handler(s3_event(["test/v1.pdf"]), None)['statusCode'] == 200
+  capsys.readouterr()
+
+  s3.put("test/v2.pdf", revised)
+  add_job(db, 2, "test/v2.pdf")
+  assert lambda_function.lambda_handler(s3_event(["test/v2.pdf"]), None)['statusCode'] == 200
+  assert job_status(db, "test/v2.pdf") == "completed"
+
+  out = capsys.readouterr().out
+  assert "**REVISION of job 1 (3 pages): 2 of 3 pages unchanged**" in out
+  assert "** Page 1 , unchanged since job 1" in out
+  assert "** Page 2 , unchanged" not in out
+  assert "** Page 3 , unchanged since job 1" in out
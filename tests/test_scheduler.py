@@ -0,0 +1,94 @@
+#
+# test_scheduler.py
+#
+
+import threading
+import time
+
+import scheduler
+
+
+def dispatch_order(fair):
+  """
+  Dispatches every queued job one at a time, each finishing before
+  the next starts; returns the users in dispatch order.
+  """
+  fair.close()
+  order = []
+  while True:
+    job = fair.get()
+    if job is None:
+      return order
+    order.append(job[0])
+    fair.done(job[0])
+
+
+def test_bulk_upload_does_not_starve_other_users():
+  fair = scheduler.FairScheduler(max_running=1, per_user=1)
+
+  for i in range(20):
+    fair.submit(80000, f"bulk{i}")
+  fair.submit(80001, "a")
+  fair.submit(80002, "b")
+
+  order = dispatch_order(fair)
+
+  assert len(order) == 22
+  assert set(order[0:3]) == {80000, 80001, 80002}
+
+
+def test_weights_share_dispatches():
+  fair = scheduler.FairScheduler(max_running=1, per_user=1, weights={"80001": 2})
+
+  for i in range(30):
+    fair.submit(80001, i)
+    fair.submit(80002, i)
+
+  order = dispatch_order(fair)[0:30]
+
+  assert order.count(80001) == 20
+  assert order.count(80002) == 10
+
+
+def run_and_watch(fair, jobs):
+  """
+  Runs (userid, i) jobs; returns the results, and for every job
+  started (userid, jobs of that user running, jobs of other users
+  queued).
+  """
+  lock = threading.Lock()
+  running = {}
+  started = []
+
+  def process(item):
+    (userid, i) = item
+    others_queued = sum(u['queued'] for (other, u) in fair.metrics()['users'].items() if other != userid)
+    with lock:
+      running[userid] = running.get(userid, 0) + 1
+      started.append((userid, running[userid], others_queued))
+    time.sleep(0.005)
+    with lock:
+      running[userid] -= 1
+    return i
+
+  return (scheduler.run_jobs(fair, [(userid, (userid, i)) for (userid, i) in jobs], process), started)
+
+
+def test_run_jobs_keeps_the_per_user_cap_while_others_wait():
+  fair = scheduler.FairScheduler(max_running=4, per_user=2)
+
+  jobs = [(80000, i) for i in range(12)] + [(80001, i) for i in range(8)]
+  (results, started) = run_and_watch(fair, jobs)
+
+  assert results == [i for (_, i) in jobs]
+  assert all(n <= 2 for (_, n, others_queued) in started if others_queued > 0)
+  assert fair.metrics()['users'][80000]['dispatched'] == 12
+
+
+def test_single_user_batch_uses_every_worker():
+  fair = scheduler.FairScheduler(max_running=4, per_user=1)
+
+  (results, started) = run_and_watch(fair, [(80000, i) for i in range(12)])
+
+  assert results == list(range(12))
+  assert max(n for (_, n, _) in started) == 4
@@ -0,0 +1,86 @@
+#
+# test_statsquery.py
+#
+
+import json
+
+import pytest
+
+import benford
+import datatier
+import jobstats
+import statsquery
+
+from conftest import add_job
+
+
+#
+# first digits of a document that follows Benford's law, and of one
+# whose digits are uniform:
+#
+BENFORD = {d: round(1000 * p) for (d, p) in benford.EXPECTED.items()}
+UNIFORM = {d: 100 for d in benford.EXPECTED}
+
+
+def test_parse_conditions():
+  filters = statsquery.parse_filters({'where': "d1<25%, chisq>20", 'userid': "80001"})
+
+  assert filters['conditions'] == [("d1", "<", 0.25), ("chisq", ">", 20.0)]
+  assert filters['userid'] == 80001
+  assert filters['limit'] == statsquery.DEFAULT_LIMIT
+
+
+def test_rejects_malformed_conditions():
+  for where in ["d1<<0.25", "d0<0.25", "password=1", "chisq>20%", "d1<0.25; DROP TABLE jobs"]:
+    with pytest.raises(ValueError, match="where"):
+      statsquery.parse_filters({'where': where})
+
+
+def test_one_join_per_digit():
+  filters = statsquery.parse_filters({'where': "d1>0.2,d1<0.4,c1>10,d3<0.2,mad<0.01"})
+  (sql, parameters) = statsquery.build_query(filters)
+
+  assert sql.count("JOIN jobdigits") == 2
+  assert "g1.digit = 1" in sql and "g3.digit = 3" in sql
+  assert "g1.frequency > %s AND g1.frequency < %s AND g1.count > %s AND g3.frequency < %s AND s.mad < %s" in sql
+  assert parameters == [0.2, 0.4, 10.0, 0.2, 0.01, statsquery.DEFAULT_LIMIT]
+
+
+def test_stats_against_the_database(db):
+  dbConn = db.connect()
+  for (jobid, userid, digit_count) in [(1, 80001, BENFORD), (2, 80001, UNIFORM), (3, 80002, UNIFORM)]:
+    add_job(db, jobid, f"{jobid}.pdf", userid=userid, status="completed")
+    datatier.perform_actions(dbConn, jobstats.job_actions(jobid, 10, digit_count))
+
+  rows = statsquery.get_stats(dbConn, statsquery.parse_filters({'where': "d1<25%,chisq>20"}))
+
+  assert [row[0] for row in rows] == [2, 3]
+  assert rows[0][:5] == [2, 80001, "2.pdf", "pages", 10]
+  assert rows[0][8:] == pytest.approx([1 / 9] * 9)
+
+  rows = statsquery.get_stats(dbConn, statsquery.parse_filters({'where': "d1<25%", 'userid': "80002"}))
+  assert [row[0] for row in rows] == [3]
+
+  rows = statsquery.get_stats(dbConn, statsquery.parse_filters({'where': "d1>25%,chisq<20"}))
+  assert [row[0] for row in rows] == [1]
+
+
+def test_job_actions_ignore_duplicates(db):
+  dbConn = db.connect()
+  add_job(db, 1, "1.pdf", status="completed")
+
+  datatier.perform_actions(dbConn, jobstats.job_actions(1, 10, BENFORD))
+  datatier.perform_actions(dbConn, jobstats.job_actions(1, 20, UNIFORM))
+
+  assert db.query("SELECT numunits FROM jobstats") == [(10,)]
+  assert db.query("SELECT COUNT(*) FROM jobdigits WHERE jobid = 1") == [(9,)]
+  assert db.query("SELECT count FROM jobdigits WHERE jobid = 1 AND digit = 1") == [(BENFORD['1'],)]
+
+
+def test_malformed_condition_is_400():
+  event = {'queryStringParameters': {'where': "d1<abc"}}
+
+  response = statsquery.lambda_handler(event, None)
+
+  assert response['statusCode'] == 400
+  assert "d1<abc" in json.loads(response['body'])
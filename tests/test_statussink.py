@@ -0,0 +1,50 @@
+#
+# test_statussink.py
+#
+
+import time
+
+import lambda_function
+import loadtest
+import statussink
+
+from conftest import add_job, job_status, s3_event
+
+
+def test_memory_backend_writes_only_terminal_states_to_jobs(db, s3, make_clients, monkeypatch):
+  # (no claims, whose lease is written to the jobs row too)
+  clients = make_clients({'status': {'backend': 'memory'}, 'claim': {'enabled': 'false'}})
+  assert isinstance(clients.status, statussink.KVStatusSink)
+
+  key = "test/job1.pdf"
+  s3.put(key, loadtest.make_pdf(3, 20))
+  add_job(db, 1, key)
+
+  updates = []
+  execute = loadtest.LocalCursor.execute
+
+  def recording_execute(cursor, sql, parameters=[]):
+    if sql.lstrip().upper().startswith("UPDATE JOBS"):
+      updates.append(parameters[0])
+    return execute(cursor, sql, parameters)
+
+  monkeypatch.setattr(loadtest.LocalCursor, "execute", recording_execute)
+
+  response = lambda_function.lambda_handler(s3_event([key]), None)
+
+  assert response['statusCode'] == 200
+  assert job_status(db, key) == "completed"
+  assert updates == ["completed"]
+
+  fields = clients.status.get_status(key)
+  assert fields['status'] == "completed"
+  assert fields['resultsfilekey'] == "test/job1.txt"
+
+
+def test_memory_kv_expires_keys():
+  sink = statussink.KVStatusSink(statussink.InMemoryKV(), ttl_secs=0)
+
+  sink.progress("a.pdf", "processing - page 1 of 2 completed")
+  time.sleep(0.01)
+
+  assert sink.get_status("a.pdf") == {}
@@ -0,0 +1,78 @@
+#
+# test_storage.py
+#
+
+import os
+
+import pytest
+
+import storage
+
+
+@pytest.fixture
+def fs(tmp_path):
+  root = tmp_path / "root"
+  (root / "a").mkdir(parents=True)
+  (root / "a" / "doc.pdf").write_bytes(b"0123456789")
+  (tmp_path / "secret.txt").write_text("secret")
+  return storage.FilesystemStorage(str(root))
+
+
+def test_keys_cannot_leave_the_root(fs, tmp_path):
+  for key in ["../secret.txt", "a/../../secret.txt", str(tmp_path / "secret.txt"), "/etc/passwd"]:
+    with pytest.raises(Exception, match="outside"):
+      fs.read(key)
+    with pytest.raises(Exception, match="outside"):
+      fs.put_file(str(tmp_path / "secret.txt"), key)
+
+  assert fs.path("a/./doc.pdf") == os.path.join(fs.root, "a", "doc.pdf")
+
+
+def test_symlinks_cannot_leave_the_root(fs, tmp_path):
+  os.symlink(str(tmp_path), os.path.join(fs.root, "a", "up"))
+
+  with pytest.raises(Exception, match="outside"):
+    fs.read("a/up/secret.txt")
+
+
+def test_read_range(fs):
+  assert fs.size("a/doc.pdf") == 10
+  assert fs.read_range("a/doc.pdf", 0, 4) == b"0123"
+  assert fs.read_range("a/doc.pdf", 8, 100) == b"89"
+  assert fs.read_range("a/doc.pdf", 20, 4) == b""
+  assert fs.read_range("a/doc.pdf", -3, 3) == b"789"
+  # more than the whole file from the end:
+  assert fs.read_range("a/doc.pdf", -50, 50) == b"0123456789"
+
+
+def test_put_file_replaces_atomically(fs, tmp_path, monkeypatch):
+  local = tmp_path / "results.txt"
+  local.write_bytes(b"new results")
+  target = os.path.join(fs.root, "a", "doc.txt")
+  with open(target, "wb") as outfile:
+    outfile.write(b"old results")
+
+  seen = []
+  replace = os.replace
+
+  def checking_replace(src, dst):
+    # the new contents are complete before the target changes:
+    with open(dst, "rb") as infile:
+      seen.append(infile.read())
+    with open(src, "rb") as infile:
+      seen.append(infile.read())
+    return replace(src, dst)
+
+  monkeypatch.setattr(storage.os, "replace", checking_replace)
+  fs.put_file(str(local), "a/doc.txt")
+
+  assert seen == [b"old results", b"new results"]
+  assert fs.read("a/doc.txt")[0] == b"new results"
+  assert not any(name.endswith(".partial") for name in os.listdir(os.path.join(fs.root, "a")))
+
+
+def test_failed_put_file_leaves_no_partial_file(fs, tmp_path):
+  with pytest.raises(Exception):
+    fs.put_file(str(tmp_path / "missing.txt"), "b/doc.txt")
+
+  assert os.listdir(os.path.join(fs.root, "b")) == []
@@ -0,0 +1,72 @@
+#
+# test_stubserver.py
+#
+
+import base64
+import json
+
+import pytest
+import requests
+
+import benford
+import loadtest
+import stubserver
+
+
+@pytest.fixture
+def stub():
+  stub = stubserver.StubServer().start()
+  yield stub
+  stub.stop()
+
+
+def test_long_poll_returns_on_completion(stub):
+  jobid = stub.create_job(80001, "a.pdf", loadtest.make_pdf(5, 50, seed=1))
+
+  since = "uploaded"
+  seen = []
+  for poll in range(50):
+    res = requests.get(f"{stub.baseurl}/results/{jobid}", params={'wait': 2, 'since': since}, timeout=10)
+    seen.append(res.status_code)
+    if res.status_code == 200:
+      break
+    assert res.status_code in [480, 481]
+    since = res.json()
+
+  assert seen[-1] == 200
+  assert len(seen) < 50
+  (number_of_pages, digit_count) = benford.parse_results(base64.b64decode(res.json()["data"]).decode("utf-8"))
+  assert number_of_pages == 5
+  assert sum(digit_count.values()) > 0
+
+  #
+  # a completed job answers at once, whatever since says:
+  #
+  res = requests.get(f"{stub.baseurl}/results/{jobid}", params={'wait': 5, 'since': "completed"}, timeout=10)
+  assert res.status_code == 200
+  assert stub.requests["results"] == len(seen) + 1
+
+
+def test_batch_results(stub):
+  jobids = [stub.create_job(80001, f"{i}.pdf", loadtest.make_pdf(2, 20, seed=i)) for i in range(3)]
+  stub.wait()
+
+  res = requests.get(f"{stub.baseurl}/results", params={'jobids': ",".join(str(j) for j in jobids + [9999])},
+                     timeout=10)
+
+  assert res.status_code == 200
+  lines = [json.loads(line) for line in res.text.splitlines()]
+  assert [line["jobid"] for line in lines] == jobids + [9999]
+  assert [line["status"] for line in lines] == [200, 200, 200, 400]
+
+  for (line, jobid) in zip(lines, jobids):
+    (code, body) = stub.results(jobid)
+    assert (code, body["data"]) == (200, line["data"])
+
+  assert stub.requests["results batch"] == 1
+
+
+def test_batch_rejects_malformed_jobids(stub):
+  res = requests.get(f"{stub.baseurl}/results", params={'jobids': "1001,abc"}, timeout=10)
+
+  assert res.status_code == 400
@@ -0,0 +1,121 @@
+#
+# test_writebehind.py
+#
+
+import threading
+import time
+import pytest
+
+import statussink
+import writebehind
+
+from conftest import add_job, job_status
+
+
+def test_one_jobs_failed_write_does_not_fail_another(db):
+  add_job(db, 1, "a.pdf")
+  add_job(db, 2, "b.pdf")
+
+  #
+  # hold the writer on its first batch, so that the writes of both
+  # jobs end up in the next one:
+  #
+  go = threading.Event()
+
+  def connect():
+    go.wait()
+    return db.connect()
+
+  queue = writebehind.WriteBehind(connect)
+  sink = statussink.RDSStatusSink(db.connect, queue)
+
+  sink.progress("warmup.pdf", "processing - starting")
+  sink.progress("a.pdf", "processing - page 1 of 2 completed")
+  queue.submit("b.pdf", "UPDATE nosuchtable SET status = %s;", ["processing"])
+  sink.progress("a.pdf", "processing - page 2 of 2 completed")
+  go.set()
+
+  results = {}
+
+  def finish(key):
+    try:
+      sink.flush(key)
+      results[key] = None
+    except Exception as err:
+      results[key] = err
+
+  threads = [threading.Thread(target=finish, args=(key,)) for key in ["a.pdf", "b.pdf"]]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  assert results["a.pdf"] is None
+  assert results["b.pdf"] is not None
+  assert job_status(db, "a.pdf") == "processing - page 2 of 2 completed"
+
+  # reported once:
+  sink.flush("b.pdf")
+  assert queue.metrics()['errors'] == 1
+
+
+def test_writes_of_a_key_stay_in_order(db):
+  add_job(db, 1, "a.pdf")
+
+  queue = writebehind.WriteBehind(db.connect, batch_size=3)
+  sql = "UPDATE jobs SET status = %s WHERE datafilekey = %s;"
+  for i in range(20):
+    queue.submit("a.pdf", sql, [f"processing - page {i + 1} of 20 completed", "a.pdf"], coalesce=True)
+  queue.flush("a.pdf")
+
+  assert job_status(db, "a.pdf") == "processing - page 20 of 20 completed"
+  metrics = queue.metrics()
+  assert metrics['written'] + metrics['coalesced'] == 20
+  assert metrics['depth'] == 0
+
+
+def test_flush_without_key_raises_any_error(db):
+  queue = writebehind.WriteBehind(db.connect)
+  queue.submit("b.pdf", "UPDATE nosuchtable SET status = %s;", ["processing"])
+
+  with pytest.raises(Exception):
+    queue.flush()
+  queue.flush()
+
+
+def test_flush_does_not_wait_for_other_keys(db):
+  add_job(db, 1, "a.pdf")
+  add_job(db, 2, "b.pdf")
+
+  #
+  # a slow database, and another job that keeps the queue full:
+  #
+  db.latency_secs = 0.002
+  queue = writebehind.WriteBehind(db.connect, maxsize=100, batch_size=20)
+
+  stop = threading.Event()
+
+  def produce():
+    i = 0
+    while not stop.is_set():
+      i += 1
+      queue.submit("b.pdf", "UPDATE jobs SET status = %s WHERE datafilekey = %s;",
+                   [f"processing - page {i} completed", "b.pdf"])
+
+  producer = threading.Thread(target=produce, daemon=True)
+  producer.start()
+  try:
+    time.sleep(0.05)
+    queue.submit("a.pdf", "UPDATE jobs SET status = %s WHERE datafilekey = %s;", ["completed", "a.pdf"])
+
+    flusher = threading.Thread(target=queue.flush, args=("a.pdf",), daemon=True)
+    flusher.start()
+    flusher.join(timeout=5)
+
+    assert not flusher.is_alive()
+    assert job_status(db, "a.pdf") == "completed"
+    assert queue.depth() > 0
+  finally:
+    stop.set()
+    producer.join()
+    queue.flush()
@@ -0,0 +1,212 @@
+#
+# writebehind.py
+#
+# Asynchronous write-behind of database actions on top of datatier.
+# Callers submit action queries into a bounded queue and carry on;
+# a background thread with its own DB connection executes them in
+# batches, one transaction (and one commit) per batch. CPU-bound
+# page processing then overlaps with database round trips.
+#
+# Actions are executed in the order they were submitted, so the
+# writes for any one key (e.g. a job's datafilekey) are delivered
+# in order. An action submitted with coalesce=True may be dropped
+# if a later action with the same key and SQL is in the same batch
+# and nothing else for that key comes in between; progress updates
+# only need the latest one.
+#
+# flush(key) blocks until the key's actions submitted so far are
+# written (whatever other keys keep submitting meanwhile), and
+# raises the first error of that key's actions since its previous
+# flush; call it at the end of a job, and before any
+# synchronous write that must come after the queued ones. A batch
+# whose transaction fails is retried one key at a time, so a bad
+# write of one job neither loses nor fails the writes of the other
+# jobs in the same batch.
+#
+
+import datatier
+import queue
+import threading
+import time
+
+
+class WriteBehind:
+
+  def __init__(self, connect_db, maxsize=1000, batch_size=50):
+    self.connect_db = connect_db
+    self.batch_size = batch_size
+    self._queue = queue.Queue(maxsize=maxsize)
+    self._lock = threading.Lock()
+    self._errors = {}      # key -> first error since its flush
+    self._pending = {}     # key -> actions submitted, not yet executed
+    self._executed = threading.Condition(self._lock)
+    self._dbConn = None
+
+    #
+    # metrics:
+    #
+    self.submitted = 0
+    self.written = 0
+    self.coalesced = 0
+    self.batches = 0
+    self.errors = 0
+    self.max_depth = 0
+    self.write_secs = 0.0
+    self.max_write_secs = 0.0
+    self.delay_secs = 0.0
+
+    self._thread = threading.Thread(target=self._run, name="writebehind", daemon=True)
+    self._thread.start()
+
+  def submit(self, key, sql, parameters=[], coalesce=False):
+    """
+    Queues an action query; blocks while the queue is full
+
+    Parameters
+    ----------
+    key: what the action is about (writes per key stay in order),
+    sql: the SQL ACTION query (can be parameterized with %s),
+    parameters: list of values if parameterized,
+    coalesce: True if the action can be dropped in favor of a
+      later one with the same key and sql
+    """
+    with self._lock:
+      self._pending[key] = self._pending.get(key, 0) + 1
+
+    self._queue.put((key, sql, parameters, coalesce, time.perf_counter()))
+
+    with self._lock:
+      self.submitted += 1
+      self.max_depth = max(self.max_depth, self._queue.qsize())
+
+  def flush(self, key=None):
+    """
+    Waits until every action submitted for the key (every action,
+    if key is None) has been executed, then raises the first error
+    of the key's actions since its last flush (of any key's if key
+    is None).
+    """
+    if key is None:
+      self._queue.join()
+
+    with self._lock:
+      while key is not None and self._pending.get(key, 0) > 0:
+        self._executed.wait()
+
+      if key is None:
+        errors = list(self._errors.values())
+        self._errors.clear()
+      else:
+        errors = [self._errors.pop(key)] if key in self._errors else []
+
+    if len(errors) > 0:
+      raise errors[0]
+
+  def depth(self):
+    """
+    Returns the number of actions waiting in the queue.
+    """
+    return self._queue.qsize()
+
+  def metrics(self):
+    """
+    Returns the queue depth and write latency metrics as a dict.
+    """
+    with self._lock:
+      return {
+        'depth': self._queue.qsize(),
+        'max_depth': self.max_depth,
+        'submitted': self.submitted,
+        'written': self.written,
+        'coalesced': self.coalesced,
+        'batches': self.batches,
+        'errors': self.errors,
+        'avg_write_ms': 1000 * self.write_secs / self.batches if self.batches > 0 else 0.0,
+        'max_write_ms': 1000 * self.max_write_secs,
+        'avg_delay_ms': 1000 * self.delay_secs / self.written if self.written > 0 else 0.0
+      }
+
+  @staticmethod
+  def _coalesce(batch):
+    #
+    # walking backwards, drop a coalescable action if a later one
+    # for the same key and sql is kept, with no other action for
+    # that key in between:
+    #
+    kept = []
+    latest = {}
+    for item in reversed(batch):
+      (key, sql, parameters, coalesce, submitted) = item
+      if coalesce and latest.get(key) == sql:
+        continue
+      latest[key] = sql if coalesce else None
+      kept.append(item)
+    kept.reverse()
+    return kept
+
+  def _execute(self, actions):
+    """
+    Executes actions in one transaction; on an error the connection
+    is dropped (the next call opens a new one) and the error raised.
+    """
+    try:
+      if self._dbConn is None:
+        self._dbConn = self.connect_db()
+      datatier.perform_actions(self._dbConn, [(sql, parameters) for (_, sql, parameters, _, _) in actions])
+    except Exception:
+      if self._dbConn is not None:
+        try:
+          self._dbConn.close()
+        except Exception:
+          pass
+      self._dbConn = None
+      raise
+
+  def _run(self):
+    while True:
+      batch = [self._queue.get()]
+      while len(batch) < self.batch_size:
+        try:
+          batch.append(self._queue.get_nowait())
+        except queue.Empty:
+          break
+
+      actions = self._coalesce(batch)
+
+      start = time.perf_counter()
+      failed = {}
+      try:
+        self._execute(actions)
+      except Exception:
+        #
+        # one transaction per key, so only the keys whose own
+        # actions fail get the error:
+        #
+        for key in dict.fromkeys(key for (key, _, _, _, _) in actions):
+          try:
+            self._execute([action for action in actions if action[0] == key])
+          except Exception as err:
+            failed[key] = err
+      done = time.perf_counter()
+
+      written = [action for action in actions if action[0] not in failed]
+
+      with self._lock:
+        self.batches += 1
+        self.write_secs += done - start
+        self.max_write_secs = max(self.max_write_secs, done - start)
+        self.written += len(written)
+        self.coalesced += len(batch) - len(actions)
+        self.delay_secs += sum(done - submitted for (_, _, _, _, submitted) in written)
+        self.errors += len(failed)
+        for (key, err) in failed.items():
+          self._errors.setdefault(key, err)
+
+        for (key, _, _, _, _) in batch:
+          self._pending[key] -= 1
+          if self._pending[key] == 0:
+            del self._pending[key]
+        self._executed.notify_all()
+
+      for _ in batch:
+        self._queue.task_done()